@@ -0,0 +1,8 @@
+"""定时任务后端离线基准测试
+
+使用fake_hass中的FakeHass代替AppDaemon的hass.Hass，在不连接Home Assistant的情况下
+测量TimerBackend创建、列表、恢复、取消和执行任务的吞吐量与延迟。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks --sizes 1000 10000 100000 --output results.json
+"""
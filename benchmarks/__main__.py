@@ -0,0 +1,5 @@
+import sys
+
+from .bench_timer_backend import main
+
+sys.exit(main())
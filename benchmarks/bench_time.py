@@ -0,0 +1,194 @@
+"""时间换算微基准测试
+
+比较之前基于pytz逐次换算的时间辅助函数与LocalClock（按天缓存UTC偏移）：
+    local_now        当前本地时间
+    parse_local_time 本地日期和时刻 → epoch秒
+    local_date       epoch秒 → 本地日期
+    datetime_to_iso  epoch秒 → ISO字符串（UTC）
+    iso_to_datetime  ISO字符串 → epoch秒
+    next_execution   每日规则的下次执行时间
+测量的时刻均匀分布在两年内，包含夏令时切换日。测量前先验证两种实现结果一致
+（包括切换日每30分钟的本地时刻，覆盖跳过和重复的时刻）。结果以JSON输出。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_time --time-zone America/New_York --count 100000
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+from .bench_timer_backend import load_backend_module, summarize
+
+
+def legacy_localize(tz, naive: datetime) -> datetime:
+    """之前的本地时间换算（pytz的localize默认is_dst=False：重复的时刻取标准时间）"""
+    return tz.localize(naive)
+
+
+def transition_days(tz, start: int, end: int) -> list:
+    """start和end之间UTC偏移发生变化的本地日期"""
+    days = []
+    day = datetime.fromtimestamp(start, tz).date()
+    last = datetime.fromtimestamp(end, tz).date()
+    while day <= last:
+        offsets = {
+            legacy_localize(tz, datetime(day.year, day.month, day.day, hour)).utcoffset()
+            for hour in (0, 12)
+        }
+        following = day + timedelta(days=1)
+        offsets.add(legacy_localize(tz, datetime(following.year, following.month, following.day)).utcoffset())
+        if len(offsets) > 1:
+            days.append(day)
+        day = following
+    return days
+
+
+def legacy_cases(tz) -> dict:
+    """之前的时间辅助函数（每次换算都调用pytz）"""
+
+    def local_now(ts):
+        return datetime.now(pytz.UTC).astimezone(tz)
+
+    def parse_local_time(ts):
+        local = datetime.fromtimestamp(ts, tz)
+        return int(legacy_localize(tz, datetime(local.year, local.month, local.day, 7, 30, 0)).timestamp())
+
+    def local_date(ts):
+        return datetime.fromtimestamp(ts, pytz.UTC).astimezone(tz).date()
+
+    def datetime_to_iso(ts):
+        return datetime.fromtimestamp(ts, pytz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def iso_to_datetime(value):
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+    def next_execution(ts):
+        after = datetime.fromtimestamp(ts, tz)
+        day = after.date()
+        for _ in range(2):
+            candidate = legacy_localize(tz, datetime(day.year, day.month, day.day, 7, 30, 0))
+            if candidate > after:
+                return candidate
+            day += timedelta(days=1)
+        return None
+
+    return {
+        "local_now": local_now,
+        "parse_local_time": parse_local_time,
+        "local_date": local_date,
+        "datetime_to_iso": datetime_to_iso,
+        "iso_to_datetime": iso_to_datetime,
+        "next_execution": next_execution,
+    }
+
+
+def clock_cases(module, clock) -> dict:
+    """LocalClock实现"""
+    rule = module.RecurrenceRule(module.RepeatType.DAILY, "07:30:00")
+
+    def parse_local_time(ts):
+        return clock.local_to_epoch(clock.local_date(ts), 7, 30, 0)
+
+    return {
+        "local_now": lambda ts: clock.now(),
+        "parse_local_time": parse_local_time,
+        "local_date": clock.local_date,
+        "datetime_to_iso": module.epoch_to_iso,
+        "iso_to_datetime": lambda value: module.iso_to_epoch(value, clock),
+        "next_execution": lambda ts: rule.next_after(ts, clock),
+    }
+
+
+def measure(name: str, implementation: str, function, inputs: list) -> dict:
+    start = time.perf_counter()
+    for value in inputs:
+        function(value)
+    result = summarize(name, len(inputs), time.perf_counter() - start, count=len(inputs))
+    result["implementation"] = implementation
+    return result
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_time", description="时间换算微基准测试")
+    parser.add_argument("--time-zone", default="America/New_York", help="时区（默认选择有夏令时的时区）")
+    parser.add_argument("--backend", choices=("pytz", "zoneinfo"), default="pytz", help="LocalClock使用的时区库")
+    parser.add_argument("--count", type=int, default=100000, help="每项的换算次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机时刻的种子")
+    parser.add_argument("--output", help="结果JSON文件（默认输出到标准输出）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    module = load_backend_module()
+
+    tz = pytz.timezone(options.time_zone)
+    if options.backend == "zoneinfo":
+        if module.ZoneInfo is None:
+            print("zoneinfo is not available", file=sys.stderr)
+            return 2
+        clock = module.LocalClock(module.ZoneInfo(options.time_zone), options.time_zone)
+    else:
+        clock = module.LocalClock(tz, options.time_zone)
+
+    # 两年内的随机时刻（先验证两种实现结果一致）
+    rng = random.Random(options.seed)
+    base = int(time.time())
+    timestamps = [base + rng.randint(-366 * 86400, 366 * 86400) for _ in range(options.count)]
+    iso_strings = [module.epoch_to_iso(ts) for ts in timestamps]
+
+    legacy = legacy_cases(tz)
+    current = clock_cases(module, clock)
+    for ts in timestamps[:1000]:
+        assert current["parse_local_time"](ts) == legacy["parse_local_time"](ts), ts
+        assert current["local_date"](ts) == legacy["local_date"](ts), ts
+        assert current["datetime_to_iso"](ts) == legacy["datetime_to_iso"](ts), ts
+        assert current["next_execution"](ts) == int(legacy["next_execution"](ts).timestamp()), ts
+    # 切换日每30分钟的本地时刻（夏令时跳过和重复的时刻）
+    switch_days = transition_days(tz, base - 366 * 86400, base + 366 * 86400)
+    for day in switch_days:
+        for minutes in range(0, 24 * 60, 30):
+            hour, minute = divmod(minutes, 60)
+            expected = int(legacy_localize(tz, datetime(day.year, day.month, day.day, hour, minute)).timestamp())
+            assert clock.local_to_epoch(day, hour, minute, 0) == expected, (day, hour, minute)
+
+    results = []
+    for name in legacy:
+        inputs = iso_strings if name == "iso_to_datetime" else timestamps
+        before = measure(name, "legacy", legacy[name], inputs)
+        after = measure(name, "local_clock", current[name], inputs)
+        after["speedup"] = round(before["seconds"] / after["seconds"], 2) if after["seconds"] > 0 else None
+        results.extend([before, after])
+
+    report = {
+        "benchmark": "time_conversion",
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "time_zone": options.time_zone,
+            "backend": options.backend,
+            "count": options.count,
+            "transition_days_checked": len(switch_days),
+            "cached_days": len(clock.days),
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""TimerBackend吞吐量与延迟基准测试
+
+每个规模N依次测量：
+    create          创建N个定时器（每个实体一个）
+    persist_flush   将合并写入的变更写入存储
+    list_cold       列表缓存失效后获取活跃任务列表
+    list_cached     命中列表缓存时获取活跃任务列表
+    cancel          取消一半定时器
+    terminate       停止应用（写入待保存的变更并压缩存储）
+    restore         新实例从存储恢复（只解析活跃任务）
+    restore_history 首次查询时加载延迟的历史任务
+    execute         剩余定时器同时到期，一次唤醒全部执行
+结果以JSON输出，可通过--compare与之前的结果比较吞吐量。
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from . import fake_hass
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_backend_module():
+    """使用FakeHass导入timer_backend"""
+    fake_hass.install()
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import timer_backend
+    return timer_backend
+
+
+def summarize(operation: str, size: int, seconds: float, latencies: list = None, count: int = None) -> dict:
+    """汇总一项测量结果（延迟单位为毫秒）"""
+    count = len(latencies) if count is None else count
+    result = {
+        "size": size,
+        "operation": operation,
+        "count": count,
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(count / seconds, 2) if seconds > 0 else None,
+    }
+    if latencies:
+        ordered = sorted(latencies)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 4)
+
+        result["latency_ms"] = {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 4),
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(ordered[-1] * 1000, 4),
+        }
+    return result
+
+
+class BackendBench:
+    """在临时目录中运行一个规模的全部测量"""
+
+    def __init__(self, module, size: int, options: argparse.Namespace):
+        self.module = module
+        self.size = size
+        self.options = options
+        self.results = []
+        self.workdir = tempfile.TemporaryDirectory(prefix="timer_backend_bench_")
+        self.entity_ids = [f"light.bench_{i}" for i in range(size)]
+        self.states = {
+            entity_id: {"state": "on", "attributes": {"friendly_name": f"Bench Light {i}"}}
+            for i, entity_id in enumerate(self.entity_ids)
+        }
+
+    def make_backend(self):
+        """创建TimerBackend实例并执行初始化（不自动执行恢复）"""
+        args = {
+            "persist_file": os.path.join(self.workdir.name, "tasks.json"),
+            "sqlite_file": os.path.join(self.workdir.name, "tasks.db"),
+            "task_store": self.options.store,
+            "persist_mode": self.options.persist_mode,
+            "persist_window": self.options.persist_window,
+            "history_max_count": self.size * 2,
+            "delta_events": self.options.delta_events,
+            # 列表测量的是每次请求的计算耗时，关闭请求合并
+            "list_coalesce_window": 0,
+            "list_min_interval": 0,
+        }
+        backend = self.module.TimerBackend(args=args, states=self.states)
+        backend.verbose = self.options.verbose
+        backend.initialize()
+        return backend
+
+    def timed_events(self, backend, events: list) -> list:
+        """逐个发送前端事件，返回每个事件的处理耗时"""
+        latencies = []
+        for data in events:
+            start = time.perf_counter()
+            backend.handle_frontend_event(backend.event_name, data, {})
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def record(self, result: dict):
+        self.results.append(result)
+        if self.options.verbose:
+            print(json.dumps(result), file=sys.stderr)
+
+    def run(self) -> list:
+        try:
+            self.run_phases()
+        finally:
+            self.workdir.cleanup()
+        return self.results
+
+    def run_phases(self):
+        size = self.size
+        backend = self.make_backend()
+        backend.run_due()  # 空存储上的恢复
+
+        # 创建
+        events = [
+            {"action": "create_timer", "entity_id": entity_id, "duration": "02:00:00", "user_id": "bench"}
+            for entity_id in self.entity_ids
+        ]
+        start = time.perf_counter()
+        latencies = self.timed_events(backend, events)
+        self.record(summarize("create", size, time.perf_counter() - start, latencies))
+
+        start = time.perf_counter()
+        backend.persist_writer.flush()
+        self.record(summarize("persist_flush", size, time.perf_counter() - start, count=size))
+
+        # 列表
+        list_event = {"action": "get_all_timers", "user_id": "bench"}
+        latencies = []
+        for _ in range(self.options.list_repeat):
+            backend.invalidate_list_cache()
+            latencies.extend(self.timed_events(backend, [list_event]))
+        self.record(summarize("list_cold", size, sum(latencies), latencies))
+        latencies = self.timed_events(backend, [list_event] * self.options.list_repeat)
+        self.record(summarize("list_cached", size, sum(latencies), latencies))
+
+        # 取消一半
+        cancel_ids = [backend.entity_timers[entity_id] for entity_id in self.entity_ids[: size // 2]]
+        events = [{"action": "cancel_timer", "timer_id": timer_id} for timer_id in cancel_ids]
+        start = time.perf_counter()
+        latencies = self.timed_events(backend, events)
+        self.record(summarize("cancel", size, time.perf_counter() - start, latencies))
+
+        # 停止（写入待保存的变更并压缩存储），模拟重启
+        start = time.perf_counter()
+        backend.terminate()
+        self.record(summarize("terminate", size, time.perf_counter() - start, count=size))
+        backend.loop.close()
+
+        # 恢复
+        restored = self.make_backend()
+        start = time.perf_counter()
+        restored.restore_tasks({})
+        self.record(summarize("restore", size, time.perf_counter() - start, count=len(restored.tasks)))
+
+        start = time.perf_counter()
+        restored.ensure_history_loaded()
+        self.record(summarize("restore_history", size, time.perf_counter() - start, count=len(restored.history)))
+
+        # 执行：剩余定时器全部改为现在到期，由一次唤醒执行
+        now = time.time()
+        for task_id, task in list(restored.tasks.items()):
+            restored.schedule_task(task_id, now, "climate" if task.is_climate else "timer", arm=False)
+        pending = len(restored.tasks)
+        restored.service_calls.clear()
+        start = time.perf_counter()
+        restored.run_callback(restored.run_due_tasks, {})
+        elapsed = time.perf_counter() - start
+        latencies = []
+        for service, data, called_at in restored.service_calls:
+            entity_ids = data.get("entity_id")
+            count = len(entity_ids) if isinstance(entity_ids, list) else 1
+            latencies.extend([called_at - start] * count)
+        self.record(summarize("execute", size, elapsed, latencies, count=pending))
+        restored.terminate()
+        restored.loop.close()
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results: list, baseline: dict, threshold: float) -> list:
+    """与基准结果比较，返回吞吐量下降超过threshold的项"""
+    previous = {
+        (item["size"], item["operation"]): item
+        for item in baseline.get("results", [])
+        if item.get("ops_per_sec")
+    }
+    regressions = []
+    for item in results:
+        old = previous.get((item["size"], item["operation"]))
+        if old is None or not item.get("ops_per_sec"):
+            continue
+        change = item["ops_per_sec"] / old["ops_per_sec"] - 1
+        if change < -threshold:
+            regressions.append({
+                "size": item["size"],
+                "operation": item["operation"],
+                "baseline_ops_per_sec": old["ops_per_sec"],
+                "ops_per_sec": item["ops_per_sec"],
+                "change": round(change, 4),
+            })
+    return regressions
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="TimerBackend离线基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="任务数量")
+    parser.add_argument("--store", choices=("json", "sqlite"), default="json", help="存储后端")
+    parser.add_argument("--persist-mode", choices=("journal", "snapshot"), default="journal", help="JSON存储模式")
+    parser.add_argument("--persist-window", type=float, default=0.25, help="合并写入窗口（秒）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个规模的运行次数（每项取最快的一次）")
+    parser.add_argument("--list-repeat", type=int, default=20, help="列表测量的重复次数")
+    parser.add_argument("--no-delta-events", dest="delta_events", action="store_false", help="关闭增量事件")
+    parser.add_argument("--output", help="结果JSON文件（默认输出到标准输出）")
+    parser.add_argument("--compare", help="与之前的结果JSON比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="吞吐量下降超过该比例视为退化")
+    parser.add_argument("--verbose", action="store_true", help="输出应用日志和每项结果")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    module = load_backend_module()
+
+    results = []
+    for size in options.sizes:
+        # 重复运行时每项取耗时最短的一次，减少噪声
+        best = {}
+        for _ in range(max(1, options.repeat)):
+            for item in BackendBench(module, size, options).run():
+                previous = best.get(item["operation"])
+                if previous is None or item["seconds"] < previous["seconds"]:
+                    best[item["operation"]] = item
+        results.extend(best.values())
+
+    report = {
+        "benchmark": "timer_backend",
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "store": options.store,
+            "persist_mode": options.persist_mode,
+            "persist_window": options.persist_window,
+            "repeat": options.repeat,
+            "list_repeat": options.list_repeat,
+            "delta_events": options.delta_events,
+        },
+        "results": results,
+    }
+
+    exit_code = 0
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        report["baseline_revision"] = baseline.get("revision")
+        report["regressions"] = compare_results(results, baseline, options.threshold)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return exit_code
@@ -0,0 +1,179 @@
+"""AppDaemon hass.Hass的本地替代实现
+
+只实现TimerBackend用到的接口：定时回调（run_in/run_daily/run_every/cancel_timer）、
+事件（fire_event/listen_event）、状态（listen_state/get_state/set_state）、
+服务调用（call_service）和日志（log）。定时回调不会自动触发，由run_due按时间执行。
+"""
+import asyncio
+import heapq
+import itertools
+import sys
+import time
+import types
+from collections import deque
+from datetime import datetime, timedelta
+
+
+class FakeHass:
+    """hass.Hass的替代类（TimerBackend继承此类后即可离线运行）"""
+
+    def __init__(self, args: dict = None, states: dict = None, event_limit: int = 100):
+        self.args = args or {}
+        self.states = states if states is not None else {}  # entity_id → {"state", "attributes"}
+        self.loop = asyncio.new_event_loop()
+
+        self.handles = {}  # 句柄 → (执行时间, 回调, kwargs, 重复间隔)
+        self.timer_heap = []
+        self.handle_ids = itertools.count()
+        self.event_listeners = []
+        self.state_listeners = []
+
+        # 只保留最近的事件，避免大规模测试占用内存
+        self.events = deque(maxlen=event_limit)
+        self.event_count = 0
+        self.service_calls = []  # (服务, 数据, perf_counter时间)
+        self.log_counts = {}
+        self.verbose = False
+
+    # ---- 定时回调 ----
+
+    def _add_handle(self, callback, when: float, interval: float, kwargs: dict) -> str:
+        handle = f"handle_{next(self.handle_ids)}"
+        self.handles[handle] = (when, callback, kwargs, interval)
+        heapq.heappush(self.timer_heap, (when, handle))
+        return handle
+
+    def run_in(self, callback, delay: float, **kwargs) -> str:
+        return self._add_handle(callback, time.time() + float(delay), None, kwargs)
+
+    def run_daily(self, callback, start: str, **kwargs) -> str:
+        hour, minute, second = map(int, start.split(":"))
+        now = datetime.now()
+        first = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+        if first <= now:
+            first += timedelta(days=1)
+        return self._add_handle(callback, first.timestamp(), 86400, kwargs)
+
+    def run_every(self, callback, start, interval: float, **kwargs) -> str:
+        if isinstance(start, str) and start.startswith("now"):
+            offset = float(start[4:]) if start.startswith("now+") else 0
+            first = time.time() + offset
+        elif isinstance(start, datetime):
+            first = start.timestamp()
+        else:
+            first = float(start)
+        return self._add_handle(callback, first, float(interval), kwargs)
+
+    def cancel_timer(self, handle) -> bool:
+        return self.handles.pop(handle, None) is not None
+
+    def cancel_timer_handle(self, handle) -> bool:
+        return self.cancel_timer(handle)
+
+    def pending_handles(self) -> int:
+        return len(self.handles)
+
+    def run_due(self, now: float = None) -> int:
+        """执行到期（执行时间 <= now）的定时回调，返回执行的回调数"""
+        now = time.time() if now is None else now
+        executed = 0
+        while self.timer_heap and self.timer_heap[0][0] <= now:
+            when, handle = heapq.heappop(self.timer_heap)
+            entry = self.handles.get(handle)
+            if entry is None or entry[0] != when:
+                # 已取消或已重新安排
+                continue
+            _, callback, kwargs, interval = entry
+            if interval:
+                next_when = when + interval
+                self.handles[handle] = (next_when, callback, kwargs, interval)
+                heapq.heappush(self.timer_heap, (next_when, handle))
+            else:
+                del self.handles[handle]
+            self.run_callback(callback, kwargs)
+            executed += 1
+        return executed
+
+    def run_callback(self, callback, *args):
+        """执行回调，协程回调在事件循环中运行到结束"""
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            result = self.loop.run_until_complete(result)
+        return result
+
+    # ---- 事件 ----
+
+    def listen_event(self, callback, event: str = None, **kwargs) -> str:
+        self.event_listeners.append((callback, event, kwargs))
+        return f"event_{len(self.event_listeners)}"
+
+    def fire_event(self, event: str, **kwargs):
+        self.event_count += 1
+        self.events.append((event, kwargs))
+        for callback, name, listener_kwargs in list(self.event_listeners):
+            if name is None or name == event:
+                self.run_callback(callback, event, kwargs, listener_kwargs)
+
+    # ---- 状态 ----
+
+    def listen_state(self, callback, entity: str = None, **kwargs) -> str:
+        self.state_listeners.append((callback, entity, kwargs))
+        return f"state_{len(self.state_listeners)}"
+
+    def _read_state(self, entity_id: str, attribute: str = None):
+        state = self.states.get(entity_id)
+        if state is None:
+            return None
+        if attribute == "all":
+            return state
+        if attribute:
+            return state.get("attributes", {}).get(attribute)
+        return state.get("state")
+
+    def get_state(self, entity_id: str = None, attribute: str = None, **kwargs):
+        """读取状态；与AppDaemon一致，在协程中调用时返回需要await的对象"""
+        value = self._read_state(entity_id, attribute)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return value
+        future = loop.create_future()
+        future.set_result(value)
+        return future
+
+    def set_state(self, entity_id: str, state=None, attributes: dict = None, **kwargs):
+        """设置状态并通知监听该实体或其所在域的回调"""
+        old = self.states.get(entity_id)
+        new = {"state": state, "attributes": dict(attributes or {})}
+        self.states[entity_id] = new
+        for callback, entity, listener_kwargs in list(self.state_listeners):
+            if entity is None or entity == entity_id or entity == entity_id.split(".")[0]:
+                if listener_kwargs.get("attribute") == "all":
+                    self.run_callback(callback, entity_id, "all", old, new, listener_kwargs)
+                else:
+                    old_state = old.get("state") if old else None
+                    self.run_callback(callback, entity_id, "state", old_state, state, listener_kwargs)
+        return new
+
+    # ---- 服务与日志 ----
+
+    async def call_service(self, service: str, **kwargs):
+        self.service_calls.append((service, kwargs, time.perf_counter()))
+        return None
+
+    def log(self, msg: str, level: str = "INFO", **kwargs):
+        self.log_counts[level] = self.log_counts.get(level, 0) + 1
+        if self.verbose or level in ("ERROR", "CRITICAL"):
+            print(f"[{level}] {msg}", file=sys.stderr)
+
+
+def install():
+    """将FakeHass注册为appdaemon.plugins.hass.hassapi.Hass（需在导入timer_backend之前调用）"""
+    names = ("appdaemon", "appdaemon.plugins", "appdaemon.plugins.hass", "appdaemon.plugins.hass.hassapi")
+    modules = [types.ModuleType(name) for name in names]
+    for parent, child, name in zip(modules, modules[1:], names[1:]):
+        setattr(parent, name.rsplit(".", 1)[1], child)
+    modules[-1].Hass = FakeHass
+    for name, module in zip(names, modules):
+        sys.modules[name] = module
+    return FakeHass
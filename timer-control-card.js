@@ -62,6 +62,12 @@ class TimerControlCard extends LitElement {
     this._pickerDefaultDuration = '00:30:00'  // 新增：时间选择器的默认时长
     this._activeSchedulesList = []  // 新增：周期任务列表
     this._scheduleUpdateInterval = null  // 新增：周期任务倒计时更新定时器
+    this._revision = null  // 新增：已同步的后端版本号
+    this._timersSnapshot = null  // 新增：最近一次完整列表（用于应用增量变更）
+    this._schedulePreview = []  // 新增：周期任务接下来的执行时间预览
+    this._schedulePreviewKey = null  // 新增：当前预览对应的规则参数
+    this._schedulePreviewTimeout = null  // 新增：预览请求防抖定时器
+    this._stateEntityUpdated = null  // 新增：已应用的状态实体更新时间
 
     // 绑定事件处理函数
     this.handleBackendResponse = this.handleResponse.bind(this);
@@ -189,6 +195,12 @@ class TimerControlCard extends LitElement {
       this._syncTimeout = null;
     }
     
+    // 清除预览请求定时器
+    if (this._schedulePreviewTimeout) {
+      clearTimeout(this._schedulePreviewTimeout);
+      this._schedulePreviewTimeout = null;
+    }
+    
     // 清除滚动超时定时器
     if (this._scrollTimeout) {
       clearTimeout(this._scrollTimeout);
@@ -230,13 +242,63 @@ class TimerControlCard extends LitElement {
     }
   }
 
-  // 新增：安全刷新定时器
+  // 新增：从后端发布的状态实体读取任务列表（配置了state_entity时不需要请求后端）
+  readStateEntity() {
+    const entityId = this.config && this.config.state_entity;
+    const stateObj = entityId && this.hass && this.hass.states ? this.hass.states[entityId] : null;
+    if (!stateObj || !stateObj.attributes || !Array.isArray(stateObj.attributes.timers)) {
+      return false;
+    }
+
+    if (stateObj.last_updated !== this._stateEntityUpdated) {
+      this._stateEntityUpdated = stateObj.last_updated;
+      // 状态实体不发布remaining_seconds（避免每秒变化），按end_time补齐
+      const timers = stateObj.attributes.timers.map(timer => ({
+        ...timer,
+        remaining_seconds: this.calculateTimerRemaining(timer)
+      }));
+      this.handleResponse({
+        data: {
+          action: 'timers_list',
+          timers,
+          schedules: stateObj.attributes.schedules || [],
+          timer_count: stateObj.attributes.timer_count,
+          schedule_count: stateObj.attributes.schedule_count,
+          revision: stateObj.attributes.revision ?? null
+        }
+      });
+    } else {
+      // 状态未变化，列表已是最新
+      this._retryCount = 0;
+      this._backendConnected = true;
+      this._lastSyncFailed = false;
+      if (this._syncTimeout) {
+        clearTimeout(this._syncTimeout);
+        this._syncTimeout = null;
+      }
+    }
+    return true;
+  }
+
+  // 新增：安全刷新定时器（已有版本号时只请求增量变更）
   async refreshTimersSafe() {
     try {
-      await this.sendEventSafe({
-        action: 'get_all_timers',
-        user_id: 'user'
-      });
+      if (this.readStateEntity()) {
+        return true;
+      }
+
+      if (this._revision !== null) {
+        await this.sendEventSafe({
+          action: 'get_changes_since',
+          revision: this._revision,
+          user_id: 'user'
+        });
+      } else {
+        await this.sendEventSafe({
+          action: 'get_all_timers',
+          user_id: 'user'
+        });
+      }
       
       return true;
       
@@ -411,6 +473,11 @@ class TimerControlCard extends LitElement {
       return;
     }
     
+    // 状态实体可用时直接读取，无需等待后端响应
+    if (this.readStateEntity()) {
+      return;
+    }
+    
     this._retryCount++;
     // 移除正常状态的debug信息更新
     
@@ -563,6 +630,16 @@ class TimerControlCard extends LitElement {
       }, 10);
     }
     
+    // 周期定时设置变化时请求执行时间预览
+    if (this._showSettings && this._timerMode === 'recurring') {
+      this.requestSchedulePreview();
+    }
+    
+    // 配置了状态实体时，hass更新即包含最新的任务列表
+    if (changedProperties.has('hass') && this.hass) {
+      this.readStateEntity();
+    }
+    
     // 当hass对象变为可用时，立即同步
     if (changedProperties.has('hass') && this.hass) {
       // 移除正常状态的debug信息更新
@@ -645,6 +722,12 @@ class TimerControlCard extends LitElement {
           this.refreshTimersSafe();
         }
       }
+
+      // 新增：任务列表中的定时器剩余时间按end_time计算，没有当前实体倒计时时也需要每秒刷新
+      if (!(this._timerInfo && this._remainingSeconds > 0) &&
+          this._activeTimersList.some(task => !task.is_schedule)) {
+        this.requestUpdate();
+      }
     }, 1000);
   }
 
@@ -2826,7 +2909,7 @@ class TimerControlCard extends LitElement {
                     <div class="task-progress-bar schedule-progress" style="width: 100%;"></div>
                     <div class="task-content">
                       <div class="task-number schedule-number">${(index % this._activeTimersList.length) + 1}</div>
-                      <div class="task-entity-name">${this.getEntityFriendlyName(task.entity_id)}</div>
+                      <div class="task-entity-name">${this.getTaskDisplayName(task)}</div>
                       <div class="task-time schedule-time">
                         <div class="schedule-countdown">${this.formatTaskTime(countdownSeconds)}</div>
                       </div>
@@ -2836,7 +2919,7 @@ class TimerControlCard extends LitElement {
               } else {
                 // 普通定时器显示
                 const totalSeconds = task.duration ? this.durationToSeconds(task.duration) : 1800; // 默认30分钟
-                const remainingSeconds = task.remaining_seconds || 0;
+                const remainingSeconds = this.calculateTimerRemaining(task);
                 const progressPercent = totalSeconds > 0 ? (1 - remainingSeconds / totalSeconds) * 100 : 0;
                 const remainingPercent = 100 - progressPercent;
                 
@@ -2847,7 +2930,7 @@ class TimerControlCard extends LitElement {
                     <div class="task-progress-remaining" style="width: ${remainingPercent}%;"></div>
                     <div class="task-content">
                       <div class="task-number">${(index % this._activeTimersList.length) + 1}</div>
-                      <div class="task-entity-name">${this.getEntityFriendlyName(task.entity_id)}</div>
+                      <div class="task-entity-name">${this.getTaskDisplayName(task)}</div>
                       <div class="task-time">${this.formatTaskTime(remainingSeconds)}</div>
                     </div>
                   </div>
@@ -2927,6 +3010,17 @@ class TimerControlCard extends LitElement {
     return `${hours.toString().padStart(2, '0')}:${minutes.toString().padStart(2, '0')}:${secs.toString().padStart(2, '0')}`;
   }
 
+  // 计算定时器的剩余秒数（优先按end_time计算，增量变更和状态实体中的remaining_seconds可能已过时或缺失）
+  calculateTimerRemaining(timer) {
+    if (timer.end_time) {
+      const endTime = new Date(timer.end_time).getTime();
+      if (!isNaN(endTime)) {
+        return Math.floor(Math.max(0, endTime - Date.now()) / 1000);
+      }
+    }
+    return Math.max(0, Math.floor(timer.remaining_seconds || 0));
+  }
+
   // 计算周期任务的倒计时
   calculateScheduleCountdown(schedule) {
     if (!schedule.next_execution) return null;
@@ -3456,6 +3550,13 @@ class TimerControlCard extends LitElement {
                       </div>
                     </div>
                   ` : ''}
+                  
+                  <!-- 接下来的执行时间预览 -->
+                  ${this._schedulePreview.length > 0 ? html`
+                    <div class="schedule-preview" style="margin-top: 10px; text-align: center; font-size: 11px; color: #666;">
+                      接下来: ${this._schedulePreview.map(time => new Date(time).toLocaleString('zh-CN', { month: '2-digit', day: '2-digit', hour: '2-digit', minute: '2-digit' })).join('、')}
+                    </div>
+                  ` : ''}
                 </div>
               ` : html`
                 <!-- 快速时间选择 - 根据模式显示不同值 -->
@@ -3658,6 +3759,12 @@ class TimerControlCard extends LitElement {
       this._lastSyncFailed = false;  // 重置同步失败状态
       
       if (data.action === 'timers_list') {
+        // 保存完整列表和版本号，后续增量变更在此基础上应用
+        this._revision = data.revision ?? null;
+        this._timersSnapshot = {
+          timers: data.timers || [],
+          schedules: data.schedules || []
+        };
 
         // 更新正在执行的任务列表
         this._activeTimersList = data.timers?.filter(t =>
@@ -3770,6 +3877,22 @@ class TimerControlCard extends LitElement {
           // 移除正常状态的debug信息更新
           this.requestUpdate();
         }
+      } else if (data.action === 'timer_added' || data.action === 'timer_updated' || data.action === 'timer_removed') {
+        // 增量变更：版本连续时直接应用，否则请求缺失的变更
+        if (this._revision !== null && this._timersSnapshot) {
+          if (data.revision === this._revision + 1) {
+            this.applyTimerChanges([data], data.revision);
+          } else if (data.revision > this._revision) {
+            this.refreshTimersSafe();
+          }
+        }
+      } else if (data.action === 'timers_changes') {
+        if (this._timersSnapshot && data.since_revision === this._revision) {
+          this.applyTimerChanges(data.changes || [], data.revision);
+        } else {
+          this._revision = null;
+          this.refreshTimersSafe();
+        }
       } else if (data.action === 'timer_created') {
         if (data.entity_id === this.config.entity) {
           // 立即刷新状态
@@ -3795,6 +3918,12 @@ class TimerControlCard extends LitElement {
           this._pendingTimerRestore = false;
           this.requestUpdate();
         }
+      } else if (data.action === 'schedule_preview') {
+        // 只接受与当前设置对应的预览
+        if (data.request_id === this._schedulePreviewKey) {
+          this._schedulePreview = data.occurrences || [];
+          this.requestUpdate();
+        }
       } else if (data.action === 'schedule_created') {
         // 周期任务创建成功，刷新任务列表
         setTimeout(() => {
@@ -3829,6 +3958,35 @@ class TimerControlCard extends LitElement {
     }
   }
 
+  // 新增：将增量变更应用到最近一次完整列表，并按完整列表重新处理
+  applyTimerChanges(changes, revision) {
+    let timers = [...this._timersSnapshot.timers];
+    let schedules = [...this._timersSnapshot.schedules];
+
+    changes.forEach(change => {
+      timers = timers.filter(t => t.timer_id !== change.task_id);
+      schedules = schedules.filter(s => s.schedule_id !== change.task_id);
+      if (change.change !== 'removed') {
+        if (change.is_schedule && change.schedule) {
+          schedules.push(change.schedule);
+        } else if (change.timer) {
+          timers.push(change.timer);
+        }
+      }
+    });
+
+    this.handleResponse({
+      data: {
+        action: 'timers_list',
+        timers,
+        schedules,
+        timer_count: timers.length,
+        schedule_count: schedules.length,
+        revision
+      }
+    });
+  }
+
   openSettings() {
     this._showSettings = true;
   }
@@ -3937,7 +4095,7 @@ class TimerControlCard extends LitElement {
                         <td style="text-align: center; color: #007aff; font-weight: 500;">${index + 1}</td>
                         <td>
                           <div class="entity-info">
-                            <div class="entity-name">${this.getEntityFriendlyName(timer.entity_id)}</div>
+                            <div class="entity-name">${this.getTaskDisplayName(timer)}</div>
                             <div class="entity-id">${timer.entity_id}</div>
                           </div>
                         </td>
@@ -3981,12 +4139,12 @@ class TimerControlCard extends LitElement {
                         <td style="text-align: center; color: #8e8e93; font-weight: 500;">${index + 1}</td>
                         <td>
                           <div class="entity-info">
-                            <div class="entity-name">${this.getEntityFriendlyName(timer.entity_id)}</div>
+                            <div class="entity-name">${this.getTaskDisplayName(timer)}</div>
                             <div class="entity-id">${timer.entity_id}</div>
                           </div>
                         </td>
                         <td style="text-align: center;">
-                          <div class="time-display">${this.formatTime(Math.floor(timer.remaining_seconds) || 0)}</div>
+                          <div class="time-display">${this.formatTime(this.calculateTimerRemaining(timer))}</div>
                           ${timer.end_time ? html`
                             <div style="font-size: 10px; color: #8e8e93; margin-top: 2px;">
                               ${this.formatEndTime(timer.end_time)}
@@ -4222,6 +4380,42 @@ class TimerControlCard extends LitElement {
     this.requestUpdate();
   }
 
+  // 请求周期规则接下来几次的执行时间（参数未变化时不重复请求）
+  requestSchedulePreview() {
+    const weekdayMap = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'];
+    const previewData = {
+      repeat_type: this._recurringInterval,
+      schedule_time: this._duration
+    };
+    if (this._recurringInterval === 'weekly') {
+      previewData.weekdays = this._recurringDays.map(dayIndex => weekdayMap[dayIndex]);
+    } else if (this._recurringInterval === 'monthly') {
+      previewData.month_days = [...this._recurringDays];
+    }
+    
+    const previewKey = JSON.stringify(previewData);
+    if (previewKey === this._schedulePreviewKey) {
+      return;
+    }
+    this._schedulePreviewKey = previewKey;
+    this._schedulePreview = [];
+    
+    clearTimeout(this._schedulePreviewTimeout);
+    // 每周/每月模式没有选择日期时规则无效，不请求预览
+    const needsDays = this._recurringInterval === 'weekly' || this._recurringInterval === 'monthly';
+    if (needsDays && this._recurringDays.length === 0) {
+      return;
+    }
+    this._schedulePreviewTimeout = setTimeout(() => {
+      this.sendEventSafe({
+        action: 'preview_schedule',
+        ...previewData,
+        count: 3,
+        request_id: previewKey
+      });
+    }, 300);
+  }
+
   // 切换周期定时的日期选择
   toggleRecurringDay(dayIndex) {
     const index = this._recurringDays.indexOf(dayIndex);
@@ -4430,9 +4624,8 @@ class TimerControlCard extends LitElement {
       this._selectedEntity = timer.entity_id;
       
       // 如果定时器有剩余时间，将其设置为当前时长
-      if (timer.remaining_seconds && timer.remaining_seconds > 0) {
-        // 确保只处理整数秒数，去掉小数部分
-        const remainingSeconds = Math.floor(timer.remaining_seconds);
+      const remainingSeconds = this.calculateTimerRemaining(timer);
+      if (remainingSeconds > 0) {
         this._duration = this.secondsToDuration(remainingSeconds);
       }
       
@@ -4902,6 +5095,15 @@ class TimerControlCard extends LitElement {
     return entity?.attributes?.friendly_name || entityId;
   }
 
+  // 获取任务显示名称（分组任务显示后端保存的名称和成员数）
+  getTaskDisplayName(task) {
+    if (task && Array.isArray(task.members)) {
+      const name = this.hass?.states?.[task.entity_id] ? this.getEntityFriendlyName(task.entity_id) : task.entity_name;
+      return `${name || task.entity_id} (${task.members.length})`;
+    }
+    return this.getEntityFriendlyName(task?.entity_id);
+  }
+
   // 格式化结束时间
   formatEndTime(endTime) {
     try {
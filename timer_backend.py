@@ -2,12 +2,26 @@ import appdaemon.plugins.hass.hassapi as hass
 import json
 import os
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import asyncio
 import pytz
 from enum import Enum
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+import bisect
 import calendar
+import heapq
+import itertools
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8及以下只能使用pytz
+    ZoneInfo = None
 
 class RepeatType(Enum):
     """重复类型枚举"""
@@ -16,23 +30,1317 @@ class RepeatType(Enum):
     WEEKLY = "weekly"
     MONTHLY = "monthly"
 
+class TaskStatus(Enum):
+    """任务状态枚举"""
+    ACTIVE = "active"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    EXPIRED = "expired"
+    ERROR = "error"
+    FAILED = "failed"
+
+# 结束状态的任务会从活跃存储移入历史存储
+TERMINAL_STATUSES = frozenset((
+    TaskStatus.COMPLETED, TaskStatus.CANCELLED, TaskStatus.EXPIRED, TaskStatus.ERROR, TaskStatus.FAILED
+))
+
+# 1970-01-01的公历序数，epoch天数与date序数互相换算时使用
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 日期部分的缓存（epoch天数 → "YYYY-MM-DDT"），同一天的时间只需拼接时分秒
+_iso_day_prefixes: Dict[int, str] = {}
+ISO_DAY_CACHE_SIZE = 4096
+
+def epoch_to_iso(ts: Optional[int]) -> Optional[str]:
+    """将epoch秒转换为ISO格式字符串（UTC时间，带Z后缀）"""
+    if ts is None:
+        return None
+    day, seconds = divmod(int(ts), 86400)
+    prefix = _iso_day_prefixes.get(day)
+    if prefix is None:
+        if len(_iso_day_prefixes) >= ISO_DAY_CACHE_SIZE:
+            _iso_day_prefixes.clear()
+        prefix = _iso_day_prefixes[day] = date.fromordinal(EPOCH_ORDINAL + day).isoformat() + "T"
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    return f"{prefix}{hour:02d}:{minute:02d}:{second:02d}Z"
+
+def iso_to_epoch(value, clock) -> Optional[int]:
+    """将ISO字符串转换为epoch秒（没有时区信息时按clock的本地时区处理，无法解析时返回None）"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        dt = datetime.fromisoformat(value)
+    except (AttributeError, ValueError):
+        try:
+            dt = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is None:
+        dt = clock.localize(dt)
+    return int(dt.timestamp())
+
+class LocalClock:
+    """本地时区的时间换算 - 以epoch秒为主，按UTC日期缓存UTC偏移
+    
+    每个UTC日期缓存当天开始时的偏移，以及当天内发生的偏移跳变（夏令时切换）时刻和跳变后的偏移，
+    之后同一天的换算只需一次字典查找和加减法，不再调用时区库。
+    支持pytz时区和zoneinfo.ZoneInfo。本地时刻换算为epoch秒时：
+    夏令时跳过的时刻（gap）按跳变前的偏移换算，即顺延到跳变之后；
+    重复的时刻（fold）取第二次出现（标准时间）。与pytz的localize默认（is_dst=False）结果一致。
+    """
+    
+    __slots__ = ("tz", "name", "max_days", "days")
+    
+    def __init__(self, tz, name: str = None, max_days: int = 4096):
+        self.tz = tz
+        self.name = name or str(tz)
+        self.max_days = max_days
+        # UTC日期（epoch天数） → (跳变时刻或None, 跳变前偏移, 跳变后偏移)
+        self.days: Dict[int, tuple] = {}
+    
+    def raw_offset(self, ts: int) -> int:
+        """直接由时区库计算ts时刻的UTC偏移（秒）"""
+        return int(datetime.fromtimestamp(ts, self.tz).utcoffset().total_seconds())
+    
+    def load_day(self, day: int) -> tuple:
+        """计算并缓存一个UTC日期内的偏移（假设一天内最多一次跳变）"""
+        start = day * 86400
+        before = self.raw_offset(start)
+        after = self.raw_offset(start + 86400)
+        transition = None
+        if before != after:
+            # 二分查找偏移变化的第一秒
+            low, high = start, start + 86400
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self.raw_offset(middle) == before:
+                    low = middle
+                else:
+                    high = middle
+            transition = high
+        if len(self.days) >= self.max_days:
+            self.days.clear()
+        entry = self.days[day] = (transition, before, after)
+        return entry
+    
+    def utc_offset(self, ts: float) -> int:
+        """ts时刻的UTC偏移（秒）"""
+        ts = int(ts // 1)
+        entry = self.days.get(ts // 86400)
+        if entry is None:
+            entry = self.load_day(ts // 86400)
+        transition, before, after = entry
+        return before if transition is None or ts < transition else after
+    
+    def now(self) -> datetime:
+        """本地时区的当前时间"""
+        return self.to_local(time.time())
+    
+    def to_local(self, ts: float) -> datetime:
+        """epoch秒 → 本地时区的datetime"""
+        return datetime.fromtimestamp(ts, self.tz)
+    
+    def local_date(self, ts: float) -> date:
+        """epoch秒所在的本地日期"""
+        return date.fromordinal(EPOCH_ORDINAL + int(ts // 1 + self.utc_offset(ts)) // 86400)
+    
+    def local_to_epoch(self, day: date, hour: int = 0, minute: int = 0, second: int = 0) -> int:
+        """本地日期和时刻 → epoch秒（处理夏令时gap和fold）"""
+        wall = (day.toordinal() - EPOCH_ORDINAL) * 86400 + hour * 3600 + minute * 60 + second
+        # 时区偏移不超过一天，前后一天的偏移即跳变前后的偏移
+        before = self.utc_offset(wall - 86400)
+        after = self.utc_offset(wall + 86400)
+        if before == after:
+            return wall - before
+        first = wall - before
+        second_ts = wall - after
+        first_valid = self.utc_offset(first) == before
+        second_valid = self.utc_offset(second_ts) == after
+        if first_valid and second_valid:
+            # fold：取第二次出现（标准时间）
+            return max(first, second_ts)
+        if second_valid:
+            return second_ts
+        # 正常时刻或gap（按跳变前的偏移换算，顺延到跳变之后）
+        return first
+    
+    def localize(self, naive: datetime) -> datetime:
+        """为没有时区信息的本地时间加上时区（替代pytz的localize）"""
+        ts = self.local_to_epoch(naive.date(), naive.hour, naive.minute, naive.second)
+        return self.to_local(ts + naive.microsecond / 1e6)
+    
+    def format_local(self, ts: float, fmt: str = '%Y-%m-%d %H:%M:%S %Z') -> str:
+        return self.to_local(ts).strftime(fmt)
+
+class Task:
+    """任务模型基类
+    
+    时间字段为整数epoch秒（*_ts），状态和重复类型为枚举；
+    只在持久化和发送给前端时通过to_dict转换为ISO字符串格式。
+    """
+    
+    __slots__ = (
+        "task_id", "entity_id", "entity_name", "entity_state", "status", "created_by",
+        "created_ts", "is_climate", "action_type", "previous_state",
+        "executed_ts", "cancelled_ts", "archived_ts", "error", "catch_up", "members",
+        "member_results", "attempts", "extra"
+    )
+    
+    # 序列化时任务ID使用的键名
+    id_key = "timer_id"
+    is_recurring = False
+    repeat_type = RepeatType.NONE
+    
+    # 由to_dict生成或不再保存的键，其余未知键原样保留在extra中
+    KNOWN_KEYS = frozenset((
+        "timer_id", "schedule_id", "entity_id", "entity_name", "entity_state", "status",
+        "domain", "created_by", "created_at", "repeat_type", "is_recurring", "is_climate",
+        "action_type", "previous_state", "executed_at", "cancelled_at", "archived_at", "error",
+        "duration", "start_time", "end_time", "action", "schedule_time", "weekdays",
+        "month_days", "action_data", "last_executed", "next_execution", "time_zone", "catch_up",
+        "members", "member_results", "attempts"
+    ))
+    
+    def __init__(self, task_id: str, entity_id: str, entity_name: str = None, entity_state=None,
+                 status: TaskStatus = TaskStatus.ACTIVE, created_by: str = "unknown",
+                 created_ts: int = None, is_climate: bool = False, action_type: str = None,
+                 previous_state: dict = None, catch_up: str = None):
+        self.task_id = task_id
+        self.entity_id = entity_id
+        self.entity_name = entity_name or entity_id
+        self.entity_state = entity_state
+        self.status = status
+        self.created_by = created_by
+        self.created_ts = int(time.time()) if created_ts is None else created_ts
+        self.is_climate = is_climate
+        self.action_type = action_type
+        self.previous_state = previous_state
+        self.executed_ts = None
+        self.cancelled_ts = None
+        self.archived_ts = None
+        self.error = None
+        # 停机期间错过执行时的补执行策略（None表示使用全局配置）
+        self.catch_up = catch_up
+        # 分组任务的成员实体列表（None表示单实体任务）和最近一次执行的成员结果
+        self.members = None
+        self.member_results = None
+        # 执行失败后的尝试记录 [{"attempt", "at"(epoch秒), "error"}]（从未失败时为None）
+        self.attempts = None
+        self.extra = None
+    
+    @property
+    def domain(self) -> str:
+        return self.entity_id.split(".")[0]
+    
+    @property
+    def is_active(self) -> bool:
+        return self.status is TaskStatus.ACTIVE
+    
+    @property
+    def is_group(self) -> bool:
+        return self.members is not None
+    
+    def to_dict(self) -> dict:
+        """转换为持久化/前端使用的字典格式"""
+        data = dict(self.extra) if self.extra else {}
+        data.update({
+            self.id_key: self.task_id,
+            "entity_id": self.entity_id,
+            "entity_name": self.entity_name,
+            "entity_state": self.entity_state,
+            "status": self.status.value,
+            "domain": self.domain,
+            "created_by": self.created_by,
+            "created_at": epoch_to_iso(self.created_ts),
+            "repeat_type": self.repeat_type.value,
+            "is_recurring": self.is_recurring,
+            "is_climate": self.is_climate,
+        })
+        if self.action_type is not None:
+            data["action_type"] = self.action_type
+        if self.previous_state is not None:
+            data["previous_state"] = self.previous_state
+        for key, ts in (("executed_at", self.executed_ts), ("cancelled_at", self.cancelled_ts),
+                        ("archived_at", self.archived_ts)):
+            if ts is not None:
+                data[key] = epoch_to_iso(ts)
+        if self.error is not None:
+            data["error"] = self.error
+        if self.catch_up is not None:
+            data["catch_up"] = self.catch_up
+        if self.members is not None:
+            data["members"] = self.members
+        if self.member_results is not None:
+            data["member_results"] = self.member_results
+        if self.attempts is not None:
+            data["attempts"] = [dict(attempt, at=epoch_to_iso(attempt.get("at"))) for attempt in self.attempts]
+        return data
+    
+    @staticmethod
+    def from_dict(task_id: str, data: dict, clock: "LocalClock") -> "Task":
+        """从持久化的字典创建任务（兼容旧版数据）"""
+        repeat_type = data.get("repeat_type") or "none"
+        if data.get("is_recurring") or (repeat_type != "none" and data.get("schedule_time")):
+            task = Schedule(task_id, data["entity_id"], RepeatType(repeat_type), data.get("schedule_time"),
+                            weekdays=data.get("weekdays"), month_days=data.get("month_days"),
+                            action_type=data.get("action_type") or "auto",
+                            action_data=data.get("action_data") or {})
+            task.last_executed_ts = iso_to_epoch(data.get("last_executed"), clock)
+            task.next_execution_ts = iso_to_epoch(data.get("next_execution"), clock)
+        else:
+            task = Timer(task_id, data["entity_id"], data.get("duration"),
+                         iso_to_epoch(data.get("start_time"), clock), iso_to_epoch(data.get("end_time"), clock),
+                         data.get("action") or {}, action_type=data.get("action_type"))
+        
+        try:
+            task.status = TaskStatus(data.get("status") or "active")
+        except ValueError:
+            task.status = TaskStatus.ERROR
+        task.entity_name = data.get("entity_name") or task.entity_id
+        task.entity_state = data.get("entity_state")
+        task.created_by = data.get("created_by", "unknown")
+        task.created_ts = iso_to_epoch(data.get("created_at"), clock)
+        task.is_climate = bool(data.get("is_climate"))
+        task.previous_state = data.get("previous_state")
+        task.executed_ts = iso_to_epoch(data.get("executed_at"), clock)
+        task.cancelled_ts = iso_to_epoch(data.get("cancelled_at"), clock)
+        task.archived_ts = iso_to_epoch(data.get("archived_at"), clock)
+        task.error = data.get("error")
+        task.catch_up = data.get("catch_up")
+        task.members = data.get("members")
+        task.member_results = data.get("member_results")
+        if data.get("attempts") is not None:
+            task.attempts = [dict(attempt, at=iso_to_epoch(attempt.get("at"), clock)) for attempt in data["attempts"]]
+        extra = {key: value for key, value in data.items() if key not in Task.KNOWN_KEYS}
+        task.extra = extra or None
+        return task
+
+class Timer(Task):
+    """一次性定时器"""
+    
+    __slots__ = ("duration", "start_ts", "end_ts", "action")
+    
+    def __init__(self, task_id: str, entity_id: str, duration: str, start_ts: Optional[int],
+                 end_ts: Optional[int], action: dict, **kwargs):
+        super().__init__(task_id, entity_id, **kwargs)
+        self.duration = duration
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.action = action
+    
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data.update({
+            "duration": self.duration,
+            "start_time": epoch_to_iso(self.start_ts),
+            "end_time": epoch_to_iso(self.end_ts),
+            "action": self.action,
+        })
+        return data
+
+class Schedule(Task):
+    """周期定时任务"""
+    
+    __slots__ = ("repeat_type", "schedule_time", "weekdays", "month_days", "action_data",
+                 "last_executed_ts", "next_execution_ts", "rule")
+    
+    id_key = "schedule_id"
+    is_recurring = True
+    
+    def __init__(self, task_id: str, entity_id: str, repeat_type: RepeatType, schedule_time: str,
+                 weekdays: list = None, month_days: list = None, action_data: dict = None, **kwargs):
+        kwargs.setdefault("action_type", "auto")
+        super().__init__(task_id, entity_id, **kwargs)
+        self.repeat_type = repeat_type
+        self.schedule_time = schedule_time
+        self.weekdays = weekdays
+        self.month_days = month_days
+        self.action_data = action_data or {}
+        self.last_executed_ts = None
+        self.next_execution_ts = None
+        # 编译后的RecurrenceRule（首次计算执行时间时生成，不持久化）
+        self.rule = None
+    
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data.update({
+            "schedule_time": self.schedule_time,
+            "action_data": self.action_data,
+            "last_executed": epoch_to_iso(self.last_executed_ts),
+            "next_execution": epoch_to_iso(self.next_execution_ts),
+        })
+        if self.weekdays is not None:
+            data["weekdays"] = self.weekdays
+        if self.month_days is not None:
+            data["month_days"] = self.month_days
+        return data
+
+# 补执行策略：skip（不补执行）、once（宽限期内错过的补执行一次）、all（补执行所有错过的）
+CATCH_UP_MODES = ("skip", "once", "all")
+
+# batch命令中允许的操作
+BATCH_ACTIONS = (
+    "create_timer", "create_climate_timer", "create_schedule", "create_group_timer", "create_group_schedule",
+    "cancel_timer", "cancel_schedule", "cancel_entity_timer"
+)
+BATCH_CANCEL_ACTIONS = ("cancel_timer", "cancel_schedule", "cancel_entity_timer")
+
+# 出站服务调用的默认优先级（数值小的先发出，未配置的为10）
+DEFAULT_SERVICE_PRIORITIES = {"climate": 0, "media_player": 20}
+
+# 非幂等服务：HA在合并调用出错前可能已对部分实体生效，逐个重试会把这些实体再切换一次，因此不合并调用
+NON_IDEMPOTENT_SERVICES = frozenset(("toggle", "media_play_pause"))
+
+# 分组任务：目标为实体列表时使用的entity_id域（timer_group.<任务ID>），以及支持的动作类型
+GROUP_TASK_DOMAIN = "timer_group"
+GROUP_ACTION_TYPES = {
+    "auto": "Auto",
+    "toggle": "Toggle state",
+    "turn_on": "Turn on",
+    "turn_off": "Turn off",
+}
+
+# 星期名称 → 数字（0=周一，6=周日）
+WEEKDAY_MAP = {
+    "monday": 0, "mon": 0,
+    "tuesday": 1, "tue": 1,
+    "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3,
+    "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5,
+    "sunday": 6, "sun": 6
+}
+
+class RecurrenceRule:
+    """编译后的周期规则 - 星期位掩码、每月日期位集合和预解析的执行时刻
+    
+    每个周期任务只编译一次，计算下次执行时间时不再解析字符串。
+    """
+    
+    __slots__ = ("repeat_type", "hour", "minute", "second", "weekday_mask", "month_day_mask")
+    
+    def __init__(self, repeat_type: RepeatType, schedule_time: str, weekdays: list = None, month_days: list = None):
+        time_parts = str(schedule_time).split(":")
+        if len(time_parts) != 3:
+            raise ValueError("Schedule time must be in HH:MM:SS format")
+        self.hour, self.minute, self.second = map(int, time_parts)
+        if not (0 <= self.hour < 24 and 0 <= self.minute < 60 and 0 <= self.second < 60):
+            raise ValueError(f"Invalid schedule time: {schedule_time}")
+        
+        self.repeat_type = repeat_type
+        # 第n位表示星期n（0=周一）
+        self.weekday_mask = 0
+        for day in weekdays or []:
+            weekday = day if isinstance(day, int) else WEEKDAY_MAP.get(str(day).lower(), 0)
+            self.weekday_mask |= 1 << (weekday % 7)
+        # 第n位表示每月n日（1-31）
+        self.month_day_mask = 0
+        for day in month_days or []:
+            day = int(day)
+            if 1 <= day <= 31:
+                self.month_day_mask |= 1 << day
+    
+    @classmethod
+    def compile(cls, schedule: "Schedule") -> "RecurrenceRule":
+        return cls(schedule.repeat_type, schedule.schedule_time, schedule.weekdays, schedule.month_days)
+    
+    def localize(self, day, clock: LocalClock) -> int:
+        """生成某一天执行时刻的epoch秒
+        
+        夏令时跳过的时刻顺延到跳变之后；重复的时刻取第二次出现（标准时间）。
+        """
+        return clock.local_to_epoch(day, self.hour, self.minute, self.second)
+    
+    def next_day(self, day):
+        """返回day当天或之后第一个符合规则的日期，规则为空时返回None"""
+        if self.repeat_type is RepeatType.DAILY:
+            return day
+        
+        if self.repeat_type is RepeatType.WEEKLY:
+            if not self.weekday_mask:
+                return None
+            weekday = day.weekday()
+            # 把掩码旋转到从当天开始，最低位即为最近的一天
+            rotated = ((self.weekday_mask >> weekday) | (self.weekday_mask << (7 - weekday))) & 0x7F
+            return day + timedelta(days=(rotated & -rotated).bit_length() - 1)
+        
+        if self.repeat_type is RepeatType.MONTHLY:
+            if not self.month_day_mask:
+                return None
+            year, month, first_day = day.year, day.month, day.day
+            # 最多跨越一年（31日、30日等每年都会出现）
+            for _ in range(13):
+                days_in_month = calendar.monthrange(year, month)[1]
+                candidates = self.month_day_mask & ~((1 << first_day) - 1) & ((1 << (days_in_month + 1)) - 1)
+                if candidates:
+                    return day.replace(year=year, month=month, day=(candidates & -candidates).bit_length() - 1)
+                year, month, first_day = (year + 1, 1, 1) if month == 12 else (year, month + 1, 1)
+            return None
+        
+        return None
+    
+    def next_after(self, after: float, clock: LocalClock) -> Optional[int]:
+        """计算after（epoch秒）之后的下一次执行时间（epoch秒）"""
+        day = clock.local_date(after)
+        # 当天的执行时刻可能已过，最多再看一个匹配日期
+        for _ in range(2):
+            day = self.next_day(day)
+            if day is None:
+                return None
+            candidate = self.localize(day, clock)
+            if candidate > after:
+                return candidate
+            day += timedelta(days=1)
+        return None
+    
+    def occurrences(self, after: float, clock: LocalClock, count: int) -> List[int]:
+        """计算after之后的count次执行时间（epoch秒）"""
+        results = []
+        current = after
+        while len(results) < count:
+            current = self.next_after(current, clock)
+            if current is None:
+                break
+            results.append(current)
+        return results
+
+class TaskStore:
+    """任务存储接口 - 持久化后端需实现以下方法"""
+    
+    # 是否支持按任务增量写入
+    incremental = False
+    # 是否支持按索引查询（不支持时由内存数据查询）
+    indexed = False
+    
+    def load(self) -> Dict[str, dict]:
+        """读取全部任务"""
+        raise NotImplementedError
+    
+    def load_partitioned(self) -> Tuple[Dict[str, dict], Optional[Dict[str, dict]]]:
+        """读取任务并拆分为（活跃任务, 已结束任务）
+        
+        已结束任务返回None时表示未读取，需要时通过load_history读取。
+        """
+        active, finished = {}, {}
+        for task_id, task in self.load().items():
+            if task.get("status", "active") == "active":
+                active[task_id] = task
+            else:
+                finished[task_id] = task
+        return active, finished
+    
+    def load_history(self) -> Dict[str, dict]:
+        """读取全部已结束的任务"""
+        return self.load_partitioned()[1] or {}
+    
+    def apply(self, puts: Dict[str, dict], deletes: List[str]):
+        """增量写入：更新puts中的任务，删除deletes中的任务"""
+        raise NotImplementedError
+    
+    def write_all(self, tasks: Dict[str, dict]):
+        """全量写入，替换已保存的所有任务"""
+        raise NotImplementedError
+    
+    def exists(self) -> bool:
+        """存储是否已存在"""
+        return True
+    
+    def needs_compaction(self) -> bool:
+        return False
+    
+    def can_compact(self) -> bool:
+        """存储中是否有可压缩的数据（终止时据此决定是否压缩）"""
+        return False
+    
+    def compact(self, tasks: Dict[str, dict]):
+        """压缩存储（默认无需处理）"""
+        pass
+    
+    def evict_history(self, cutoff: str, max_count: int, limit: int) -> List[str]:
+        """直接在存储中淘汰归档时间早于cutoff或超出数量上限的已结束任务
+        
+        最旧的优先，每次最多limit条，返回淘汰的任务ID。
+        """
+        raise NotImplementedError
+    
+    def query_history(self, entity_id: str = None, created_by: str = None,
+                      status: str = None, limit: int = 50) -> List[dict]:
+        """按索引查询已结束的任务（最新的在前）"""
+        raise NotImplementedError
+    
+    def count_history(self) -> int:
+        """已结束的任务数"""
+        return len(self.load_history())
+    
+    def close(self):
+        pass
+
+class JsonTaskStore(TaskStore):
+    """JSON文件存储（旧版后端）- 快照文件 + 追加写日志（每次变更只追加一条紧凑记录）"""
+    
+    def __init__(self, snapshot_file: str, mode: str = "journal", max_journal_bytes: int = 1024 * 1024):
+        self.snapshot_file = snapshot_file
+        self.journal_file = f"{snapshot_file}.journal"
+        self.mode = mode
+        self.incremental = mode == "journal"
+        self.max_journal_bytes = max_journal_bytes
+        self.journal_size = 0
+        self._lock = threading.Lock()
+    
+    def load(self) -> Dict[str, dict]:
+        """读取快照并重放日志，返回完整任务字典"""
+        tasks = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r') as f:
+                content = f.read()
+            if content.strip():
+                tasks = json.loads(content)
+        
+        self.journal_size = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    self.journal_size += len(line.encode("utf-8"))
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时可能留下写了一半的最后一行，忽略即可
+                        continue
+                    if record.get("op") == "put":
+                        tasks[record["id"]] = record["task"]
+                    elif record.get("op") == "del":
+                        tasks.pop(record["id"], None)
+        return tasks
+    
+    def apply(self, puts: Dict[str, dict], deletes: List[str]):
+        """追加变更记录到日志（每条记录一行）"""
+        records = [{"op": "put", "id": task_id, "task": task} for task_id, task in puts.items()]
+        records.extend({"op": "del", "id": task_id} for task_id in deletes)
+        if not records:
+            return
+        payload = "".join(
+            json.dumps(record, separators=(",", ":"), default=str) + "\n"
+            for record in records
+        )
+        with self._lock:
+            with open(self.journal_file, 'a') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_size += len(payload.encode("utf-8"))
+    
+    def write_all(self, tasks: Dict[str, dict]):
+        """原子写入快照（临时文件 + rename），随后清空日志"""
+        indent = 2 if self.mode == "snapshot" else None
+        with self._lock:
+            tmp_file = f"{self.snapshot_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(tasks, f, indent=indent, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            
+            # 快照已包含全部数据，日志可以清空
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'w') as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.journal_size = 0
+    
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_file)
+    
+    def needs_compaction(self) -> bool:
+        return self.incremental and self.journal_size > self.max_journal_bytes
+    
+    def can_compact(self) -> bool:
+        return self.incremental and self.journal_size > 0
+    
+    def compact(self, tasks: Dict[str, dict]):
+        self.write_all(tasks)
+
+class SqliteTaskStore(TaskStore):
+    """SQLite存储 - 状态、实体、创建者为索引列，每个变更是单行事务"""
+    
+    incremental = True
+    indexed = True
+    
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    entity_id TEXT,
+                    created_by TEXT,
+                    is_recurring INTEGER NOT NULL DEFAULT 0,
+                    archived_at TEXT,
+                    data TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_entity_id ON tasks(entity_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_by ON tasks(created_by)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archived_at ON tasks(archived_at)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    
+    def _row(self, task_id: str, task: dict) -> tuple:
+        return (
+            task_id,
+            task.get("status", "active"),
+            task.get("entity_id"),
+            task.get("created_by"),
+            1 if task.get("is_recurring") else 0,
+            task.get("archived_at"),
+            json.dumps(task, separators=(",", ":"), default=str)
+        )
+    
+    def load(self) -> Dict[str, dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT task_id, data FROM tasks").fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}
+    
+    def load_partitioned(self) -> Tuple[Dict[str, dict], Optional[Dict[str, dict]]]:
+        """只读取活跃任务（通过状态索引），已结束任务留到需要时读取"""
+        with self._lock:
+            rows = self.conn.execute("SELECT task_id, data FROM tasks WHERE status = 'active'").fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}, None
+    
+    def load_history(self) -> Dict[str, dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT task_id, data FROM tasks WHERE status != 'active'").fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}
+    
+    def apply(self, puts: Dict[str, dict], deletes: List[str]):
+        with self._lock:
+            for task_id, task in puts.items():
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        self._row(task_id, task)
+                    )
+            for task_id in deletes:
+                with self.conn:
+                    self.conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+    
+    def write_all(self, tasks: Dict[str, dict]):
+        rows = [self._row(task_id, task) for task_id, task in tasks.items()]
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM tasks")
+            self.conn.executemany("INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    
+    def evict_history(self, cutoff: str, max_count: int, limit: int) -> List[str]:
+        """按归档时间索引找到最旧的已结束任务并删除（没有archived_at的旧数据视为已过期）"""
+        with self._lock, self.conn:
+            (total,) = self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status != 'active'").fetchone()
+            excess = total - max_count
+            rows = self.conn.execute(
+                "SELECT task_id, archived_at FROM tasks WHERE status != 'active' ORDER BY archived_at LIMIT ?",
+                (limit,)
+            ).fetchall()
+            evicted_ids = []
+            for position, (task_id, archived_at) in enumerate(rows):
+                if position >= excess and archived_at is not None and archived_at >= cutoff:
+                    break
+                evicted_ids.append(task_id)
+            self.conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(task_id,) for task_id in evicted_ids])
+        return evicted_ids
+    
+    def query_history(self, entity_id: str = None, created_by: str = None,
+                      status: str = None, limit: int = 50) -> List[dict]:
+        if status:
+            clauses, params = ["status = ?"], [status]
+        else:
+            clauses = [f"status IN ({', '.join('?' for _ in TERMINAL_STATUSES)})"]
+            params = [status.value for status in TERMINAL_STATUSES]
+        if entity_id:
+            clauses.append("entity_id = ?")
+            params.append(entity_id)
+        if created_by:
+            clauses.append("created_by = ?")
+            params.append(created_by)
+        params.append(limit)
+        
+        sql = f"SELECT data FROM tasks WHERE {' AND '.join(clauses)} ORDER BY archived_at DESC LIMIT ?"
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def count_history(self) -> int:
+        with self._lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status != 'active'").fetchone()
+        return count
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+    
+    def migrate_from(self, legacy_store: TaskStore) -> int:
+        """从旧版存储一次性迁移全部任务，返回迁移的任务数"""
+        if self.get_meta("migrated_from"):
+            return 0
+        
+        try:
+            tasks = legacy_store.load()
+        except json.JSONDecodeError:
+            tasks = {}
+        with self._lock:
+            has_rows = self.conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone()
+        if tasks and not has_rows:
+            self.write_all(tasks)
+        self.set_meta("migrated_from", getattr(legacy_store, "snapshot_file", "legacy"))
+        return len(tasks) if not has_rows else 0
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class TaskIndex:
+    """任务二级索引 - 状态/实体/用户 → 任务ID集合，随每次状态变化增量维护"""
+    
+    def __init__(self):
+        self.by_status: Dict[TaskStatus, set] = {}
+        self.by_entity: Dict[str, set] = {}
+        self.by_user: Dict[str, set] = {}
+        self._keys: Dict[str, tuple] = {}
+    
+    def add(self, task_id: str, task: Task):
+        """加入或更新任务的索引项"""
+        key = (task.status, task.entity_id, task.created_by)
+        if self._keys.get(task_id) == key:
+            return
+        self.remove(task_id)
+        self._keys[task_id] = key
+        status, entity_id, user_id = key
+        self.by_status.setdefault(status, set()).add(task_id)
+        self.by_entity.setdefault(entity_id, set()).add(task_id)
+        self.by_user.setdefault(user_id, set()).add(task_id)
+    
+    def remove(self, task_id: str):
+        key = self._keys.pop(task_id, None)
+        if key is None:
+            return
+        for index, value in zip((self.by_status, self.by_entity, self.by_user), key):
+            ids = index.get(value)
+            if ids is not None:
+                ids.discard(task_id)
+                if not ids:
+                    del index[value]
+    
+    def clear(self):
+        self.by_status.clear()
+        self.by_entity.clear()
+        self.by_user.clear()
+        self._keys.clear()
+    
+    def ids(self, status: TaskStatus = None, entity_id: str = None, user_id: str = None) -> set:
+        """按条件查询任务ID，多个条件取交集（从最小的集合开始）"""
+        candidates = []
+        if status is not None:
+            candidates.append(self.by_status.get(status, set()))
+        if entity_id is not None:
+            candidates.append(self.by_entity.get(entity_id, set()))
+        if user_id is not None:
+            candidates.append(self.by_user.get(user_id, set()))
+        if not candidates:
+            return set(self._keys)
+        
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for ids in candidates[1:]:
+            result &= ids
+        return result
+
+class DueQueue:
+    """到期队列 - 按到期时间（epoch秒）排序的最小堆，取消采用惰性删除"""
+    
+    def __init__(self):
+        self._heap = []
+        self._entries: Dict[str, list] = {}  # task_id → [due, seq, task_id, kind, valid]
+        self._seq = itertools.count()
+        self._stale = 0
+        # 只在堆操作期间持有，持有期间不调用AppDaemon接口（事件循环中通过非阻塞方式获取）
+        self.lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._entries
+    
+    def push(self, task_id: str, due: float, kind: str):
+        """加入或更新任务的到期时间"""
+        with self.lock:
+            self._invalidate(task_id)
+            entry = [due, next(self._seq), task_id, kind, True]
+            self._entries[task_id] = entry
+            heapq.heappush(self._heap, entry)
+    
+    def cancel(self, task_id: str) -> bool:
+        """取消任务（只做标记，出堆时跳过）"""
+        with self.lock:
+            return self._invalidate(task_id)
+    
+    def _invalidate(self, task_id: str) -> bool:
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return False
+        entry[4] = False
+        self._stale += 1
+        # 失效项过多时重建堆，避免堆无限增长
+        if self._stale > 64 and self._stale > len(self._heap) // 2:
+            self._heap = [item for item in self._heap if item[4]]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        return True
+    
+    def next_due(self) -> Optional[float]:
+        """最早的到期时间"""
+        with self.lock:
+            while self._heap and not self._heap[0][4]:
+                heapq.heappop(self._heap)
+                self._stale -= 1
+            return self._heap[0][0] if self._heap else None
+    
+    def due_time(self, task_id: str) -> Optional[float]:
+        entry = self._entries.get(task_id)
+        return entry[0] if entry else None
+    
+    def pop_due(self, now: float) -> List[tuple]:
+        """取出所有已到期的任务，返回[(task_id, kind, due), ...]"""
+        due_items = []
+        with self.lock:
+            while self._heap and (self._heap[0][0] <= now or not self._heap[0][4]):
+                due, _, task_id, kind, valid = heapq.heappop(self._heap)
+                if not valid:
+                    self._stale -= 1
+                    continue
+                del self._entries[task_id]
+                due_items.append((task_id, kind, due))
+        return due_items
+
+class CoalescingWriter:
+    """合并写入 - 时间窗口内的多次保存请求合并为一次，由单一后台线程执行"""
+    
+    def __init__(self, flush_func, window: float = 0.25):
+        # flush_func(task_ids: set, full: bool)
+        self.flush_func = flush_func
+        self.window = window
+        self.pending_ids = set()
+        self.pending_full = False
+        self.requests = 0
+        self.writes = 0
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timer_backend_persist")
+    
+    @property
+    def dirty(self) -> bool:
+        return self.pending_full or bool(self.pending_ids)
+    
+    @property
+    def coalesced(self) -> int:
+        """被合并掉的保存请求数"""
+        return max(0, self.requests - self.writes)
+    
+    def mark_dirty(self, task_ids=None):
+        """登记一次保存请求；task_ids为空表示需要完整快照"""
+        with self._lock:
+            self.requests += 1
+            if task_ids:
+                self.pending_ids.update(task_ids)
+            else:
+                self.pending_full = True
+            
+            if self.window <= 0:
+                schedule = False
+            elif not self._scheduled:
+                self._scheduled = True
+                schedule = True
+            else:
+                return
+        
+        if schedule:
+            self._executor.submit(self._delayed_flush)
+        else:
+            # 未配置时间窗口时同步写入
+            self.flush()
+    
+    def _delayed_flush(self):
+        self._wakeup.wait(self.window)
+        self._wakeup.clear()
+        self.flush()
+    
+    def flush(self):
+        """立即写入所有待保存的变更"""
+        with self._flush_lock:
+            with self._lock:
+                self._scheduled = False
+                if not self.dirty:
+                    return
+                task_ids, full = self.pending_ids, self.pending_full
+                self.pending_ids, self.pending_full = set(), False
+            
+            try:
+                self.flush_func(task_ids, full)
+                self.writes += 1
+            except Exception:
+                # 写入失败时保留待写数据，等待下次请求或终止时重试
+                with self._lock:
+                    self.pending_ids.update(task_ids)
+                    self.pending_full = self.pending_full or full
+                raise
+    
+    def close(self):
+        """唤醒后台线程，同步写入剩余变更并关闭线程池"""
+        self._wakeup.set()
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+    
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "pending": len(self.pending_ids) + (1 if self.pending_full else 0),
+        }
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图（毫秒），百分位按所在分桶的上限估算"""
+    
+    # 分桶上限（毫秒），最后一个分桶收集所有更大的值
+    BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    
+    __slots__ = ("counts", "count", "total_ms", "max_ms", "last_ms")
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+    
+    def observe(self, seconds: float):
+        value = max(0.0, seconds * 1000)
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, value)] += 1
+        self.count += 1
+        self.total_ms += value
+        self.last_ms = value
+        if value > self.max_ms:
+            self.max_ms = value
+    
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = p * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+    
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "last_ms": round(self.last_ms, 3),
+        }
+
+class MetricsRegistry:
+    """按名称收集耗时直方图（可能在后台写入线程中记录，使用锁保护）"""
+    
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+    
+    def get(self, name: str) -> Optional[LatencyHistogram]:
+        return self.histograms.get(name)
+    
+    def snapshot(self, prefix: str = "") -> Dict[str, dict]:
+        """返回名称以prefix开头的直方图摘要（键去掉prefix）"""
+        with self._lock:
+            return {
+                name[len(prefix):]: histogram.snapshot()
+                for name, histogram in sorted(self.histograms.items())
+                if name.startswith(prefix)
+            }
+
+class TokenBucket:
+    """令牌桶 - 每秒补充rate个令牌，最多积累burst个"""
+    
+    __slots__ = ("rate", "burst", "tokens", "updated")
+    
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = max(0.001, rate)
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+    
+    def take(self, now: float) -> float:
+        """尝试取一个令牌，成功返回0，否则返回还需等待的秒数"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class ServiceCallDispatcher:
+    """出站服务调用队列
+    
+    调用按优先级排队（数值小的先发出，同优先级按入队顺序），每个限流键（实体组、实体或域）一个令牌桶，
+    同时进行的调用不超过max_in_flight。令牌不足的键暂时跳过，其他键的调用先发出，令牌补充后再唤醒。
+    """
+    
+    def __init__(self, max_in_flight: int, rate_limits: dict = None, priorities: dict = None,
+                 key_groups: dict = None, default_priority: int = 10):
+        self.max_in_flight = max(1, int(max_in_flight))
+        # 限流键 → 令牌桶（配置格式 {键: {"rate": 每秒次数, "burst": 突发次数}}）
+        self.buckets = {
+            key: TokenBucket(float(config.get("rate", 1)), float(config.get("burst", 1)))
+            for key, config in (rate_limits or {}).items()
+        }
+        self.priorities = dict(priorities or {})
+        self.default_priority = default_priority
+        # 实体 → 实体组名（同一集成的多个实体共用一个令牌桶）
+        self.key_groups = {
+            entity_id: name for name, entity_ids in (key_groups or {}).items() for entity_id in entity_ids
+        }
+        self.queue = []  # (优先级, 序号, 限流键, future, 入队时间)
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.wakeup = None  # 等待令牌补充的call_later句柄
+        self.wakeup_at = None
+        self.wait = LatencyHistogram()
+        self.dispatched = 0
+        self.throttled = 0  # 因令牌不足而等待过的调用数
+        self.throttled_entries = set()
+        self.max_depth = 0
+    
+    def resolve(self, service: str, entity_id) -> Tuple[Optional[str], int]:
+        """返回调用的(限流键, 优先级)，依次匹配实体所属的实体组、实体ID和域"""
+        if isinstance(entity_id, (list, tuple)):
+            entity_id = entity_id[0] if entity_id else None
+        candidates = [key for key in (self.key_groups.get(entity_id), entity_id, service.split("/")[0]) if key]
+        key = next((key for key in candidates if key in self.buckets), None)
+        priority = next((self.priorities[key] for key in candidates if key in self.priorities), self.default_priority)
+        return key, priority
+    
+    async def acquire(self, key: Optional[str], priority: int) -> float:
+        """排队直到可以发出调用，返回排队等待的秒数（调用结束后必须调用release）"""
+        enqueued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self.sequence), key, future, enqueued))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已放行但调用方被取消时归还名额
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        waited = time.monotonic() - enqueued
+        self.wait.observe(waited)
+        return waited
+    
+    def release(self):
+        self.in_flight -= 1
+        self.pump()
+    
+    def pump(self):
+        """在并发上限内按优先级放行令牌充足的调用"""
+        now = time.monotonic()
+        skipped = []
+        blocked = {}  # 本轮令牌不足的键 → 等待秒数
+        while self.queue and self.in_flight < self.max_in_flight:
+            entry = heapq.heappop(self.queue)
+            key, future = entry[2], entry[3]
+            if future.done():
+                # 等待方已取消
+                self.throttled_entries.discard(entry[1])
+                continue
+            if key in blocked:
+                skipped.append(entry)
+                continue
+            bucket = self.buckets.get(key)
+            wait = bucket.take(now) if bucket is not None else 0.0
+            if wait > 0:
+                blocked[key] = wait
+                skipped.append(entry)
+                if entry[1] not in self.throttled_entries:
+                    self.throttled_entries.add(entry[1])
+                    self.throttled += 1
+                continue
+            self.throttled_entries.discard(entry[1])
+            self.in_flight += 1
+            self.dispatched += 1
+            future.set_result(None)
+        
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        if blocked and self.in_flight < self.max_in_flight:
+            self.schedule_wakeup(now + min(blocked.values()))
+    
+    def schedule_wakeup(self, when: float):
+        """在最早的令牌补充时间再次放行"""
+        if self.wakeup is not None and self.wakeup_at <= when:
+            return
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        self.wakeup_at = when
+        self.wakeup = asyncio.get_running_loop().call_later(max(0.0, when - time.monotonic()), self.on_wakeup)
+    
+    def on_wakeup(self):
+        self.wakeup = None
+        self.wakeup_at = None
+        self.pump()
+    
+    def stats(self) -> dict:
+        queued_by_key = {}
+        for entry in self.queue:
+            name = entry[2] or "unlimited"
+            queued_by_key[name] = queued_by_key.get(name, 0) + 1
+        return {
+            "queue_depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "queued_by_key": queued_by_key,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "dispatched": self.dispatched,
+            "throttled": self.throttled,
+            "wait": self.wait.snapshot(),
+        }
+
+class EntityStateCache:
+    """实体状态缓存 - 保存状态和常用属性，由listen_state回调更新，超过max_age秒未确认的视为过期"""
+    
+    # 缓存的属性
+    ATTRIBUTES = (
+        "friendly_name", "hvac_mode", "temperature", "current_temperature",
+        "fan_mode", "swing_mode", "preset_mode", "entity_id"
+    )
+    
+    def __init__(self, max_age: float = 600):
+        self.max_age = max_age
+        self.entries: Dict[str, tuple] = {}  # entity_id → (状态, 属性, 更新时间)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_age > 0
+    
+    def get(self, entity_id: str) -> Optional[tuple]:
+        """读取未过期的缓存项，并更新命中/未命中计数"""
+        entry = self.entries.get(entity_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.monotonic() - entry[2] > self.max_age:
+            self.stale += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+    
+    def update(self, entity_id: str, full_state: Optional[dict]):
+        """写入get_state(attribute="all")格式的完整状态（实体不存在时删除缓存项）"""
+        if not full_state:
+            self.entries.pop(entity_id, None)
+            return
+        attributes = full_state.get("attributes") or {}
+        self.entries[entity_id] = (
+            full_state.get("state"),
+            {name: attributes[name] for name in self.ATTRIBUTES if name in attributes},
+            time.monotonic()
+        )
+    
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "entries": len(self.entries),
+        }
+
 class TimerBackend(hass.Hass):
     """定时任务后端 - 包含空调支持的全自动版本，支持周期定时"""
     
     def initialize(self):
         """初始化应用"""
         # 配置文件 - 使用指定的路径
-        self.persist_file = "/homeassistant/www/logstimer_tasks.json"
+        self.persist_file = self.args.get("persist_file", "/homeassistant/www/logstimer_tasks.json")
+        # 持久化模式：journal（追加日志 + 定期压缩）或 snapshot（每次全量重写）
+        self.persist_mode = self.args.get("persist_mode", "journal")
+        self.journal_max_bytes = int(self.args.get("journal_max_bytes", 1024 * 1024))
+        # 存储后端：json（旧版文件存储）或 sqlite
+        self.task_store = self.args.get("task_store", "json")
+        self.sqlite_file = self.args.get("sqlite_file", "/homeassistant/www/logstimer_tasks.db")
+        self.store = self.create_task_store()
+        self.compaction_scheduled = False
+        # 合并写入窗口（秒），0表示每次保存同步写入
+        self.persist_window = float(self.args.get("persist_window", 0.25))
+        self.persist_writer = CoalescingWriter(self.flush_task_changes, self.persist_window)
+        # 历史任务保留策略
+        self.history_ttl_days = float(self.args.get("history_ttl_days", 30))
+        self.history_max_count = int(self.args.get("history_max_count", 1000))
+        self.history_evict_batch = int(self.args.get("history_evict_batch", 100))
         self.event_name = self.args.get("event_name", "timer_backend_event")
         self.default_actions = self.args.get("default_actions", {})
         
         # 获取AppDaemon时区配置
         self.time_zone = self.args.get("time_zone", "Asia/Shanghai")
+        # 时区库：pytz（默认）或zoneinfo（Python 3.9+）
+        self.time_zone_backend = self.args.get("time_zone_backend", "pytz")
+        if self.time_zone_backend == "zoneinfo" and ZoneInfo is None:
+            self.log("zoneinfo is not available, using pytz", level="WARNING")
+            self.time_zone_backend = "pytz"
         try:
-            self.tz = pytz.timezone(self.time_zone)
+            if self.time_zone_backend == "zoneinfo":
+                self.tz = ZoneInfo(self.time_zone)
+            else:
+                self.tz = pytz.timezone(self.time_zone)
         except:
             self.log(f"Invalid time zone: {self.time_zone}, using UTC", level="WARNING")
             self.tz = pytz.UTC
+        # 本地时间换算（按天缓存UTC偏移）
+        self.clock = LocalClock(self.tz, self.time_zone)
         
         # 空调相关配置
         self.climate_config = {
@@ -43,9 +1351,110 @@ class TimerBackend(hass.Hass):
         }
         
         # 存储
-        self.tasks = {}
-        self.timers = {}
-        self.recurring_timers = {}  # 周期定时器句柄
+        self.tasks = {}  # 活跃任务
+        self.history = OrderedDict()  # 已结束任务，按归档时间排序
+        self.index = TaskIndex()  # 状态/实体/用户二级索引
+        
+        # 启动时只恢复活跃任务，历史任务在首次需要时加载
+        self.history_loaded = True
+        self.deferred_history = None  # 启动时已读取但未解析的历史数据
+        self.history_lock = threading.Lock()
+        self.history_load_lock = threading.Lock()  # 保证历史只加载一次，加载期间不持有history_lock
+        self.restore_delay = float(self.args.get("restore_delay", 0))
+        self.restore_stats = {
+            "seconds": None, "timers": 0, "schedules": 0, "expired": 0, "caught_up": 0, "skipped": 0,
+            "saved": 0, "history_deferred": None, "history_loaded": 0, "history_load_seconds": None
+        }
+        
+        # 版本号与变更日志（版本号从启动时的毫秒时间戳开始，重启后仍单调递增）
+        self.revision = int(time.time() * 1000)
+        self.change_log = deque(maxlen=int(self.args.get("change_log_size", 500)))
+        self.delta_events = bool(self.args.get("delta_events", True))
+        
+        # 活跃列表缓存（按user_id），任务变更时失效
+        self.list_cache = {}
+        self.list_cache_hits = 0
+        self.list_cache_misses = 0
+        
+        # 状态实体：在实体属性中发布活跃任务列表，卡片直接从hass.states读取（为空时不发布）
+        self.state_entity = self.args.get("state_entity", "")
+        self.state_entity_pending = False
+        self.state_entity_updates = 0
+        
+        # 列表请求合并：list_coalesce_window内的请求合并为一次广播，
+        # 同一user_id两次广播至少间隔list_min_interval秒（期间的请求推迟到间隔结束时合并发送）
+        self.list_coalesce_window = float(self.args.get("list_coalesce_window", 0.2))
+        self.list_min_interval = float(self.args.get("list_min_interval", 2.0))
+        self.pending_list_users = {}  # user_id → 计划发送时间（monotonic）
+        self.list_last_sent = {}  # user_id → 上次广播时间（monotonic）
+        self.list_flush_handle = None
+        self.list_flush_due = None
+        self.list_request_stats = {"received": 0, "broadcasts": 0, "coalesced": 0, "deferred": 0}
+        
+        # 实体状态缓存（由listen_state更新），超过state_cache_max_age秒未确认时重新读取
+        self.state_cache = EntityStateCache(float(self.args.get("state_cache_max_age", 600)))
+        self.watched_entities = set()
+        # 关闭缓存时，异步执行路径中由refresh_entity_state读取的最新状态
+        self.fetched_states = {}
+        
+        # 同一时刻到期的相同服务调用合并为一次（entity_id为列表）
+        self.group_service_calls = bool(self.args.get("group_service_calls", True))
+        # 单个分组任务最多包含的实体数
+        self.group_max_members = max(1, int(self.args.get("group_max_members", 200)))
+        self.execution_stats = {
+            "service_calls": 0, "grouped_calls": 0, "grouped_actions": 0,
+            "batches": 0, "last_batch_seconds": 0.0, "max_batch_seconds": 0.0, "total_batch_seconds": 0.0
+        }
+        
+        # 不同实体的动作并发执行，同一实体按顺序执行
+        self.max_concurrent_actions = max(1, int(self.args.get("max_concurrent_actions", 8)))
+        # 出站服务调用队列：按优先级和每个域/实体组的令牌桶放行，同时进行的调用不超过max_concurrent_actions
+        self.dispatcher = ServiceCallDispatcher(
+            self.max_concurrent_actions,
+            rate_limits=self.args.get("rate_limits") or {},
+            priorities=dict(DEFAULT_SERVICE_PRIORITIES, **(self.args.get("service_priorities") or {})),
+            key_groups=self.args.get("rate_limit_groups") or {}
+        )
+        self.entity_locks = {}
+        
+        # 运行指标（耗时直方图），关闭时为None，各记录点只做一次判断
+        self.metrics = MetricsRegistry() if self.args.get("metrics", False) else None
+        self.metrics_interval = max(5, float(self.args.get("metrics_interval", 60)))
+        self.metrics_prefix = self.args.get("metrics_prefix", "sensor.timer_backend")
+        
+        # 停机期间错过的任务：按策略补执行，每catch_up_interval秒最多执行catch_up_batch_size个
+        self.catch_up = self.args.get("catch_up", "once")
+        if self.catch_up not in CATCH_UP_MODES:
+            self.log(f"Invalid catch_up mode: {self.catch_up}, using once", level="WARNING")
+            self.catch_up = "once"
+        self.catch_up_grace = float(self.args.get("catch_up_grace", 3600))
+        self.catch_up_max_runs = max(1, int(self.args.get("catch_up_max_runs", 10)))
+        self.catch_up_batch_size = max(1, int(self.args.get("catch_up_batch_size", 10)))
+        self.catch_up_interval = float(self.args.get("catch_up_interval", 1.0))
+        self.catch_up_queue = deque()  # (任务ID, 类型, 错过的执行时间)
+        # 等待补执行的定时器ID（不在到期队列中，列表清理过期定时器时需跳过）
+        self.catch_up_pending = set()
+        self.catch_up_handle = None
+        self.catch_up_stats = {"queued": 0, "executed": 0, "skipped": 0}
+        
+        # 定时器执行失败后的重试：指数退避加随机抖动，经到期队列重新执行，超过最大延迟后不再重试
+        self.retry_max_attempts = max(1, int(self.args.get("retry_max_attempts", 3)))
+        self.retry_backoff = max(0.0, float(self.args.get("retry_backoff", 5)))
+        self.retry_backoff_max = max(self.retry_backoff, float(self.args.get("retry_backoff_max", 300)))
+        self.retry_jitter = min(1.0, max(0.0, float(self.args.get("retry_jitter", 0.2))))
+        self.retry_max_lateness = float(self.args.get("retry_max_lateness", 900))
+        self.retry_stats = {"scheduled": 0, "succeeded": 0, "exhausted": 0}
+        
+        # batch命令执行上下文：期间合并保存、响应和增量事件
+        self.batch = None
+        
+        # 统一调度：所有定时器和周期任务放入一个到期队列，只保留一个AppDaemon唤醒
+        self.scheduler = DueQueue()
+        self.scheduler_handle = None
+        self.scheduler_deadline = None
+        self.scheduler_token = 0
+        self.scheduler_tolerance = float(self.args.get("scheduler_tolerance", 0.5))
+        self.unarmed_schedules = set()  # 无法计算下次执行时间的周期任务，午夜检查时重试
         self.entity_timers = {}  # 按实体ID索引的定时器
         self.climate_previous_states = {}  # 保存空调之前的状态
         
@@ -56,206 +1465,1003 @@ class TimerBackend(hass.Hass):
         self.listen_state(self.handle_climate_state_change, "climate")
         
         # 恢复任务
-        self.run_in(self.restore_tasks, 2)
+        self.run_in(self.restore_tasks, self.restore_delay)
+        self.mark_state_entity_dirty()
         
         # 设置每日午夜检查周期任务（使用本地时区）
         self.run_daily(self.check_recurring_schedules, "00:00:00")
         
-        self.log(f"Timer backend started - with climate and recurring schedule support (Timezone: {self.time_zone})")
-    
-    def get_local_now(self) -> datetime:
-        """获取本地时区的当前时间"""
-        utc_now = datetime.now(pytz.UTC)
-        return utc_now.astimezone(self.tz)
-    
-    def parse_local_time(self, time_str: str, date_obj: datetime = None) -> datetime:
-        """解析本地时间字符串为datetime对象"""
-        if not date_obj:
-            date_obj = self.get_local_now()
-        
-        # 解析时间字符串
-        hour, minute, second = map(int, time_str.split(":"))
-        
-        # 创建本地时间的naive datetime
-        local_naive = datetime(
-            date_obj.year,
-            date_obj.month,
-            date_obj.day,
-            hour,
-            minute,
-            second,
-            0  # 微秒
-        )
+        # 定期分批清理过期的历史任务
+        self.run_every(self.evict_history, "now+60", 300)
+        
+        # 定期发布运行指标传感器
+        if self.metrics is not None:
+            self.run_every(self.publish_metrics, f"now+{int(self.metrics_interval)}", self.metrics_interval)
+        
+        self.log(f"Timer backend started - with climate and recurring schedule support (Timezone: {self.time_zone})")
+    
+    def get_local_now(self) -> datetime:
+        """获取本地时区的当前时间"""
+        return self.clock.now()
+    
+    def datetime_to_iso(self, dt: datetime) -> str:
+        """将datetime转换为ISO格式字符串（返回UTC时间，带Z后缀）"""
+        if dt.tzinfo is None:
+            # 如果没有时区信息，假设为本地时区
+            dt = self.clock.localize(dt)
+        # 转换为UTC并返回带Z后缀的ISO格式
+        return epoch_to_iso(dt.timestamp() // 1)
+    
+    def create_task_store(self) -> TaskStore:
+        """根据配置创建存储后端，首次使用SQLite时从JSON文件一次性迁移"""
+        json_store = JsonTaskStore(self.persist_file, self.persist_mode, self.journal_max_bytes)
+        if self.task_store != "sqlite":
+            return json_store
+        
+        try:
+            directory = os.path.dirname(self.sqlite_file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            
+            store = SqliteTaskStore(self.sqlite_file)
+            migrated = store.migrate_from(json_store)
+            if migrated:
+                self.log(f"Migrated {migrated} tasks from {self.persist_file} to {self.sqlite_file}")
+            return store
+            
+        except Exception as e:
+            self.log(f"Failed to open SQLite task store: {e}, using JSON file", level="ERROR")
+            self.task_store = "json"
+            return json_store
+    
+    def ensure_file_exists(self):
+        """确保文件存在，如果不存在则创建"""
+        if not isinstance(self.store, JsonTaskStore):
+            return False
+        
+        try:
+            # 确保目录存在
+            directory = os.path.dirname(self.persist_file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+                self.log(f"Created directory: {directory}")
+            
+            # 如果文件不存在，创建空文件
+            if not os.path.exists(self.persist_file):
+                with open(self.persist_file, 'w') as f:
+                    json.dump({}, f, indent=2)
+                self.log(f"Created empty task file: {self.persist_file}")
+                return True
+            return False
+        except Exception as e:
+            self.log(f"Failed to ensure file exists: {e}", level="ERROR")
+            return False
+    
+    def save_tasks(self, *task_ids):
+        """保存任务到文件
+        
+        保存请求交给后台写入线程，在persist_window内合并后统一写入。
+        存储支持增量写入时（journal模式、SQLite）只写入task_ids对应的任务；
+        不传task_ids时写入完整快照。
+        """
+        # 所有修改任务的路径都会保存，在此使列表缓存失效
+        self.invalidate_list_cache()
+        if self.batch is not None:
+            # batch命令结束时统一保存
+            if task_ids:
+                self.batch["dirty"].update(task_ids)
+            else:
+                self.batch["full"] = True
+            return
+        start = time.perf_counter() if self.metrics is not None else None
+        try:
+            self.persist_writer.mark_dirty(task_ids)
+        except Exception as e:
+            self.log(f"Failed to save tasks: {e}", level="ERROR")
+        if start is not None:
+            # 保存请求阻塞调用方的时间（persist_window为0时包含写入）
+            self.metrics.observe("persist.save_tasks", time.perf_counter() - start)
+    
+    def flush_task_changes(self, task_ids, full):
+        """写入合并后的变更（在后台写入线程中执行）"""
+        start = time.perf_counter()
+        try:
+            # 确保文件存在
+            self.ensure_file_exists()
+            
+            if self.store.incremental and task_ids and not full:
+                self.apply_task_changes(task_ids)
+            else:
+                self.write_task_snapshot()
+            
+        except RuntimeError as e:
+            # 任务字典在序列化期间被其他线程修改，交给下一次写入
+            self.log(f"Task data changed while saving, will retry: {e}", level="WARNING")
+            raise
+        except Exception as e:
+            self.log(f"Failed to save tasks: {e}", level="ERROR")
+            # 尝试创建文件后以完整快照重试
+            try:
+                self.ensure_file_exists()
+                self.write_task_snapshot()
+                self.log(f"Tasks saved after file creation: {self.persist_file}")
+            except Exception as retry_error:
+                self.log(f"Failed to save after retry: {retry_error}", level="ERROR")
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe("persist.flush", time.perf_counter() - start)
+    
+    def apply_task_changes(self, task_ids):
+        """增量写入任务变更，存储需要压缩时安排压缩"""
+        puts = {}
+        deletes = []
+        for task_id in task_ids:
+            task = self.get_task(task_id)
+            if task is not None:
+                puts[task_id] = task.to_dict()
+            else:
+                deletes.append(task_id)
+        
+        self.store.apply(puts, deletes)
+        
+        if self.store.needs_compaction():
+            if self.persist_window > 0:
+                # 已在后台写入线程中，直接压缩
+                self.compact_tasks({})
+            elif not self.compaction_scheduled:
+                self.compaction_scheduled = True
+                self.run_in(self.compact_tasks, 0)
+    
+    def get_all_task_data(self) -> Dict[str, dict]:
+        """合并活跃任务和历史任务并转换为字典，用于全量写入"""
+        # 全量写入会替换存储中的全部任务，必须先加载延迟的历史任务
+        self.ensure_history_loaded()
+        data = {task_id: task.to_dict() for task_id, task in list(self.history.items())}
+        data.update((task_id, task.to_dict()) for task_id, task in list(self.tasks.items()))
+        return data
+    
+    def write_task_snapshot(self):
+        """写入完整快照"""
+        self.store.write_all(self.get_all_task_data())
+        self.log(f"Tasks saved to {self.task_store} store")
+    
+    def compact_tasks(self, kwargs):
+        """后台压缩：将当前任务写为新快照并清空日志"""
+        self.compaction_scheduled = False
+        try:
+            self.store.compact(self.get_all_task_data())
+            self.log(f"Task store compacted ({self.task_store})")
+        except Exception as e:
+            self.log(f"Failed to compact task store: {e}", level="ERROR")
+    
+    def get_task(self, task_id: str) -> Optional[Task]:
+        """按ID查找任务（活跃任务优先，其次历史任务）"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            task = self.history.get(task_id)
+        return task
+    
+    def reset_tasks(self):
+        """清空活跃任务、历史任务和索引"""
+        self.tasks = {}
+        self.history = OrderedDict()
+        self.history_loaded = True
+        self.deferred_history = None
+        self.index.clear()
+    
+    def ensure_history_loaded(self):
+        """首次需要历史任务时解析启动时延迟的历史数据（可能在后台写入线程中调用）
+        
+        读取和解析在history_lock之外进行，只在替换历史字典时短暂持有锁，
+        事件循环中结束任务时不会等待整个加载过程。
+        """
+        if self.history_loaded:
+            return
+        with self.history_load_lock:
+            if self.history_loaded:
+                return
+            start = time.perf_counter()
+            raw_history = self.deferred_history
+            if raw_history is None:
+                try:
+                    raw_history = self.store.load_history()
+                except Exception as e:
+                    self.log(f"Failed to load history: {e}", level="ERROR")
+                    raw_history = {}
+            
+            loaded = []
+            for task_id, task_data in raw_history.items():
+                try:
+                    loaded.append((task_id, Task.from_dict(task_id, task_data, self.clock)))
+                except (KeyError, ValueError) as e:
+                    self.log(f"Skipping invalid task {task_id}: {e}", level="WARNING")
+            loaded.sort(key=lambda item: self.get_archived_time(item[1]))
+            
+            with self.history_lock:
+                # 启动后已在内存中更新过的任务以内存为准
+                items = [(task_id, task) for task_id, task in loaded
+                         if task_id not in self.tasks and task_id not in self.history]
+                for task_id, task in items:
+                    self.index.add(task_id, task)
+                # 启动后才结束的任务比加载的历史更新，排在后面
+                items.extend(self.history.items())
+                self.history = OrderedDict(items)
+                self.deferred_history = None
+                self.history_loaded = True
+            
+            self.restore_stats["history_loaded"] = len(raw_history)
+            self.restore_stats["history_load_seconds"] = round(time.perf_counter() - start, 3)
+            self.log(f"Loaded {len(raw_history)} history entries in {self.restore_stats['history_load_seconds']}s")
+    
+    def get_history_count(self) -> int:
+        """历史任务总数（SQLite存储在历史未加载时按状态索引统计，不加载历史）"""
+        if self.history_loaded:
+            return len(self.history)
+        if self.store.indexed:
+            return self.store.count_history()
+        return len(self.history) + len(self.deferred_history or {})
+    
+    def add_task(self, task_id: str, task: Task, record: bool = True):
+        """加入活跃任务并更新索引（恢复任务时不记录变更）"""
+        self.tasks[task_id] = task
+        self.index.add(task_id, task)
+        if record:
+            self.record_change(task_id, "added", task)
+    
+    def finish_task(self, task_id: str, status: TaskStatus, **fields) -> Optional[Task]:
+        """将任务标记为结束状态，并从活跃存储移入历史存储（fields为要设置的任务属性）"""
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return None
+        
+        task.status = status
+        for name, value in fields.items():
+            setattr(task, name, value)
+        task.archived_ts = int(time.time())
+        # 历史任务可能正在后台写入线程中加载，持有锁避免加载结果覆盖这次变更
+        with self.history_lock:
+            self.history[task_id] = task
+            self.history.move_to_end(task_id)
+            self.index.add(task_id, task)
+            
+            # 超出数量上限时淘汰最旧的历史任务
+            evicted_ids = []
+            while len(self.history) > self.history_max_count:
+                evicted_id, _ = self.history.popitem(last=False)
+                self.index.remove(evicted_id)
+                evicted_ids.append(evicted_id)
+        self.record_change(task_id, "removed", task)
+        if evicted_ids:
+            self.save_tasks(*evicted_ids)
+        
+        return task
+    
+    def get_archived_time(self, task: Task) -> int:
+        """获取任务的归档时间epoch秒（兼容旧数据中没有archived_at的任务）"""
+        archived_ts = task.archived_ts or task.executed_ts or task.cancelled_ts or task.created_ts
+        if not archived_ts:
+            return int(time.time())
+        return archived_ts
+    
+    def evict_history(self, kwargs):
+        """分批淘汰超过保留期限或数量上限的历史任务"""
+        try:
+            cutoff = time.time() - self.history_ttl_days * 86400
+            if not self.history_loaded:
+                if self.store.indexed:
+                    # 历史任务尚未加载，直接在存储中按索引淘汰
+                    self.evict_stored_history(cutoff)
+                    return
+                self.ensure_history_loaded()
+            evicted_ids = []
+            
+            with self.history_lock:
+                while self.history and len(evicted_ids) < self.history_evict_batch:
+                    task_id, task = next(iter(self.history.items()))
+                    if len(self.history) <= self.history_max_count and self.get_archived_time(task) > cutoff:
+                        # 历史按归档时间排序，最旧的未过期则后面的都未过期
+                        break
+                    del self.history[task_id]
+                    self.index.remove(task_id)
+                    evicted_ids.append(task_id)
+            
+            if evicted_ids:
+                self.save_tasks(*evicted_ids)
+                self.log(f"Evicted {len(evicted_ids)} history entries, {len(self.history)} remaining")
+                
+        except Exception as e:
+            self.log(f"Failed to evict history: {e}", level="ERROR")
+    
+    def evict_stored_history(self, cutoff: float):
+        """历史任务未加载时在存储中淘汰，同时移除内存中启动后才结束的同一批任务"""
+        # 先写入待保存的变更，存储中的数量才包含启动后结束的任务
+        self.persist_writer.flush()
+        evicted_ids = self.store.evict_history(epoch_to_iso(int(cutoff)), self.history_max_count,
+                                               self.history_evict_batch)
+        if not evicted_ids:
+            return
+        with self.history_lock:
+            for task_id in evicted_ids:
+                if self.history.pop(task_id, None) is not None:
+                    self.index.remove(task_id)
+        self.log(f"Evicted {len(evicted_ids)} stored history entries")
+    
+    def query_history(self, entity_id: str = None, user_id: str = None,
+                      status: str = None, limit: int = 50) -> List[dict]:
+        """查询历史任务（最新的在前）"""
+        if self.store.indexed:
+            # 先写入待保存的变更，再通过存储索引查询（无需加载历史）
+            self.persist_writer.flush()
+            return self.store.query_history(entity_id=entity_id, created_by=user_id,
+                                            status=status, limit=limit)
+        
+        self.ensure_history_loaded()
+        
+        if not (entity_id or user_id or status):
+            results = []
+            for task in reversed(self.history.values()):
+                results.append(task.to_dict())
+                if len(results) >= limit:
+                    break
+            return results
+        
+        if status:
+            try:
+                status = TaskStatus(status)
+            except ValueError:
+                return []
+        
+        # 通过索引找到匹配的任务，只对匹配结果排序
+        matched = [
+            self.history[task_id]
+            for task_id in self.index.ids(status=status or None, entity_id=entity_id or None, user_id=user_id or None)
+            if task_id in self.history
+        ]
+        matched.sort(key=lambda task: task.archived_ts or 0, reverse=True)
+        return [task.to_dict() for task in matched[:limit]]
+    
+    def send_history(self, data: dict):
+        """发送历史任务列表"""
+        try:
+            limit = int(data.get("limit", 50))
+            history = self.query_history(
+                entity_id=data.get("entity_id"),
+                user_id=data.get("user_id"),
+                status=data.get("status"),
+                limit=limit
+            )
+            
+            entries = []
+            for task in history:
+                entries.append({
+                    "task_id": task.get("timer_id") or task.get("schedule_id"),
+                    "entity_id": task.get("entity_id"),
+                    "entity_name": task.get("entity_name"),
+                    "status": task.get("status"),
+                    "is_recurring": task.get("is_recurring", False),
+                    "repeat_type": task.get("repeat_type", "none"),
+                    "created_by": task.get("created_by"),
+                    "created_at": task.get("created_at"),
+                    "executed_at": task.get("executed_at"),
+                    "cancelled_at": task.get("cancelled_at"),
+                    "archived_at": task.get("archived_at"),
+                    "error": task.get("error")
+                })
+            
+            self.fire_event(
+                "timer_backend_response",
+                action="history_list",
+                history=entries,
+                count=len(entries),
+                total=self.get_history_count(),
+                source="timer_backend",
+                timestamp=self.datetime_to_iso(self.get_local_now()),
+                time_zone=self.time_zone
+            )
+            
+        except Exception as e:
+            self.log(f"Failed to send history list: {e}", level="ERROR")
+    
+    def restore_tasks(self, kwargs):
+        """恢复保存的任务
+        
+        启动时只解析活跃任务，全部加入到期队列后统一设置一次唤醒；
+        历史任务在首次查询或全量写入时才加载。只保存恢复过程中改变的任务。
+        """
+        start = time.perf_counter()
+        try:
+            # 确保文件存在
+            self.ensure_file_exists()
+            
+            if self.store.exists():
+                active_data, history_data = self.store.load_partitioned()
+                
+                stats = self.restore_stats
+                changed_ids = []
+                now_ts = int(time.time())
+                for timer_id, timer_data in active_data.items():
+                    try:
+                        task = Task.from_dict(timer_id, timer_data, self.clock)
+                    except (KeyError, ValueError) as e:
+                        self.log(f"Skipping invalid task {timer_id}: {e}", level="WARNING")
+                        stats["skipped"] += 1
+                        continue
+                    
+                    if task.is_recurring:
+                        # 恢复周期任务，下次执行时间变化时需要保存
+                        previous_next = task.next_execution_ts
+                        if self.restore_recurring_timer(timer_id, task):
+                            stats["schedules"] += 1
+                            if task.next_execution_ts != previous_next:
+                                changed_ids.append(timer_id)
+                            # 停机期间错过的执行按策略补执行
+                            if previous_next is not None and previous_next <= now_ts:
+                                missed = self.get_missed_executions(task, previous_next, now_ts)
+                                for missed_ts in missed:
+                                    self.catch_up_queue.append((timer_id, "schedule", missed_ts))
+                                stats["caught_up"] += len(missed)
+                        else:
+                            stats["skipped"] += 1
+                    elif task.end_ts is not None and task.end_ts > now_ts:
+                        # 重新安排定时器（恢复完成后统一设置唤醒）
+                        kind = "climate" if task.is_climate else "timer"
+                        self.schedule_task(timer_id, task.end_ts, kind, arm=False)
+                        
+                        self.entity_timers[task.entity_id] = timer_id
+                        self.add_task(timer_id, task, record=False)
+                        stats["timers"] += 1
+                    elif self.should_catch_up(task, task.end_ts, now_ts):
+                        # 停机期间到期的定时器补执行（保持活跃直到执行完成）
+                        kind = "climate" if task.is_climate else "timer"
+                        self.catch_up_queue.append((timer_id, kind, task.end_ts))
+                        self.catch_up_pending.add(timer_id)
+                        self.entity_timers[task.entity_id] = timer_id
+                        self.add_task(timer_id, task, record=False)
+                        stats["caught_up"] += 1
+                    else:
+                        # 标记为过期，移入历史
+                        task.status = TaskStatus.EXPIRED
+                        task.archived_ts = now_ts
+                        self.history[timer_id] = task
+                        self.index.add(timer_id, task)
+                        changed_ids.append(timer_id)
+                        stats["expired"] += 1
+                
+                # 历史任务延迟加载
+                self.deferred_history = history_data
+                self.history_loaded = False
+                stats["history_deferred"] = len(history_data) if history_data is not None else None
+                self.arm_scheduler()
+                self.mark_state_entity_dirty()
+                self.start_catch_up()
+                
+                # 没有变化时不重写存储
+                if changed_ids:
+                    self.save_tasks(*changed_ids)
+                stats["saved"] = len(changed_ids)
+                stats["seconds"] = round(time.perf_counter() - start, 3)
+                if stats["history_deferred"] is None:
+                    history_note = "history left in store"
+                else:
+                    history_note = f"{stats['history_deferred']} history entries deferred"
+                self.log(
+                    f"Restored {stats['timers']} timers and {stats['schedules']} recurring schedules "
+                    f"in {stats['seconds']}s ({stats['expired']} expired, {stats['caught_up']} to catch up, "
+                    f"{stats['skipped']} skipped, {history_note})"
+                )
+                
+            else:
+                self.log("No task file found, starting with empty tasks")
+                self.reset_tasks()
+                
+        except json.JSONDecodeError:
+            self.log("Task file is empty or corrupted, starting fresh")
+            self.reset_tasks()
+            self.save_tasks()
+        except Exception as e:
+            self.log(f"Failed to restore tasks: {e}", level="ERROR")
+            self.reset_tasks()
+    
+    def restore_recurring_timer(self, timer_id: str, schedule: Schedule) -> bool:
+        """恢复周期定时器（加入到期队列，由调用方统一设置唤醒）"""
+        try:
+            if schedule.repeat_type is RepeatType.NONE or not schedule.schedule_time:
+                return False
+            
+            # 保存任务数据
+            self.add_task(timer_id, schedule, record=False)
+            
+            # 重新安排周期任务
+            self.schedule_recurring_timer(timer_id, schedule, arm=False)
+            
+            self.log(f"Restored recurring timer: {timer_id} - {schedule.repeat_type.value} at {schedule.schedule_time}", level="DEBUG")
+            return True
+            
+        except Exception as e:
+            self.log(f"Failed to restore recurring timer: {e}", level="ERROR")
+            return False
+    
+    def get_catch_up_mode(self, task: Task) -> str:
+        """任务的补执行策略（任务未设置时使用全局配置）"""
+        return task.catch_up if task.catch_up in CATCH_UP_MODES else self.catch_up
+    
+    def should_catch_up(self, task: Task, missed_ts: Optional[int], now_ts: float) -> bool:
+        """停机期间错过的执行是否需要补执行"""
+        if missed_ts is None:
+            return False
+        mode = self.get_catch_up_mode(task)
+        if mode == "all":
+            return True
+        return mode == "once" and now_ts - missed_ts <= self.catch_up_grace
+    
+    def get_missed_executions(self, schedule: Schedule, first_missed: int, now_ts: float) -> List[int]:
+        """按补执行策略返回周期任务需要补执行的时间（epoch秒，最早的在前）"""
+        mode = self.get_catch_up_mode(schedule)
+        if mode == "skip":
+            return []
+        
+        # 从第一次错过的执行开始，列出到现在为止所有错过的执行（最多保留最近的catch_up_max_runs次）
+        missed = deque([first_missed], maxlen=self.catch_up_max_runs)
+        rule = self.get_recurrence_rule(schedule)
+        current = first_missed
+        while True:
+            current = rule.next_after(current, self.clock)
+            if current is None or current > now_ts:
+                break
+            missed.append(current)
+        
+        if mode == "once":
+            latest = missed[-1]
+            return [latest] if now_ts - latest <= self.catch_up_grace else []
+        return list(missed)
+    
+    def start_catch_up(self):
+        """有待补执行的任务时安排分批执行"""
+        if self.catch_up_queue and self.catch_up_handle is None:
+            self.catch_up_stats["queued"] += len(self.catch_up_queue)
+            self.log(f"Catching up {len(self.catch_up_queue)} missed executions")
+            self.catch_up_handle = self.run_in(self.run_catch_up, 0)
+    
+    async def run_catch_up(self, kwargs):
+        """执行一批错过的任务（同一任务每批只执行一次），剩余的在catch_up_interval秒后继续"""
+        self.catch_up_handle = None
+        batch = []
+        deferred = []
+        task_ids = set()
+        while self.catch_up_queue and len(batch) < self.catch_up_batch_size:
+            item = self.catch_up_queue.popleft()
+            if item[0] in task_ids:
+                deferred.append(item)
+            else:
+                task_ids.add(item[0])
+                batch.append(item)
+        self.catch_up_queue.extendleft(reversed(deferred))
+        
+        plans = []
+        for task_id, kind, missed_ts in batch:
+            try:
+                plan = await self.prepare_execution(task_id, kind)
+            except Exception as e:
+                self.log(f"Failed to prepare catch-up for {task_id}: {e}", level="ERROR")
+                plan = None
+            if plan is None:
+                # 任务已取消或不存在
+                self.catch_up_stats["skipped"] += 1
+                continue
+            self.log(f"Catching up {kind} {task_id} missed at {epoch_to_iso(missed_ts)}")
+            plans.append(plan)
+        
+        await self.run_execution_plans(plans)
+        
+        for plan in plans:
+            try:
+                if plan["kind"] == "schedule":
+                    self.complete_schedule_execution(plan)
+                else:
+                    self.complete_timer_execution(plan)
+            except Exception as e:
+                self.log(f"Failed to complete catch-up for {plan['task_id']}: {e}", level="ERROR")
+        self.catch_up_stats["executed"] += len(plans)
+        # 执行完成（或重试已加入到期队列）后才移出，执行期间的列表清理不会提前将其标记为完成
+        self.catch_up_pending.difference_update(task_ids)
+        await self.arm_scheduler_async()
+        
+        if self.catch_up_queue:
+            self.catch_up_handle = self.run_in(self.run_catch_up, self.catch_up_interval)
+        else:
+            self.log("Catch-up completed")
+    
+    def parse_catch_up(self, data: dict) -> Optional[str]:
+        """校验前端传入的补执行策略（未传时返回None，使用全局配置）"""
+        catch_up = data.get("catch_up")
+        if catch_up in (None, ""):
+            return None
+        if catch_up not in CATCH_UP_MODES:
+            raise ValueError(f"Unsupported catch-up mode: {catch_up}")
+        return catch_up
+    
+    def schedule_task(self, task_id: str, due: float, kind: str, arm: bool = True):
+        """将任务加入到期队列（due为epoch秒，kind为timer/climate/schedule）"""
+        self.scheduler.push(task_id, due, kind)
+        if arm:
+            self.arm_scheduler()
+    
+    def unschedule_task(self, task_id: str) -> bool:
+        """从到期队列移除任务（惰性删除，已设置的唤醒无需取消）"""
+        self.unarmed_schedules.discard(task_id)
+        return self.scheduler.cancel(task_id)
+    
+    def arm_scheduler(self):
+        """确保有一个AppDaemon唤醒对准最早的到期时间"""
+        with self.scheduler.lock:
+            wakeup = self.plan_scheduler_wakeup()
+        self.start_scheduler_wakeup(wakeup)
+    
+    async def arm_scheduler_async(self):
+        """事件循环中的arm_scheduler（不阻塞等待调度器锁）"""
+        await self.acquire_scheduler_lock()
+        try:
+            wakeup = self.plan_scheduler_wakeup()
+        finally:
+            self.scheduler.lock.release()
+        self.start_scheduler_wakeup(wakeup)
+    
+    async def acquire_scheduler_lock(self):
+        """在事件循环中获取调度器锁：锁被工作线程占用时让出事件循环后重试，而不是阻塞等待"""
+        while not self.scheduler.lock.acquire(blocking=False):
+            await asyncio.sleep(0.001)
+    
+    def plan_scheduler_wakeup(self) -> Optional[tuple]:
+        """计算需要设置的唤醒（调用方持有调度器锁），返回(要取消的旧句柄, 令牌, 到期时间)，无需设置时返回None
+        
+        锁内只更新唤醒状态，run_in和cancel_timer由start_scheduler_wakeup在释放锁之后调用：
+        工作线程中的AppDaemon同步接口要等待事件循环执行，持锁调用会与事件循环中等待同一把锁的回调互相等待。
+        """
+        next_due = self.scheduler.next_due()
+        if next_due is None:
+            return None
+        if self.scheduler_deadline is not None and self.scheduler_deadline <= next_due:
+            return None
+        
+        # 已有更晚的唤醒，取消后重新设置
+        stale_handle = self.scheduler_handle
+        self.scheduler_handle = None
+        self.scheduler_token += 1
+        self.scheduler_deadline = next_due
+        return stale_handle, self.scheduler_token, next_due
+    
+    def start_scheduler_wakeup(self, wakeup: Optional[tuple]):
+        """取消旧唤醒并设置新唤醒（不持有调度器锁）"""
+        if wakeup is None:
+            return
+        stale_handle, token, next_due = wakeup
+        self.cancel_callback(stale_handle)
+        handle = self.run_in(self.run_due_tasks, max(0, next_due - time.time()), wakeup=token)
+        
+        # 期间已有更早的唤醒取代了这一个时取消它
+        if token == self.scheduler_token:
+            self.scheduler_handle = handle
+        else:
+            self.cancel_callback(handle)
+    
+    def cancel_scheduler_wakeup(self):
+        """取消当前的AppDaemon唤醒"""
+        with self.scheduler.lock:
+            handle = self.scheduler_handle
+            self.scheduler_handle = None
+            self.scheduler_deadline = None
+        self.cancel_callback(handle)
+    
+    def cancel_callback(self, handle):
+        """取消run_in返回的AppDaemon回调句柄"""
+        if handle is None:
+            return
+        try:
+            # 在异步上下文中run_in返回的是Future
+            if isinstance(handle, asyncio.Future):
+                if not handle.done():
+                    handle.cancel()
+                    return
+                handle = handle.result()
+            # 本类的cancel_timer用于取消任务，这里调用AppDaemon的同名方法
+            hass.Hass.cancel_timer(self, handle)
+        except Exception as e:
+            self.log(f"Failed to cancel callback: {e}", level="DEBUG")
+    
+    async def run_due_tasks(self, kwargs):
+        """调度器唤醒：批量执行所有已到期的任务，然后对准下一个到期时间"""
+        await self.acquire_scheduler_lock()
+        try:
+            if kwargs.get("wakeup") == self.scheduler_token:
+                self.scheduler_handle = None
+                self.scheduler_deadline = None
+            due_items = self.scheduler.pop_due(time.time() + self.scheduler_tolerance)
+        finally:
+            self.scheduler.lock.release()
+        
+        # 立即对准下一个到期时间，执行耗时较长时后续任务不会被推迟
+        await self.arm_scheduler_async()
+        
+        if self.metrics is not None:
+            # 触发延迟：实际触发时间 - 计划时间（容差内提前触发的记为0）
+            fired_at = time.time()
+            for task_id, kind, due in due_items:
+                self.metrics.observe(f"lateness.{kind}", fired_at - due)
+        
+        # 先为所有到期任务生成执行计划，合并服务调用后统一执行，再逐个更新任务状态
+        plans = []
+        prepared = await asyncio.gather(
+            *(self.prepare_execution(task_id, kind) for task_id, kind, due in due_items),
+            return_exceptions=True
+        )
+        for (task_id, kind, due), plan in zip(due_items, prepared):
+            if isinstance(plan, Exception):
+                self.log(f"Failed to dispatch due task {task_id}: {plan}", level="ERROR")
+            elif plan is not None:
+                plans.append(plan)
+        
+        await self.run_execution_plans(plans)
+        
+        for plan in plans:
+            try:
+                if plan["kind"] == "schedule":
+                    self.complete_schedule_execution(plan)
+                else:
+                    self.complete_timer_execution(plan)
+            except Exception as e:
+                self.log(f"Failed to complete due task {plan['task_id']}: {e}", level="ERROR")
+        
+        if len(due_items) > 1:
+            self.log(f"Dispatched {len(due_items)} due tasks in one batch")
+        
+        await self.arm_scheduler_async()
+    
+    async def prepare_execution(self, task_id: str, kind: str) -> Optional[dict]:
+        """生成到期任务的执行计划（要按顺序调用的服务列表）"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            self.log(f"Task {task_id} not found", level="DEBUG")
+            return None
+        
+        # 检查是否已取消或禁用
+        if not task.is_active:
+            self.log(f"Task {task_id} is not active, skipping execution")
+            return None
+        
+        plan = {"task_id": task_id, "kind": kind, "task": task, "action": {}, "calls": [], "error": None}
+        try:
+            if task.is_group:
+                if kind == "schedule":
+                    task.last_executed_ts = int(time.time())
+                plan["action"] = task.action if kind != "schedule" else {"type": "service_call"}
+                plan["member_calls"] = await self.prepare_group_calls(task)
+                plan["calls"] = [call for calls in plan["member_calls"].values() for call in calls]
+                return plan
+            
+            if kind == "schedule":
+                # 记录执行时间
+                task.last_executed_ts = int(time.time())
+                
+                # 使用异步方式刷新状态缓存，生成动作时同步读取缓存
+                try:
+                    await self.refresh_entity_state(task.entity_id)
+                except Exception as e:
+                    self.log(f"Failed to refresh state of {task.entity_id}: {e}", level="WARNING")
+                
+                if task.is_climate:
+                    action = self.generate_climate_action(task.entity_id, task.action_type, task.action_data)
+                else:
+                    current_state = self.get_entity_state(task.entity_id) or "unknown"
+                    action = self.generate_action(task.entity_id, task.action_type, current_state)
+            else:
+                action = task.action
+            
+            plan["action"] = action
+            plan["calls"] = self.build_service_calls(task.entity_id, action, task.action_type)
+        except Exception as e:
+            plan["error"] = str(e)
+        
+        return plan
+    
+    async def prepare_group_calls(self, task: Task) -> Dict[str, List[tuple]]:
+        """按执行时各成员的状态生成分组任务的服务调用 {成员: [(服务, 数据)]}"""
+        await asyncio.gather(*(self.refresh_entity_state(member) for member in task.members), return_exceptions=True)
+        action_data = getattr(task, "action_data", None)
+        member_calls = {}
+        for member in task.members:
+            if member.startswith("climate."):
+                action = self.generate_climate_action(member, task.action_type, action_data)
+            else:
+                action = self.generate_action(member, task.action_type, self.get_entity_state(member) or "unknown")
+            member_calls[member] = self.build_service_calls(member, action or {}, task.action_type)
+        return member_calls
+    
+    def build_service_calls(self, entity_id: str, action: dict, action_type: str = None) -> List[tuple]:
+        """将动作转换为服务调用列表[(服务, 数据)]"""
+        if action.get("type") != "service_call":
+            return []
+        
+        # 空调恢复操作：依次恢复温度、风速，最后设置模式
+        if action_type == "restore_previous" and "restore_data" in action:
+            restore_data = action["restore_data"]
+            calls = []
+            if restore_data.get("temperature"):
+                calls.append(("climate/set_temperature", {"entity_id": entity_id, "temperature": restore_data["temperature"]}))
+            if restore_data.get("fan_mode"):
+                calls.append(("climate/set_fan_mode", {"entity_id": entity_id, "fan_mode": restore_data["fan_mode"]}))
+            if restore_data.get("hvac_mode"):
+                calls.append(("climate/set_hvac_mode", {"entity_id": entity_id, "hvac_mode": restore_data["hvac_mode"]}))
+            return calls
+        
+        domain, service = action["service"].split(".")
+        return [(f"{domain}/{service}", dict(action.get("data", {})))]
+    
+    async def run_execution_plans(self, plans: List[dict]):
+        """执行计划中的服务调用
+        
+        只有一次调用的计划按服务和除entity_id外的数据分组，每组发起一次调用（entity_id为列表）；
+        多步调用（如空调恢复）和非幂等服务（如toggle）单独按顺序执行。不同实体的调用并发执行（经出站队列限流，受max_concurrent_actions限制），
+        同一实体的调用按到期顺序依次执行。
+        """
+        started = time.monotonic()
+        groups = OrderedDict()
+        units = []
+        for plan in plans:
+            calls = plan["calls"]
+            if plan["error"] or not calls:
+                continue
+            
+            if (self.group_service_calls and len(calls) == 1 and "member_calls" not in plan and
+                    isinstance(calls[0][1].get("entity_id"), str) and self.is_groupable_service(calls[0][0])):
+                service, data = calls[0]
+                shared_data = {key: value for key, value in data.items() if key != "entity_id"}
+                key = (service, json.dumps(shared_data, sort_keys=True, default=str))
+                if key not in groups:
+                    groups[key] = []
+                    units.append(groups[key])
+                groups[key].append(plan)
+            else:
+                units.append([plan])
+        
+        if not units:
+            return
+        
+        # 按到期顺序创建协程，同一实体的锁按创建顺序获得
+        await asyncio.gather(*(self.run_execution_unit(unit) for unit in units))
         
-        # 转换为时区感知的datetime
-        return self.tz.localize(local_naive)
+        elapsed = time.monotonic() - started
+        stats = self.execution_stats
+        stats["batches"] += 1
+        stats["last_batch_seconds"] = round(elapsed, 3)
+        stats["max_batch_seconds"] = round(max(stats["max_batch_seconds"], elapsed), 3)
+        stats["total_batch_seconds"] += elapsed
+        if self.metrics is not None:
+            self.metrics.observe("execution.batch", elapsed)
+        if len(units) > 1:
+            self.log(f"Executed {len(units)} service call units for {len(plans)} tasks in {elapsed:.3f}s")
     
-    def datetime_to_iso(self, dt: datetime) -> str:
-        """将datetime转换为ISO格式字符串（返回UTC时间，带Z后缀）"""
-        if dt.tzinfo is None:
-            # 如果没有时区信息，假设为本地时区
-            dt = self.tz.localize(dt)
-        # 转换为UTC并返回带Z后缀的ISO格式
-        utc_dt = dt.astimezone(pytz.UTC)
-        return utc_dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    def is_groupable_service(self, service: str) -> bool:
+        """服务是否可以合并调用（合并调用失败时会逐个重试，只适用于幂等服务）"""
+        return service.replace("/", ".").rsplit(".", 1)[-1] not in NON_IDEMPOTENT_SERVICES
     
-    def iso_to_datetime(self, iso_str: str) -> datetime:
-        """将ISO字符串转换为本地时区datetime"""
+    async def run_execution_unit(self, unit: List[dict]):
+        """执行一个调用单元（单个计划或合并调用的一组计划），持有相关实体的锁"""
+        entity_ids = sorted({
+            entity_id for plan in unit for entity_id in (plan["task"].members or [plan["task"].entity_id])
+        })
+        locks = [self.entity_locks.setdefault(entity_id, asyncio.Lock()) for entity_id in entity_ids]
+        
+        # 按固定顺序获取实体锁，避免合并调用之间死锁
+        for lock in locks:
+            await lock.acquire()
         try:
-            # 如果字符串以Z结尾，替换为+00:00以便fromisoformat解析
-            if iso_str.endswith('Z'):
-                iso_str = iso_str.replace('Z', '+00:00')
-            dt = datetime.fromisoformat(iso_str)
-            if dt.tzinfo is None:
-                # 如果没有时区信息，假设为本地时区
-                dt = self.tz.localize(dt)
-            return dt
-        except:
-            # 如果解析失败，尝试其他格式
-            try:
-                dt = datetime.strptime(iso_str, "%Y-%m-%d %H:%M:%S")
-                return self.tz.localize(dt)
-            except:
-                self.log(f"Failed to parse datetime: {iso_str}", level="WARNING")
-                return self.get_local_now()
+            if "member_calls" in unit[0]:
+                await self.run_group_task_calls(unit[0])
+            elif len(unit) == 1:
+                await self.run_service_calls(unit[0])
+            else:
+                await self.run_grouped_call(unit)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
     
-    def ensure_file_exists(self):
-        """确保文件存在，如果不存在则创建"""
+    async def run_grouped_call(self, group: List[dict]):
+        """对一组计划发起一次合并调用，失败时逐个调用"""
+        service, data = group[0]["calls"][0]
+        shared_data = {key: value for key, value in data.items() if key != "entity_id"}
+        entity_ids = [plan["calls"][0][1]["entity_id"] for plan in group]
         try:
-            # 确保目录存在
-            directory = os.path.dirname(self.persist_file)
-            if directory and not os.path.exists(directory):
-                os.makedirs(directory, exist_ok=True)
-                self.log(f"Created directory: {directory}")
-            
-            # 如果文件不存在，创建空文件
-            if not os.path.exists(self.persist_file):
-                with open(self.persist_file, 'w') as f:
-                    json.dump({}, f, indent=2)
-                self.log(f"Created empty task file: {self.persist_file}")
-                return True
-            return False
+            await self.dispatch_service_call(service, entity_id=entity_ids, **shared_data)
+            self.execution_stats["service_calls"] += 1
+            self.execution_stats["grouped_calls"] += 1
+            self.execution_stats["grouped_actions"] += len(group)
+            self.log(f"Grouped {service} call for {len(entity_ids)} entities")
         except Exception as e:
-            self.log(f"Failed to ensure file exists: {e}", level="ERROR")
-            return False
+            # 合并调用失败时逐个调用，确定每个任务各自的结果
+            self.log(f"Grouped {service} call failed: {e}, retrying individually", level="WARNING")
+            for plan in group:
+                await self.run_service_calls(plan)
     
-    def save_tasks(self):
-        """保存任务到文件"""
-        try:
-            # 确保文件存在
-            self.ensure_file_exists()
-            
-            # 保存文件
-            with open(self.persist_file, 'w') as f:
-                json.dump(self.tasks, f, indent=2, default=str)
-                
-            self.log(f"Tasks saved to {self.persist_file}")
-            
-        except Exception as e:
-            self.log(f"Failed to save tasks: {e}", level="ERROR")
-            # 尝试创建文件后重试
+    async def run_group_task_calls(self, plan: dict):
+        """执行分组任务：只有一次调用的成员按服务和其余数据合并为一次调用，多步调用和非幂等服务的成员逐个执行
+        
+        合并调用失败时逐个调用。每个成员的结果记录在plan["member_results"]中，全部失败时计划记为出错。
+        """
+        member_calls = plan["member_calls"]
+        errors = {}
+        groups = OrderedDict()
+        for member, calls in member_calls.items():
+            if not calls:
+                errors[member] = "No action"
+            elif (len(calls) == 1 and isinstance(calls[0][1].get("entity_id"), str) and
+                    self.is_groupable_service(calls[0][0])):
+                service, data = calls[0]
+                shared_data = {key: value for key, value in data.items() if key != "entity_id"}
+                key = (service, json.dumps(shared_data, sort_keys=True, default=str))
+                groups.setdefault(key, (service, shared_data, []))[2].append(member)
+            else:
+                for service, data in calls:
+                    try:
+                        await self.dispatch_service_call(service, **data)
+                        self.execution_stats["service_calls"] += 1
+                    except Exception as e:
+                        errors[member] = str(e)
+                        break
+        
+        for service, shared_data, members in groups.values():
             try:
-                self.ensure_file_exists()
-                with open(self.persist_file, 'w') as f:
-                    json.dump(self.tasks, f, indent=2, default=str)
-                self.log(f"Tasks saved after file creation: {self.persist_file}")
-            except Exception as retry_error:
-                self.log(f"Failed to save after retry: {retry_error}", level="ERROR")
+                await self.dispatch_service_call(service, entity_id=members if len(members) > 1 else members[0], **shared_data)
+                self.execution_stats["service_calls"] += 1
+                if len(members) > 1:
+                    self.execution_stats["grouped_calls"] += 1
+                    self.execution_stats["grouped_actions"] += len(members)
+            except Exception as e:
+                if len(members) == 1:
+                    errors[members[0]] = str(e)
+                    continue
+                self.log(f"Grouped {service} call failed: {e}, retrying individually", level="WARNING")
+                for member in members:
+                    try:
+                        await self.dispatch_service_call(service, entity_id=member, **shared_data)
+                        self.execution_stats["service_calls"] += 1
+                    except Exception as member_error:
+                        errors[member] = str(member_error)
+        
+        # 精简记录：成功数和失败成员的错误
+        results = {"succeeded": len(member_calls) - len(errors), "failed": len(errors)}
+        if errors:
+            results["errors"] = errors
+        plan["member_results"] = results
+        if errors and len(errors) == len(member_calls):
+            plan["error"] = f"All {len(member_calls)} members failed"
     
-    def restore_tasks(self, kwargs):
-        """恢复保存的任务"""
+    async def dispatch_service_call(self, service: str, **data):
+        """经出站队列发出服务调用（按优先级、限流和并发上限排队）"""
+        key, priority = self.dispatcher.resolve(service, data.get("entity_id"))
+        waited = await self.dispatcher.acquire(key, priority)
+        if self.metrics is not None:
+            self.metrics.observe(f"dispatch.{key or service.split('/')[0]}", waited)
         try:
-            # 确保文件存在
-            self.ensure_file_exists()
-            
-            if os.path.exists(self.persist_file):
-                with open(self.persist_file, 'r') as f:
-                    data = json.load(f)
-                
-                restored = 0
-                recurring_restored = 0
-                for timer_id, timer_data in data.items():
-                    # 检查是否为周期任务
-                    repeat_type = timer_data.get("repeat_type", "none")
-                    schedule_time = timer_data.get("schedule_time")
-                    
-                    if repeat_type != "none" and schedule_time:
-                        # 恢复周期任务
-                        self.restore_recurring_timer(timer_id, timer_data)
-                        recurring_restored += 1
-                    elif timer_data.get("status") == "active":
-                        # 恢复一次性定时器
-                        entity_id = timer_data["entity_id"]
-                        
-                        # 检查是否过期（使用本地时区）
-                        end_time = self.iso_to_datetime(timer_data["end_time"])
-                        now = self.get_local_now()
-                        
-                        if end_time > now:
-                            remaining = (end_time - now).total_seconds()
-                            
-                            # 选择正确的执行函数
-                            if timer_data.get("is_climate"):
-                                execute_func = self.execute_climate_timer
-                            else:
-                                execute_func = self.execute_timer
-                            
-                            # 重新安排定时器
-                            timer_handle = self.run_in(
-                                execute_func,
-                                remaining,
-                                timer_id=timer_id
-                            )
-                            
-                            self.timers[timer_id] = timer_handle
-                            self.entity_timers[entity_id] = timer_id
-                            self.tasks[timer_id] = timer_data
-                            restored += 1
-                        else:
-                            # 标记为过期
-                            timer_data["status"] = "expired"
-                
-                self.save_tasks()
-                self.log(f"Restored {restored} timers and {recurring_restored} recurring schedules")
-                
-            else:
-                self.log("No task file found, starting with empty tasks")
-                self.tasks = {}
-                
-        except json.JSONDecodeError:
-            self.log("Task file is empty or corrupted, starting fresh")
-            self.tasks = {}
-            self.save_tasks()
-        except Exception as e:
-            self.log(f"Failed to restore tasks: {e}", level="ERROR")
-            self.tasks = {}
+            return await self.call_service(service, **data)
+        finally:
+            self.dispatcher.release()
     
-    def restore_recurring_timer(self, timer_id: str, timer_data: dict):
-        """恢复周期定时器"""
-        try:
-            repeat_type = timer_data.get("repeat_type")
-            schedule_time = timer_data.get("schedule_time")
-            
-            if not repeat_type or not schedule_time:
+    async def run_service_calls(self, plan: dict):
+        """按顺序执行单个计划的服务调用，出错时记录到计划中"""
+        for service, data in plan["calls"]:
+            try:
+                await self.dispatch_service_call(service, **data)
+                self.execution_stats["service_calls"] += 1
+            except Exception as e:
+                plan["error"] = str(e)
                 return
-            
-            # 保存任务数据
-            self.tasks[timer_id] = timer_data
-            
-            # 重新安排周期任务
-            self.schedule_recurring_timer(timer_id, timer_data)
-            
-            self.log(f"Restored recurring timer: {timer_id} - {repeat_type} at {schedule_time}")
-            
-        except Exception as e:
-            self.log(f"Failed to restore recurring timer: {e}", level="ERROR")
     
     def handle_climate_state_change(self, entity, attribute, old, new, kwargs):
         """监听空调状态变化，保存之前的设置"""
         if entity.startswith("climate.") and attribute == "state":
             if entity not in self.climate_previous_states:
                 # 保存当前完整状态
-                current_state = self.get_state(entity, attribute="all")
+                current_state = self.get_entity_state(entity, attribute="all")
                 if current_state:
                     self.climate_previous_states[entity] = {
                         "hvac_mode": current_state.get("attributes", {}).get("hvac_mode"),
@@ -266,26 +2472,306 @@ class TimerBackend(hass.Hass):
                         "saved_at": self.get_local_now().isoformat()
                     }
     
+    def respond(self, **event_data):
+        """发送操作响应（batch命令执行期间先收集，最后合并为一个响应）"""
+        if self.batch is not None:
+            self.batch["responses"].append(event_data)
+            return
+        self.fire_event("timer_backend_response", **event_data)
+    
+    def get_entity_state(self, entity_id: str, attribute: str = None):
+        """读取实体状态，参数与get_state相同
+        
+        优先使用状态缓存；attribute="all"时只包含EntityStateCache.ATTRIBUTES中的属性。
+        """
+        if not self.state_cache.enabled:
+            value = self.get_state(entity_id, attribute=attribute)
+            if not (asyncio.iscoroutine(value) or asyncio.isfuture(value)):
+                return value
+            # 异步上下文中无法同步读取，使用refresh_entity_state刚读取的状态
+            if asyncio.iscoroutine(value):
+                value.close()
+            full_state = self.fetched_states.get(entity_id)
+            if full_state is None:
+                self.log(f"State of {entity_id} not fetched in async context", level="DEBUG")
+                return None
+            if attribute is None:
+                return full_state.get("state")
+            if attribute == "all":
+                return full_state
+            return (full_state.get("attributes") or {}).get(attribute)
+        
+        entry = self.state_cache.get(entity_id)
+        if entry is None:
+            full_state = self.get_state(entity_id, attribute="all")
+            if asyncio.iscoroutine(full_state) or asyncio.isfuture(full_state):
+                # 异步上下文中无法同步读取，调用方应先await refresh_entity_state
+                if asyncio.iscoroutine(full_state):
+                    full_state.close()
+                self.log(f"State of {entity_id} not cached in async context", level="DEBUG")
+                return None
+            self.cache_entity_state(entity_id, full_state)
+            entry = self.state_cache.entries.get(entity_id)
+            if entry is None:
+                return None
+        
+        state, attributes, _ = entry
+        if attribute is None:
+            return state
+        if attribute == "all":
+            return {"state": state, "attributes": dict(attributes)}
+        return attributes.get(attribute)
+    
+    async def refresh_entity_state(self, entity_id: str):
+        """异步上下文中确保之后可同步读取实体状态（关闭缓存时每次重新读取）"""
+        if not self.state_cache.enabled:
+            full_state = await self.get_state(entity_id, attribute="all")
+            if full_state:
+                self.fetched_states[entity_id] = full_state
+            else:
+                self.fetched_states.pop(entity_id, None)
+            return
+        if self.state_cache.get(entity_id) is not None:
+            return
+        self.cache_entity_state(entity_id, await self.get_state(entity_id, attribute="all"))
+    
+    def cache_entity_state(self, entity_id: str, full_state: Optional[dict]):
+        """写入状态缓存，首次缓存的实体开始监听其状态变化"""
+        self.state_cache.update(entity_id, full_state)
+        if full_state and entity_id not in self.watched_entities:
+            self.watched_entities.add(entity_id)
+            self.listen_state(self.handle_cached_state_change, entity_id, attribute="all")
+    
+    def handle_cached_state_change(self, entity, attribute, old, new, kwargs):
+        """已缓存实体的状态变化时更新缓存"""
+        self.state_cache.update(entity, new)
+    
+    def validate_batch_operation(self, operation, simulated: dict) -> Optional[str]:
+        """校验batch命令中的单个操作，返回错误信息（校验通过时返回None）
+        
+        simulated记录批次中前面的操作已取消的任务ID（cancelled）和新建定时器占用的实体（claimed），
+        校验时按顺序模拟执行，发现同一批次内部的冲突。
+        """
+        if not isinstance(operation, dict):
+            return "Operation must be an object"
+        
+        action = operation.get("action")
+        if action not in BATCH_ACTIONS:
+            return f"Unsupported batch action: {action}"
+        
+        try:
+            if action == "cancel_entity_timer":
+                entity_id = operation.get("entity_id")
+                if not entity_id:
+                    raise ValueError("Entity ID is required")
+                timer_id = self.entity_timers.get(entity_id)
+                has_timer = timer_id in self.tasks and timer_id not in simulated["cancelled"]
+                if not has_timer and entity_id not in simulated["claimed"]:
+                    raise ValueError(f"No active timer for entity: {entity_id}")
+                if timer_id is not None:
+                    simulated["cancelled"].add(timer_id)
+                simulated["claimed"].discard(entity_id)
+                
+            elif action in ("cancel_timer", "cancel_schedule"):
+                id_key = "timer_id" if action == "cancel_timer" else "schedule_id"
+                task_id = operation.get(id_key)
+                if task_id not in self.tasks:
+                    raise ValueError(f"Task not found: {task_id}")
+                if task_id in simulated["cancelled"]:
+                    raise ValueError(f"Task already cancelled in this batch: {task_id}")
+                if action == "cancel_schedule" and not self.tasks[task_id].is_recurring:
+                    raise ValueError(f"Task {task_id} is not a recurring schedule")
+                simulated["cancelled"].add(task_id)
+                
+            elif action in ("create_group_timer", "create_group_schedule"):
+                group_id, _ = self.resolve_group_target(operation)
+                self.validate_group_action_type(operation)
+                if action == "create_group_schedule":
+                    self.build_recurrence_rule(operation)
+                else:
+                    self.parse_duration(operation.get("duration", "00:30:00"))
+                    if group_id:
+                        self.claim_batch_entity(group_id, simulated)
+                
+            else:
+                entity_id = operation.get("entity_id")
+                if not entity_id:
+                    raise ValueError("Entity ID is required")
+                if action == "create_climate_timer" and not entity_id.startswith("climate."):
+                    raise ValueError("Climate entity required")
+                if self.get_entity_state(entity_id) is None:
+                    raise ValueError(f"Entity {entity_id} does not exist")
+                
+                # 空调定时器带周期参数时按周期任务创建
+                is_schedule = action == "create_schedule" or (
+                    entity_id.startswith("climate.") and
+                    operation.get("repeat_type", "none") != "none" and operation.get("schedule_time")
+                )
+                if is_schedule:
+                    self.build_recurrence_rule(operation)
+                else:
+                    self.parse_duration(operation.get("duration", "00:30:00"))
+                    self.claim_batch_entity(entity_id, simulated)
+                    
+        except Exception as e:
+            return str(e)
+        
+        return None
+    
+    def claim_batch_entity(self, entity_id: str, simulated: dict):
+        """模拟新建定时器：同一批次中每个实体只能新建一个定时器，实体原有的定时器会被替换"""
+        if entity_id in simulated["claimed"]:
+            raise ValueError(f"Entity {entity_id} already has a timer in this batch")
+        simulated["claimed"].add(entity_id)
+        replaced_id = self.entity_timers.get(entity_id)
+        if replaced_id is not None:
+            simulated["cancelled"].add(replaced_id)
+    
+    def execute_batch(self, data: dict):
+        """执行batch命令
+        
+        先校验全部操作，任一操作无效时整体拒绝；全部通过后依次执行，
+        合并为一次保存、一个timers_changes增量事件和一个batch_result响应。
+        """
+        operations = data.get("operations")
+        request_id = data.get("request_id")
+        
+        if self.batch is not None or not isinstance(operations, list) or not operations:
+            self.fire_event(
+                "timer_backend_response",
+                action="batch_result",
+                request_id=request_id,
+                success=False,
+                applied=False,
+                error="Batch requires a non-empty list of operations",
+                results=[]
+            )
+            return
+        
+        start_revision = self.revision
+        self.batch = {"dirty": set(), "full": False, "responses": []}
+        results = []
+        applied = False
+        
+        try:
+            simulated = {"cancelled": set(), "claimed": set()}
+            errors = [self.validate_batch_operation(operation, simulated) for operation in operations]
+            
+            if any(errors):
+                for index, (operation, error) in enumerate(zip(operations, errors)):
+                    results.append({
+                        "index": index,
+                        "action": operation.get("action") if isinstance(operation, dict) else None,
+                        "success": error is None,
+                        "error": error
+                    })
+            else:
+                applied = True
+                for index, operation in enumerate(operations):
+                    operation = dict(operation)
+                    operation.setdefault("user_id", data.get("user_id", "unknown"))
+                    
+                    response_count = len(self.batch["responses"])
+                    outcome = self.handle_frontend_event("batch", operation, {})
+                    responses = self.batch["responses"][response_count:]
+                    
+                    result = responses[-1] if responses else {}
+                    success = result.get("action") != "error"
+                    error = result.get("error")
+                    if operation["action"] in BATCH_CANCEL_ACTIONS and not outcome:
+                        # 取消操作找不到目标时不发送响应，以返回值为准
+                        success = False
+                        error = error or "Nothing to cancel"
+                    results.append({
+                        "index": index,
+                        "action": operation["action"],
+                        "success": success,
+                        "error": error,
+                        "result": result
+                    })
+                    
+        finally:
+            batch = self.batch
+            self.batch = None
+            
+            # 一次保存
+            if batch["full"]:
+                self.save_tasks()
+            elif batch["dirty"]:
+                self.save_tasks(*batch["dirty"])
+            
+            # 一个增量事件
+            if self.delta_events and self.revision > start_revision:
+                self.fire_event(
+                    "timer_backend_response",
+                    action="timers_changes",
+                    since_revision=start_revision,
+                    revision=self.revision,
+                    changes=self.collect_changes_since(start_revision),
+                    source="timer_backend",
+                    time_zone=self.time_zone
+                )
+        
+        succeeded = sum(1 for result in results if result["success"])
+        self.fire_event(
+            "timer_backend_response",
+            action="batch_result",
+            request_id=request_id,
+            success=applied and succeeded == len(results),
+            applied=applied,
+            results=results,
+            count=len(results),
+            succeeded=succeeded,
+            revision=self.revision,
+            source="timer_backend",
+            time_zone=self.time_zone
+        )
+        self.log(f"Batch {'applied' if applied else 'rejected'}: {succeeded}/{len(results)} operations succeeded")
+    
     def handle_frontend_event(self, event_name, data, kwargs):
-        """处理前端事件"""
+        """处理前端事件（开启指标时按动作记录处理耗时）"""
         action = data.get("action")
+        if self.metrics is None:
+            return self.dispatch_frontend_event(action, data)
         
+        start = time.perf_counter()
+        try:
+            return self.dispatch_frontend_event(action, data)
+        finally:
+            self.metrics.observe(f"action.{action}", time.perf_counter() - start)
+    
+    def dispatch_frontend_event(self, action: str, data: dict):
+        """按动作分发前端事件（取消操作返回处理结果，供batch命令使用）"""
         if action == "create_timer":
             self.create_timer(data)
         elif action == "get_all_timers":
-            self.send_all_timers(data.get("user_id"))
+            self.request_all_timers(data.get("user_id"))
         elif action == "cancel_timer":
-            self.cancel_timer(data.get("timer_id"))
+            return self.cancel_timer(data.get("timer_id"))
         elif action == "cancel_entity_timer":
-            self.cancel_entity_timer(data.get("entity_id"), data.get("user_id"))
+            return self.cancel_entity_timer(data.get("entity_id"), data.get("user_id"))
         elif action == "create_climate_timer":
             self.create_climate_timer(data)
         elif action == "create_schedule":
             self.create_schedule(data)
+        elif action == "create_group_timer":
+            self.create_group_timer(data)
+        elif action == "create_group_schedule":
+            self.create_group_schedule(data)
         elif action == "cancel_schedule":
-            self.cancel_schedule(data.get("schedule_id"))
+            return self.cancel_schedule(data.get("schedule_id"))
         elif action == "get_all_schedules":
             self.send_all_schedules(data.get("user_id"))
+        elif action == "get_history":
+            self.send_history(data)
+        elif action == "get_changes_since":
+            self.send_changes_since(data.get("revision"), data.get("user_id"))
+        elif action == "get_stats":
+            self.send_stats()
+        elif action == "preview_schedule":
+            self.send_schedule_preview(data)
+        elif action == "batch":
+            self.execute_batch(data)
     
     def create_timer(self, data):
         """创建通用定时器"""
@@ -297,7 +2783,7 @@ class TimerBackend(hass.Hass):
                 raise ValueError("Entity ID is required")
             
             # 检查实体是否存在
-            state = self.get_state(entity_id)
+            state = self.get_entity_state(entity_id)
             if state is None:
                 raise ValueError(f"Entity {entity_id} does not exist")
             
@@ -315,67 +2801,50 @@ class TimerBackend(hass.Hass):
             # 生成ID
             timer_id = str(uuid.uuid4())
             
-            # 计算时间（使用本地时区）
-            start_time = self.get_local_now()
-            end_time = start_time + duration
+            # 计算时间（epoch秒）
+            start_ts = int(time.time())
+            end_ts = start_ts + int(duration.total_seconds())
             
-            # 创建任务数据
-            timer_data = {
-                "timer_id": timer_id,
-                "entity_id": entity_id,
-                "duration": duration_str,
-                "start_time": self.datetime_to_iso(start_time),
-                "end_time": self.datetime_to_iso(end_time),
-                "status": "active",
-                "entity_name": self.get_friendly_name(entity_id),
-                "entity_state": state,
-                "domain": entity_id.split(".")[0],
-                "created_by": data.get("user_id", "unknown"),
-                "created_at": self.datetime_to_iso(self.get_local_now()),
-                "action": self.generate_action(entity_id, data.get("action_type", "auto")),
-                "repeat_type": "none",
-                "is_recurring": False
-            }
+            # 创建任务
+            timer = Timer(
+                timer_id, entity_id, duration_str, start_ts, end_ts,
+                self.generate_action(entity_id, data.get("action_type", "auto")),
+                entity_name=self.get_friendly_name(entity_id),
+                entity_state=state,
+                created_by=data.get("user_id", "unknown"),
+                created_ts=start_ts,
+                catch_up=self.parse_catch_up(data)
+            )
             
             # 设置定时器
-            timer_handle = self.run_in(
-                self.execute_timer, 
-                duration.total_seconds(), 
-                timer_id=timer_id
-            )
+            self.schedule_task(timer_id, end_ts, "timer")
             
             # 保存
-            self.timers[timer_id] = timer_handle
             self.entity_timers[entity_id] = timer_id
-            self.tasks[timer_id] = timer_data
-            self.save_tasks()
+            self.add_task(timer_id, timer)
+            self.save_tasks(timer_id)
             
             # 发送响应
             response_data = {
                 "action": "timer_created",
                 "timer_id": timer_id,
                 "entity_id": entity_id,
-                "entity_name": timer_data["entity_name"],
+                "entity_name": timer.entity_name,
                 "duration": duration_str,
-                "end_time": self.datetime_to_iso(end_time),
+                "end_time": epoch_to_iso(end_ts),
                 "status": "active",
-                "action_description": self.get_action_description(timer_data["action"]),
-                "message": f"Timer set for {timer_data['entity_name']}",
+                "action_description": self.get_action_description(timer.action),
+                "message": f"Timer set for {timer.entity_name}",
                 "time_zone": self.time_zone
             }
             
-            self.fire_event("timer_backend_response", **response_data)
+            self.respond(**response_data)
             
             self.log(f"Timer created: {entity_id} - {duration_str}")
             
         except Exception as e:
             self.log(f"Failed to create timer: {e}", level="ERROR")
-            self.fire_event(
-                "timer_backend_response",
-                action="error",
-                error=str(e),
-                success=False
-            )
+            self.respond(action="error", error=str(e), success=False)
     
     def create_climate_timer(self, data):
         """创建空调专用定时器"""
@@ -391,7 +2860,7 @@ class TimerBackend(hass.Hass):
             if not entity_id.startswith("climate."):
                 raise ValueError("Climate entity required")
             
-            state = self.get_state(entity_id)
+            state = self.get_entity_state(entity_id)
             if state is None:
                 raise ValueError(f"Climate entity {entity_id} does not exist")
             
@@ -413,12 +2882,12 @@ class TimerBackend(hass.Hass):
             # 生成ID
             timer_id = str(uuid.uuid4())
             
-            # 计算时间（使用本地时区）
-            start_time = self.get_local_now()
-            end_time = start_time + duration
+            # 计算时间（epoch秒）
+            start_ts = int(time.time())
+            end_ts = start_ts + int(duration.total_seconds())
             
             # 获取当前空调状态
-            current_state = self.get_state(entity_id, attribute="all")
+            current_state = self.get_entity_state(entity_id, attribute="all")
             current_attrs = current_state.get("attributes", {}) if current_state else {}
             
             # 保存当前状态（用于恢复）
@@ -440,67 +2909,49 @@ class TimerBackend(hass.Hass):
                 data.get("action_data", {})
             )
             
-            # 创建任务数据
-            timer_data = {
-                "timer_id": timer_id,
-                "entity_id": entity_id,
-                "duration": duration_str,
-                "start_time": self.datetime_to_iso(start_time),
-                "end_time": self.datetime_to_iso(end_time),
-                "status": "active",
-                "entity_name": self.get_friendly_name(entity_id),
-                "entity_state": state,
-                "domain": "climate",
-                "created_by": data.get("user_id", "unknown"),
-                "created_at": self.datetime_to_iso(self.get_local_now()),
-                "action": action,
-                "previous_state": self.climate_previous_states.get(entity_id, {}),
-                "is_climate": True,
-                "repeat_type": "none",
-                "is_recurring": False
-            }
+            # 创建任务
+            timer = Timer(
+                timer_id, entity_id, duration_str, start_ts, end_ts, action,
+                entity_name=self.get_friendly_name(entity_id),
+                entity_state=state,
+                created_by=data.get("user_id", "unknown"),
+                created_ts=start_ts,
+                is_climate=True,
+                previous_state=self.climate_previous_states.get(entity_id, {}),
+                catch_up=self.parse_catch_up(data)
+            )
             
             # 设置定时器
-            timer_handle = self.run_in(
-                self.execute_climate_timer, 
-                duration.total_seconds(), 
-                timer_id=timer_id
-            )
+            self.schedule_task(timer_id, end_ts, "climate")
             
             # 保存
-            self.timers[timer_id] = timer_handle
             self.entity_timers[entity_id] = timer_id
-            self.tasks[timer_id] = timer_data
-            self.save_tasks()
+            self.add_task(timer_id, timer)
+            self.save_tasks(timer_id)
             
             # 发送响应
             response_data = {
                 "action": "timer_created",
                 "timer_id": timer_id,
                 "entity_id": entity_id,
-                "entity_name": timer_data["entity_name"],
+                "entity_name": timer.entity_name,
                 "duration": duration_str,
-                "end_time": self.datetime_to_iso(end_time),
+                "end_time": epoch_to_iso(end_ts),
                 "status": "active",
                 "action_description": self.get_climate_action_description(action),
-                "previous_mode": timer_data["previous_state"].get("hvac_mode", "Unknown"),
+                "previous_mode": timer.previous_state.get("hvac_mode", "Unknown"),
                 "target_action": action_type,
-                "message": f"Climate timer set for {timer_data['entity_name']}",
+                "message": f"Climate timer set for {timer.entity_name}",
                 "time_zone": self.time_zone
             }
             
-            self.fire_event("timer_backend_response", **response_data)
+            self.respond(**response_data)
             
             self.log(f"Created climate timer: {entity_id} - {duration_str} - Action: {action_type}")
             
         except Exception as e:
             self.log(f"Failed to create climate timer: {e}", level="ERROR")
-            self.fire_event(
-                "timer_backend_response",
-                action="error",
-                error=str(e),
-                success=False
-            )
+            self.respond(action="error", error=str(e), success=False)
     
     def create_schedule(self, data: dict):
         """创建周期定时任务"""
@@ -513,67 +2964,43 @@ class TimerBackend(hass.Hass):
             if not entity_id:
                 raise ValueError("Entity ID is required")
             
-            if repeat_type == "none":
-                raise ValueError("Repeat type must be specified for schedule")
-            
-            if not schedule_time:
-                raise ValueError("Schedule time must be specified")
+            # 校验并编译周期规则
+            rule = self.build_recurrence_rule(data)
+            repeat = rule.repeat_type
             
             # 检查实体是否存在
-            state = self.get_state(entity_id)
+            state = self.get_entity_state(entity_id)
             if state is None:
                 raise ValueError(f"Entity {entity_id} does not exist")
             
             # 生成ID
             schedule_id = str(uuid.uuid4())
             
-            # 解析时间
-            time_parts = schedule_time.split(":")
-            if len(time_parts) != 3:
-                raise ValueError("Schedule time must be in HH:MM:SS format")
-            
-            hour, minute, second = map(int, time_parts)
-            
-            # 创建任务数据
-            schedule_data = {
-                "schedule_id": schedule_id,
-                "entity_id": entity_id,
-                "repeat_type": repeat_type,
-                "schedule_time": schedule_time,
-                "status": "active",
-                "entity_name": self.get_friendly_name(entity_id),
-                "entity_state": state,
-                "domain": entity_id.split(".")[0],
-                "created_by": data.get("user_id", "unknown"),
-                "created_at": self.datetime_to_iso(self.get_local_now()),
-                "action_type": action_type,
-                "action_data": data.get("action_data", {}),
-                "is_recurring": True,
-                "last_executed": None,
-                "next_execution": None,
-                "time_zone": self.time_zone
-            }
+            # 创建任务
+            schedule = Schedule(
+                schedule_id, entity_id, repeat, schedule_time,
+                action_data=data.get("action_data", {}),
+                entity_name=self.get_friendly_name(entity_id),
+                entity_state=state,
+                created_by=data.get("user_id", "unknown"),
+                action_type=action_type,
+                catch_up=self.parse_catch_up(data)
+            )
             
             # 处理特定类型的参数
-            if repeat_type == "weekly":
-                weekdays = data.get("weekdays", [])
-                if not weekdays:
-                    raise ValueError("Weekdays must be specified for weekly schedule")
-                schedule_data["weekdays"] = weekdays
-                
-            elif repeat_type == "monthly":
-                month_days = data.get("month_days", [])
-                if not month_days:
-                    raise ValueError("Month days must be specified for monthly schedule")
-                schedule_data["month_days"] = month_days
+            if repeat is RepeatType.WEEKLY:
+                schedule.weekdays = data["weekdays"]
+            elif repeat is RepeatType.MONTHLY:
+                schedule.month_days = data["month_days"]
+            schedule.rule = rule
             
             # 如果是空调，保存当前状态
             if entity_id.startswith("climate."):
-                current_state = self.get_state(entity_id, attribute="all")
+                current_state = self.get_entity_state(entity_id, attribute="all")
                 current_attrs = current_state.get("attributes", {}) if current_state else {}
                 
                 if self.climate_config["save_state_on_timer"]:
-                    schedule_data["previous_state"] = {
+                    schedule.previous_state = {
                         "hvac_mode": current_attrs.get("hvac_mode", "off"),
                         "temperature": current_attrs.get("temperature"),
                         "fan_mode": current_attrs.get("fan_mode"),
@@ -581,397 +3008,346 @@ class TimerBackend(hass.Hass):
                         "preset_mode": current_attrs.get("preset_mode"),
                         "saved_at": self.datetime_to_iso(self.get_local_now())
                     }
-                schedule_data["is_climate"] = True
-            else:
-                schedule_data["is_climate"] = False
+                schedule.is_climate = True
             
             # 安排定时任务
-            self.schedule_recurring_timer(schedule_id, schedule_data)
+            self.schedule_recurring_timer(schedule_id, schedule)
             
             # 保存
-            self.tasks[schedule_id] = schedule_data
-            self.save_tasks()
+            self.add_task(schedule_id, schedule)
+            self.save_tasks(schedule_id)
             
             # 发送响应
             response_data = {
                 "action": "schedule_created",
                 "schedule_id": schedule_id,
                 "entity_id": entity_id,
-                "entity_name": schedule_data["entity_name"],
+                "entity_name": schedule.entity_name,
                 "repeat_type": repeat_type,
                 "schedule_time": schedule_time,
                 "status": "active",
-                "next_execution": schedule_data.get("next_execution"),
-                "message": f"Schedule created for {schedule_data['entity_name']}",
+                "next_execution": epoch_to_iso(schedule.next_execution_ts),
+                "message": f"Schedule created for {schedule.entity_name}",
                 "time_zone": self.time_zone
             }
             
-            if repeat_type == "weekly":
-                response_data["weekdays"] = schedule_data.get("weekdays", [])
-            elif repeat_type == "monthly":
-                response_data["month_days"] = schedule_data.get("month_days", [])
+            if repeat is RepeatType.WEEKLY:
+                response_data["weekdays"] = schedule.weekdays or []
+            elif repeat is RepeatType.MONTHLY:
+                response_data["month_days"] = schedule.month_days or []
             
-            self.fire_event("timer_backend_response", **response_data)
+            self.respond(**response_data)
             
             self.log(f"Schedule created: {entity_id} - {repeat_type} at {schedule_time}")
             
         except Exception as e:
             self.log(f"Failed to create schedule: {e}", level="ERROR")
-            self.fire_event(
-                "timer_backend_response",
-                action="error",
-                error=str(e),
-                success=False
-            )
+            self.respond(action="error", error=str(e), success=False)
+    
+    def resolve_group_target(self, data: dict) -> Tuple[Optional[str], List[str]]:
+        """解析分组任务的目标（entity_ids列表或group实体），返回(group实体ID或None, 去重后的成员列表)"""
+        group_id = data.get("group")
+        entity_ids = data.get("entity_ids")
+        if group_id:
+            if not str(group_id).startswith("group."):
+                raise ValueError(f"Invalid group entity: {group_id}")
+            if self.get_entity_state(group_id) is None:
+                raise ValueError(f"Entity {group_id} does not exist")
+            entity_ids = self.get_entity_state(group_id, attribute="entity_id")
+        
+        if not isinstance(entity_ids, (list, tuple)) or not entity_ids:
+            raise ValueError("Group timer requires entity_ids or a group entity with members")
+        members = list(dict.fromkeys(str(entity_id) for entity_id in entity_ids))
+        if len(members) > self.group_max_members:
+            raise ValueError(f"Too many entities in group: {len(members)} (max {self.group_max_members})")
+        
+        missing = [member for member in members if self.get_entity_state(member) is None]
+        if missing:
+            raise ValueError(f"Entities do not exist: {', '.join(missing[:5])}")
+        return group_id, members
+    
+    def validate_group_action_type(self, data: dict) -> str:
+        action_type = data.get("action_type", "auto")
+        if action_type not in GROUP_ACTION_TYPES:
+            raise ValueError(f"Unsupported group action type: {action_type}")
+        return action_type
     
-    def schedule_recurring_timer(self, schedule_id: str, schedule_data: dict):
-        """安排周期定时任务（使用本地时区）"""
+    def get_group_name(self, data: dict, group_id: Optional[str], members: List[str]) -> str:
+        if data.get("name"):
+            return str(data["name"])
+        if group_id:
+            return self.get_friendly_name(group_id)
+        return f"{len(members)} entities"
+    
+    def create_group_timer(self, data: dict):
+        """创建分组定时器：多个实体共用一个任务和一个到期队列项，到期时合并执行服务调用"""
         try:
-            repeat_type = schedule_data["repeat_type"]
-            schedule_time = schedule_data["schedule_time"]
+            group_id, members = self.resolve_group_target(data)
+            action_type = self.validate_group_action_type(data)
+            duration_str = data.get("duration", "00:30:00")
+            duration = self.parse_duration(duration_str)
             
-            # 计算下次执行时间（本地时区）
-            next_execution = self.calculate_next_execution(repeat_type, schedule_time, schedule_data)
+            # 同一group实体只保留一个定时器
+            if group_id and group_id in self.entity_timers:
+                self.cancel_entity_timer(group_id, data.get("user_id"))
             
-            if not next_execution:
-                raise ValueError("无法计算下次执行时间")
+            timer_id = str(uuid.uuid4())
+            entity_id = group_id or f"{GROUP_TASK_DOMAIN}.{timer_id}"
+            start_ts = int(time.time())
+            end_ts = start_ts + int(duration.total_seconds())
             
-            now = self.get_local_now()
-            delay_seconds = (next_execution - now).total_seconds()
+            # 各成员的动作在到期时按当时的状态生成
+            action = {
+                "type": "service_call",
+                "description": f"{GROUP_ACTION_TYPES[action_type]} ({len(members)} entities)"
+            }
+            timer = Timer(
+                timer_id, entity_id, duration_str, start_ts, end_ts, action,
+                entity_name=self.get_group_name(data, group_id, members),
+                entity_state=self.get_entity_state(group_id) if group_id else None,
+                created_by=data.get("user_id", "unknown"),
+                created_ts=start_ts,
+                action_type=action_type,
+                catch_up=self.parse_catch_up(data)
+            )
+            timer.members = members
             
-            if delay_seconds < 0:
-                # 如果时间已过，重新计算
-                self.check_recurring_schedules({})
-                return
+            self.schedule_task(timer_id, end_ts, "timer")
+            self.entity_timers[entity_id] = timer_id
+            self.add_task(timer_id, timer)
+            self.save_tasks(timer_id)
             
-            # 取消已存在的定时器
-            if schedule_id in self.recurring_timers:
-                old_handle = self.recurring_timers[schedule_id]
-                try:
-                    self.cancel_timer_handle(old_handle)
-                except:
-                    pass
-            
-            # 创建新定时器
-            timer_handle = self.run_in(
-                self.execute_recurring_schedule,
-                delay_seconds,
-                schedule_id=schedule_id
+            self.respond(
+                action="timer_created",
+                timer_id=timer_id,
+                entity_id=entity_id,
+                entity_name=timer.entity_name,
+                members=members,
+                duration=duration_str,
+                end_time=epoch_to_iso(end_ts),
+                status="active",
+                action_description=action["description"],
+                message=f"Group timer set for {timer.entity_name}",
+                time_zone=self.time_zone
             )
             
-            # 保存定时器句柄和下次执行时间
-            next_execution_iso = self.datetime_to_iso(next_execution)
-            schedule_data["next_execution"] = next_execution_iso
-            
-            self.log(f"Scheduled {repeat_type} task for {schedule_data['entity_id']} at {next_execution.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+            self.log(f"Group timer created: {entity_id} ({len(members)} entities) - {duration_str}")
             
         except Exception as e:
-            self.log(f"Failed to schedule recurring timer: {e}", level="ERROR")
-    
-    def calculate_next_execution(self, repeat_type: str, schedule_time: str, 
-                                schedule_data: dict) -> Optional[datetime]:
-        """计算下次执行时间（本地时区）"""
-        now = self.get_local_now()
-        
-        # 解析时间
-        hour, minute, second = map(int, schedule_time.split(":"))
-        
-        if repeat_type == "daily":
-            # 每日执行
-            # 创建今天的时间
-            today_time = self.parse_local_time(schedule_time, now)
-
-            # 如果今天的时间已经过去，安排明天
-            if today_time <= now:
-                tomorrow = now + timedelta(days=1)
-                result = self.parse_local_time(schedule_time, tomorrow)
-                return result
-            else:
-                return today_time
-        
-        elif repeat_type == "weekly":
-            # 每周执行
-            weekdays = schedule_data.get("weekdays", [])
-            if not weekdays:
-                return None
-            
-            # 转换为数字（0=周一，6=周日）
-            target_days = [self.parse_weekday(day) for day in weekdays]
-            
-            # 找到下一个符合条件的日期
-            for day_offset in range(7):
-                check_date = now + timedelta(days=day_offset)
-                check_weekday = check_date.weekday()  # 0=周一，6=周日
-                
-                if check_weekday in target_days:
-                    check_time = self.parse_local_time(schedule_time, check_date)
-                    # 如果是今天且时间已过，继续找下一天
-                    if day_offset == 0 and check_time <= now:
-                        continue
-                    return check_time
-            
-            return None
-        
-        elif repeat_type == "monthly":
-            # 每月执行
-            month_days = schedule_data.get("month_days", [])
-            if not month_days:
-                return None
-            
-            # 找到下一个符合条件的日期
-            current_year = now.year
-            current_month = now.month
-            current_day = now.day
-            
-            for month_offset in range(12):  # 最多检查12个月
-                check_year = current_year + ((current_month - 1 + month_offset) // 12)
-                check_month = ((current_month - 1 + month_offset) % 12) + 1
-                
-                # 获取该月的天数
-                days_in_month = calendar.monthrange(check_year, check_month)[1]
-                
-                # 检查该月的每一天
-                for day in month_days:
-                    if day <= days_in_month:
-                        # 创建日期对象
-                        try:
-                            check_date = self.tz.localize(datetime(
-                                check_year, check_month, day, 0, 0, 0
-                            ))
-                            check_time = self.parse_local_time(schedule_time, check_date)
-                            
-                            # 如果日期在当前时间之后，返回
-                            if check_time > now:
-                                return check_time
-                        except:
-                            continue
-                
-                # 如果不是第一个月，找到了就返回
-                if month_offset > 0:
-                    for day in month_days:
-                        if day <= days_in_month:
-                            try:
-                                check_date = self.tz.localize(datetime(
-                                    check_year, check_month, day, 0, 0, 0
-                                ))
-                                return self.parse_local_time(schedule_time, check_date)
-                            except:
-                                continue
-            
-            return None
-        
-        return None
-    
-    def parse_weekday(self, weekday_str: str) -> int:
-        """将星期字符串转换为数字（0=周一，6=周日）"""
-        weekday_map = {
-            "monday": 0, "mon": 0,
-            "tuesday": 1, "tue": 1,
-            "wednesday": 2, "wed": 2,
-            "thursday": 3, "thu": 3,
-            "friday": 4, "fri": 4,
-            "saturday": 5, "sat": 5,
-            "sunday": 6, "sun": 6
-        }
-        
-        weekday_lower = weekday_str.lower()
-        return weekday_map.get(weekday_lower, 0)
-    
-    def weekday_to_string(self, weekday_num: int) -> str:
-        """将数字转换为星期字符串"""
-        weekday_names = [
-            "Monday", "Tuesday", "Wednesday", "Thursday", 
-            "Friday", "Saturday", "Sunday"
-        ]
-        return weekday_names[weekday_num]
+            self.log(f"Failed to create group timer: {e}", level="ERROR")
+            self.respond(action="error", error=str(e), success=False)
     
-    async def execute_recurring_schedule(self, kwargs):
-        """执行周期定时任务"""
-        schedule_id = kwargs["schedule_id"]
-        
-        if schedule_id not in self.tasks:
-            self.log(f"Schedule {schedule_id} not found")
-            return
-        
-        schedule_data = self.tasks[schedule_id]
-        
-        # 检查是否已禁用
-        if schedule_data.get("status") != "active":
-            self.log(f"Schedule {schedule_id} is not active, skipping execution")
-            return
-        
+    def create_group_schedule(self, data: dict):
+        """创建分组周期任务：多个实体共用一个任务和一个到期队列项"""
         try:
-            entity_id = schedule_data["entity_id"]
-            action_type = schedule_data.get("action_type", "auto")
-            # 记录执行时间
-            schedule_data["last_executed"] = self.datetime_to_iso(self.get_local_now())
-            
-            # 执行动作
-            if schedule_data.get("is_climate"):
-                # 空调任务
-                action_data = schedule_data.get("action_data", {})
-                action = self.generate_climate_action(entity_id, action_type, action_data)
-                
-                if action["type"] == "service_call":
-                    domain, service = action["service"].split(".")
-                    service_data = action.get("data", {}).copy()
-                    
-                    # 如果是恢复操作，使用保存的数据
-                    if action_type == "restore_previous" and "restore_data" in action:
-                        restore_data = action["restore_data"]
-                        
-                        # 恢复完整状态
-                        if restore_data.get("temperature"):
-                            await self.call_service(
-                                "climate/set_temperature",
-                                entity_id=entity_id,
-                                temperature=restore_data["temperature"]
-                            )
-                        
-                        if restore_data.get("fan_mode"):
-                            await self.call_service(
-                                "climate/set_fan_mode",
-                                entity_id=entity_id,
-                                fan_mode=restore_data["fan_mode"]
-                            )
-                        
-                        # 最后设置模式
-                        if restore_data.get("hvac_mode"):
-                            await self.call_service(
-                                "climate/set_hvac_mode",
-                                entity_id=entity_id,
-                                hvac_mode=restore_data["hvac_mode"]
-                            )
-                    else:
-                        # 普通服务调用
-                        await self.call_service(
-                            f"{domain}/{service}",
-                            **service_data
-                        )
-            else:
-                # 通用任务
-                
-                # 使用异步方式获取设备状态，避免协程问题
-                try:
-                    # 直接使用异步方式获取状态
-                    current_state = await self.get_state(entity_id)
-                except Exception as e:
-                    current_state = "unknown"
-                
-                try:
-                    action = self.generate_action(entity_id, action_type, current_state)
-                except Exception as e:
-                    raise
-
-                if action["type"] == "service_call":
-                    domain, service = action["service"].split(".")
-                    try:
-                        await self.call_service(
-                            f"{domain}/{service}",
-                            **action.get("data", {})
-                        )
-                    except Exception as e:
-                        raise
+            group_id, members = self.resolve_group_target(data)
+            action_type = self.validate_group_action_type(data)
+            rule = self.build_recurrence_rule(data)
+            repeat = rule.repeat_type
+            
+            schedule_id = str(uuid.uuid4())
+            entity_id = group_id or f"{GROUP_TASK_DOMAIN}.{schedule_id}"
+            schedule = Schedule(
+                schedule_id, entity_id, repeat, data.get("schedule_time"),
+                action_data=data.get("action_data", {}),
+                entity_name=self.get_group_name(data, group_id, members),
+                entity_state=self.get_entity_state(group_id) if group_id else None,
+                created_by=data.get("user_id", "unknown"),
+                action_type=action_type,
+                catch_up=self.parse_catch_up(data)
+            )
+            if repeat is RepeatType.WEEKLY:
+                schedule.weekdays = data["weekdays"]
+            elif repeat is RepeatType.MONTHLY:
+                schedule.month_days = data["month_days"]
+            schedule.rule = rule
+            schedule.members = members
             
-            self.log(f"Executed recurring schedule: {schedule_id} - {entity_id}")
+            self.schedule_recurring_timer(schedule_id, schedule)
+            self.add_task(schedule_id, schedule)
+            self.save_tasks(schedule_id)
             
-            # 发送执行通知
-            self.fire_event(
-                "timer_backend_response",
-                action="schedule_executed",
+            self.respond(
+                action="schedule_created",
                 schedule_id=schedule_id,
                 entity_id=entity_id,
-                entity_name=schedule_data["entity_name"],
-                repeat_type=schedule_data["repeat_type"],
-                message=f"Recurring schedule executed for {schedule_data['entity_name']}",
+                entity_name=schedule.entity_name,
+                members=members,
+                repeat_type=repeat.value,
+                schedule_time=schedule.schedule_time,
+                status="active",
+                next_execution=epoch_to_iso(schedule.next_execution_ts),
+                message=f"Group schedule created for {schedule.entity_name}",
                 time_zone=self.time_zone
             )
             
-            # 重新安排下次执行
-            self.reschedule_recurring_timer(schedule_id, schedule_data)
+            self.log(f"Group schedule created: {entity_id} ({len(members)} entities) - {repeat.value} at {schedule.schedule_time}")
             
         except Exception as e:
-            self.log(f"Failed to execute recurring schedule: {e}", level="ERROR")
-            # 仍然尝试重新安排
-            try:
-                self.reschedule_recurring_timer(schedule_id, schedule_data)
-            except Exception as reschedule_error:
-                self.log(f"Failed to reschedule after error: {reschedule_error}", level="ERROR")
+            self.log(f"Failed to create group schedule: {e}", level="ERROR")
+            self.respond(action="error", error=str(e), success=False)
     
-    def reschedule_recurring_timer(self, schedule_id: str, schedule_data: dict):
-        """重新安排周期定时任务"""
+    def schedule_recurring_timer(self, schedule_id: str, schedule: Schedule, arm: bool = True) -> bool:
+        """将周期任务的下次执行加入到期队列（使用本地时区，arm=False时由调用方统一设置唤醒）
+        
+        无法安排的任务记录在unarmed_schedules中，由午夜检查重试。
+        """
         try:
-            # 计算下次执行时间（本地时区）
-            schedule_time = schedule_data["schedule_time"]
+            # 计算下次执行时间（本地时区，一定晚于当前时间）
+            next_execution = self.calculate_next_execution(schedule)
             
-            next_execution = self.calculate_next_execution(
-                schedule_data["repeat_type"],
-                schedule_time,
-                schedule_data
-            )
+            if next_execution is None:
+                # 规则没有可用的执行日期，移出到期队列
+                self.unschedule_task(schedule_id)
+                schedule.next_execution_ts = None
+                self.unarmed_schedules.add(schedule_id)
+                self.log(f"No upcoming execution for schedule {schedule_id}, will check at midnight", level="WARNING")
+                return False
             
-            if not next_execution:
-                self.log(f"Cannot calculate next execution for schedule {schedule_id}")
-                return
+            # 加入到期队列（已存在的会被替换）
+            schedule.next_execution_ts = next_execution
+            self.schedule_task(schedule_id, schedule.next_execution_ts, "schedule", arm=arm)
+            self.unarmed_schedules.discard(schedule_id)
             
-            now = self.get_local_now()
-            delay_seconds = (next_execution - now).total_seconds()
+            self.log(f"Scheduled {schedule.repeat_type.value} task for {schedule.entity_id} at {self.clock.format_local(next_execution)}")
+            return True
             
-            # 取消旧的定时器
-            if schedule_id in self.recurring_timers:
-                old_handle = self.recurring_timers[schedule_id]
-                try:
-                    self.cancel_timer_handle(old_handle)
-                except:
-                    pass
-            
-            # 创建新定时器
-            if delay_seconds > 0:
-                timer_handle = self.run_in(
-                    self.execute_recurring_schedule,
-                    delay_seconds,
-                    schedule_id=schedule_id
-                )
-                
-                self.recurring_timers[schedule_id] = timer_handle
-                schedule_data["next_execution"] = self.datetime_to_iso(next_execution)
-                
-                self.log(f"Rescheduled {schedule_data['repeat_type']} task for {schedule_data['entity_id']} at {next_execution.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+        except Exception as e:
+            self.unarmed_schedules.add(schedule_id)
+            self.log(f"Failed to schedule recurring timer: {e}", level="ERROR")
+            return False
+    
+    def build_recurrence_rule(self, data: dict) -> RecurrenceRule:
+        """校验前端传入的周期参数并编译为规则"""
+        repeat_type = data.get("repeat_type", "none")
+        try:
+            repeat = RepeatType(repeat_type)
+        except ValueError:
+            raise ValueError(f"Unsupported repeat type: {repeat_type}")
+        
+        if repeat is RepeatType.NONE:
+            raise ValueError("Repeat type must be specified for schedule")
+        if not data.get("schedule_time"):
+            raise ValueError("Schedule time must be specified")
+        if repeat is RepeatType.WEEKLY and not data.get("weekdays"):
+            raise ValueError("Weekdays must be specified for weekly schedule")
+        if repeat is RepeatType.MONTHLY and not data.get("month_days"):
+            raise ValueError("Month days must be specified for monthly schedule")
+        
+        return RecurrenceRule(repeat, data["schedule_time"], data.get("weekdays"), data.get("month_days"))
+    
+    def get_recurrence_rule(self, schedule: Schedule) -> RecurrenceRule:
+        """获取周期任务编译后的规则（只编译一次）"""
+        if schedule.rule is None:
+            schedule.rule = RecurrenceRule.compile(schedule)
+        return schedule.rule
+    
+    def calculate_next_execution(self, schedule: Schedule, after: float = None) -> Optional[int]:
+        """计算下次执行时间（epoch秒，按本地时区的规则）"""
+        return self.get_recurrence_rule(schedule).next_after(time.time() if after is None else after, self.clock)
+    
+    def send_schedule_preview(self, data: dict):
+        """发送周期规则接下来的N次执行时间（已有任务传schedule_id，否则传规则参数）"""
+        try:
+            count = min(max(int(data.get("count", 5)), 1), 50)
+            schedule = self.tasks.get(data.get("schedule_id"))
+            
+            if schedule is not None and schedule.is_recurring:
+                rule = self.get_recurrence_rule(schedule)
             else:
-                # 如果延迟为负数，安排到明天检查
-                self.log(f"Next execution is in the past for schedule {schedule_id}, will check tomorrow")
-                schedule_data["next_execution"] = None
+                rule = self.build_recurrence_rule(data)
             
-            self.save_tasks()
+            occurrences = rule.occurrences(time.time(), self.clock, count)
+            
+            self.fire_event(
+                "timer_backend_response",
+                action="schedule_preview",
+                request_id=data.get("request_id"),
+                schedule_id=data.get("schedule_id"),
+                occurrences=[epoch_to_iso(occurrence) for occurrence in occurrences],
+                count=len(occurrences),
+                source="timer_backend",
+                time_zone=self.time_zone
+            )
             
         except Exception as e:
-            self.log(f"Failed to reschedule recurring timer: {e}", level="ERROR")
+            # 规则无效（如未选择日期）只回复给发起预览的请求，不作为后端错误广播
+            self.log(f"Failed to preview schedule: {e}", level="WARNING")
+            self.fire_event(
+                "timer_backend_response",
+                action="schedule_preview",
+                request_id=data.get("request_id"),
+                schedule_id=data.get("schedule_id"),
+                occurrences=[],
+                count=0,
+                error=str(e),
+                source="timer_backend",
+                time_zone=self.time_zone
+            )
+    
+    def complete_schedule_execution(self, plan: dict):
+        """周期任务执行后：发送执行通知并安排下次执行"""
+        schedule_id = plan["task_id"]
+        schedule = plan["task"]
+        if "member_results" in plan:
+            schedule.member_results = plan["member_results"]
+        
+        if plan["error"] is not None:
+            self.log(f"Failed to execute recurring schedule: {plan['error']}", level="ERROR")
+        else:
+            self.log(f"Executed recurring schedule: {schedule_id} - {schedule.entity_id}")
+            
+            # 发送执行通知
+            self.fire_event(
+                "timer_backend_response",
+                action="schedule_executed",
+                schedule_id=schedule_id,
+                entity_id=schedule.entity_id,
+                entity_name=schedule.entity_name,
+                repeat_type=schedule.repeat_type.value,
+                message=f"Recurring schedule executed for {schedule.entity_name}",
+                time_zone=self.time_zone,
+                **self.build_group_fields(schedule)
+            )
+        
+        # 重新安排下次执行（出错时同样重新安排）
+        self.reschedule_recurring_timer(schedule_id, schedule)
+    
+    def reschedule_recurring_timer(self, schedule_id: str, schedule: Schedule):
+        """执行后重新安排周期任务，并记录和保存新的下次执行时间（唤醒由执行回调统一设置）"""
+        self.schedule_recurring_timer(schedule_id, schedule, arm=False)
+        self.record_change(schedule_id, "updated")
+        self.save_tasks(schedule_id)
     
     def check_recurring_schedules(self, kwargs):
-        """检查并重新安排所有周期任务（每日午夜执行，使用本地时区）"""
+        """每日午夜的一致性检查
+        
+        周期任务在每次执行后重新加入到期队列，这里只重试未能安排的任务，
+        并确认到期队列的唤醒没有丢失。
+        """
         try:
-            self.log(f"Checking recurring schedules at {self.get_local_now().strftime('%Y-%m-%d %H:%M:%S %Z')}...")
-            
-            for schedule_id, schedule_data in self.tasks.items():
-                if schedule_data.get("is_recurring") and schedule_data.get("status") == "active":
-                    # 检查是否需要重新安排
-                    next_execution_str = schedule_data.get("next_execution")
-                    if not next_execution_str:
-                        # 重新安排
-                        self.schedule_recurring_timer(schedule_id, schedule_data)
-                    else:
-                        # 检查是否已过期
-                        try:
-                            next_execution = self.iso_to_datetime(next_execution_str)
-                            now = self.get_local_now()
-                            if next_execution <= now:
-                                # 重新安排
-                                self.schedule_recurring_timer(schedule_id, schedule_data)
-                        except:
-                            # 解析失败，重新安排
-                            self.schedule_recurring_timer(schedule_id, schedule_data)
-            
-            self.log("Recurring schedules check completed")
+            rescheduled_ids = []
+            for schedule_id in list(self.unarmed_schedules):
+                schedule = self.tasks.get(schedule_id)
+                if schedule is None or not schedule.is_recurring or not schedule.is_active:
+                    self.unarmed_schedules.discard(schedule_id)
+                    continue
+                if self.schedule_recurring_timer(schedule_id, schedule, arm=False):
+                    rescheduled_ids.append(schedule_id)
+            
+            for schedule_id in rescheduled_ids:
+                self.record_change(schedule_id, "updated")
+            if rescheduled_ids:
+                self.save_tasks(*rescheduled_ids)
+            
+            # 唤醒时间早已过去说明回调丢失，重新设置
+            if self.scheduler_deadline is not None and self.scheduler_deadline < time.time() - 60:
+                self.log("Scheduler wakeup was missed, re-arming", level="WARNING")
+                self.cancel_scheduler_wakeup()
+            self.arm_scheduler()
+            
+            self.log(f"Recurring schedules check completed: {len(rescheduled_ids)} rescheduled, "
+                     f"{len(self.unarmed_schedules)} without upcoming execution")
             
         except Exception as e:
             self.log(f"Failed to check recurring schedules: {e}", level="ERROR")
@@ -988,6 +3364,14 @@ class TimerBackend(hass.Hass):
                 "description": "Turn off AC"
             }
             
+        elif action_type in ("turn_on", "toggle"):
+            return {
+                "type": "service_call",
+                "service": f"climate.{action_type}",
+                "data": {"entity_id": entity_id},
+                "description": "Turn on AC" if action_type == "turn_on" else "Toggle AC"
+            }
+            
         elif action_type == "set_temperature":
             temperature = action_data.get("temperature", self.climate_config["default_temperature"])
             hvac_mode = action_data.get("hvac_mode", self.climate_config["default_mode"])
@@ -1036,7 +3420,7 @@ class TimerBackend(hass.Hass):
             
         elif action_type == "auto":
             # 智能判断：如果空调开着就关，如果关着就恢复之前状态或默认设置
-            current_state = self.get_state(entity_id)
+            current_state = self.get_entity_state(entity_id)
             if current_state == "off":
                 return self.generate_climate_action(entity_id, "restore_previous")
             else:
@@ -1046,107 +3430,13 @@ class TimerBackend(hass.Hass):
             # 默认关闭
             return self.generate_climate_action(entity_id, "turn_off")
     
-    async def execute_climate_timer(self, kwargs):
-        """执行空调定时器"""
-        timer_id = kwargs["timer_id"]
-        
-        if timer_id in self.tasks:
-            timer = self.tasks[timer_id]
-            entity_id = timer["entity_id"]
-            
-            # 检查定时器是否已被取消
-            if timer.get("status") == "cancelled":
-                self.log(f"Climate timer {timer_id} was cancelled, skipping execution")
-                return
-            
-            try:
-                # 执行动作
-                action = timer["action"]
-                success = False
-                
-                if action["type"] == "service_call":
-                    domain, service = action["service"].split(".")
-                    service_data = action.get("data", {}).copy()
-                    
-                    # 如果是恢复操作，使用保存的数据
-                    if timer.get("action_type") == "restore_previous" and "restore_data" in action:
-                        restore_data = action["restore_data"]
-                        
-                        # 恢复完整状态
-                        if restore_data.get("temperature"):
-                            await self.call_service(
-                                "climate/set_temperature",
-                                entity_id=entity_id,
-                                temperature=restore_data["temperature"]
-                            )
-                        
-                        if restore_data.get("fan_mode"):
-                            await self.call_service(
-                                "climate/set_fan_mode",
-                                entity_id=entity_id,
-                                fan_mode=restore_data["fan_mode"]
-                            )
-                        
-                        # 最后设置模式
-                        if restore_data.get("hvac_mode"):
-                            await self.call_service(
-                                "climate/set_hvac_mode",
-                                entity_id=entity_id,
-                                hvac_mode=restore_data["hvac_mode"]
-                            )
-                            
-                        success = True
-                    else:
-                        # 普通服务调用
-                        await self.call_service(
-                            f"{domain}/{service}",
-                            **service_data
-                        )
-                        success = True
-                
-                # 更新状态
-                if success:
-                    timer["status"] = "completed"
-                    timer["executed_at"] = self.datetime_to_iso(self.get_local_now())
-                else:
-                    timer["status"] = "failed"
-                
-                # 清理
-                if entity_id in self.entity_timers:
-                    del self.entity_timers[entity_id]
-                if timer_id in self.timers:
-                    del self.timers[timer_id]
-                
-                self.save_tasks()
-                
-                # 发送通知
-                self.fire_event(
-                    "timer_backend_response",
-                    action="timer_completed",
-                    timer_id=timer_id,
-                    entity_id=entity_id,
-                    entity_name=timer["entity_name"],
-                    success=success,
-                    action_description=timer["action"].get("description", ""),
-                    message=f"Climate timer executed for {timer['entity_name']}",
-                    time_zone=self.time_zone
-                )
-                
-                self.log(f"Climate timer executed successfully: {entity_id} - {timer['action'].get('description', '')}")
-                
-            except Exception as e:
-                self.log(f"Failed to execute climate timer: {e}", level="ERROR")
-                timer["status"] = "error"
-                timer["error"] = str(e)
-                self.save_tasks()
-    
     def generate_action(self, entity_id, action_type="auto", current_state=None):
         """根据实体类型自动生成动作"""
         domain = entity_id.split(".")[0]
         
         # 如果没有传入状态，则获取当前状态
         if current_state is None:
-            current_state = self.get_state(entity_id)
+            current_state = self.get_entity_state(entity_id)
         
         # 空调特殊处理
         if domain == "climate":
@@ -1257,115 +3547,91 @@ class TimerBackend(hass.Hass):
                 desc = f"Set temperature to {temp}°C"
         return desc
     
-    def cancel_timer(self, timer_id):
-        """取消指定定时器"""
+    def cancel_timer(self, timer_id) -> bool:
+        """取消指定定时器，返回是否已取消"""
         if timer_id in self.tasks:
             try:
                 timer = self.tasks[timer_id]
-                entity_id = timer["entity_id"]
+                entity_id = timer.entity_id
                 
                 # 检查是否为周期任务
-                if timer.get("is_recurring"):
+                if timer.is_recurring:
                     return self.cancel_schedule(timer_id)
                 
-                # 无论timer_handle是否存在，都要取消
-                if timer_id in self.timers:
-                    timer_handle = self.timers[timer_id]
-                    try:
-                        # 尝试AppDaemon的取消方法
-                        self.cancel_timer_handle(timer_handle)
-                    except:
-                        try:
-                            # 如果是asyncio handle，使用其cancel方法
-                            if hasattr(timer_handle, 'cancel'):
-                                timer_handle.cancel()
-                        except:
-                            # 最后尝试直接调用cancel
-                            pass
-                    
-                    # 清理定时器句柄
-                    del self.timers[timer_id]
+                # 从到期队列移除
+                self.unschedule_task(timer_id)
                 
                 # 更新状态
-                timer["status"] = "cancelled"
-                timer["cancelled_at"] = self.datetime_to_iso(self.get_local_now())
+                self.finish_task(timer_id, TaskStatus.CANCELLED, cancelled_ts=int(time.time()))
                 
                 # 彻底清理所有相关引用
                 if entity_id in self.entity_timers and self.entity_timers[entity_id] == timer_id:
                     del self.entity_timers[entity_id]
                 
                 # 确保没有其他活跃的定时器使用相同实体
-                self.cleanup_entity_timers(entity_id, timer_id)
+                cleaned_ids = self.cleanup_entity_timers(entity_id, timer_id)
                 
-                self.save_tasks()
+                self.save_tasks(timer_id, *cleaned_ids)
                 
                 # 发送响应
-                self.fire_event(
-                    "timer_backend_response",
+                self.respond(
                     action="timer_cancelled",
                     timer_id=timer_id,
                     entity_id=entity_id,
-                    entity_name=timer["entity_name"],
-                    message=f"Timer cancelled for {timer['entity_name']}",
+                    entity_name=timer.entity_name,
+                    message=f"Timer cancelled for {timer.entity_name}",
                     time_zone=self.time_zone
                 )
                 
                 self.log(f"Timer cancelled: {timer_id} for entity: {entity_id}")
+                return True
                 
             except Exception as e:
                 self.log(f"Failed to cancel timer: {e}", level="ERROR")
         else:
             self.log(f"Timer not found for cancellation: {timer_id}", level="WARNING")
+        return False
     
-    def cancel_schedule(self, schedule_id: str):
-        """取消周期定时任务"""
+    def cancel_schedule(self, schedule_id: str) -> bool:
+        """取消周期定时任务，返回是否已取消"""
         if schedule_id in self.tasks:
             try:
                 schedule = self.tasks[schedule_id]
                 
-                if not schedule.get("is_recurring"):
+                if not schedule.is_recurring:
                     self.log(f"Task {schedule_id} is not a recurring schedule")
-                    return
+                    return False
                 
-                # 取消定时器
-                if schedule_id in self.recurring_timers:
-                    timer_handle = self.recurring_timers[schedule_id]
-                    try:
-                        self.cancel_timer_handle(timer_handle)
-                    except:
-                        try:
-                            if hasattr(timer_handle, 'cancel'):
-                                timer_handle.cancel()
-                        except:
-                            pass
-                    del self.recurring_timers[schedule_id]
+                # 从到期队列移除
+                self.unschedule_task(schedule_id)
                 
                 # 更新状态
-                schedule["status"] = "cancelled"
-                schedule["cancelled_at"] = self.datetime_to_iso(self.get_local_now())
+                self.finish_task(schedule_id, TaskStatus.CANCELLED, cancelled_ts=int(time.time()))
                 
-                self.save_tasks()
+                self.save_tasks(schedule_id)
                 
                 # 发送响应
-                self.fire_event(
-                    "timer_backend_response",
+                self.respond(
                     action="schedule_cancelled",
                     schedule_id=schedule_id,
-                    entity_id=schedule["entity_id"],
-                    entity_name=schedule["entity_name"],
-                    message=f"Schedule cancelled for {schedule['entity_name']}",
+                    entity_id=schedule.entity_id,
+                    entity_name=schedule.entity_name,
+                    message=f"Schedule cancelled for {schedule.entity_name}",
                     time_zone=self.time_zone
                 )
                 
                 self.log(f"Schedule cancelled: {schedule_id}")
+                return True
                 
             except Exception as e:
                 self.log(f"Failed to cancel schedule: {e}", level="ERROR")
         else:
             self.log(f"Schedule not found for cancellation: {schedule_id}", level="WARNING")
+        return False
     
     def cleanup_entity_timers(self, entity_id, exclude_timer_id=None):
-        """清理实体相关的所有定时器状态，排除指定的定时器ID"""
+        """清理实体相关的所有定时器状态，排除指定的定时器ID，返回被清理的定时器ID"""
+        cleaned_ids = []
         # 检查entity_timers中是否有该实体的其他定时器引用
         if entity_id in self.entity_timers:
             referenced_timer_id = self.entity_timers[entity_id]
@@ -1373,144 +3639,368 @@ class TimerBackend(hass.Hass):
                 # 如果引用的不是当前取消的定时器，也需要处理
                 if referenced_timer_id in self.tasks:
                     timer = self.tasks[referenced_timer_id]
-                    if timer.get("status") == "active":
-                        timer["status"] = "cancelled"
-                        timer["cancelled_at"] = self.datetime_to_iso(self.get_local_now())
+                    if timer.is_active:
+                        self.finish_task(referenced_timer_id, TaskStatus.CANCELLED, cancelled_ts=int(time.time()))
+                        cleaned_ids.append(referenced_timer_id)
                         self.log(f"Cleaned up active timer from entity_timers: {referenced_timer_id}")
                 
                 # 清理引用
                 del self.entity_timers[entity_id]
         
         # 检查是否还有其他使用相同实体的活跃定时器
-        for timer_id, timer_data in list(self.tasks.items()):
-            if (timer_id != exclude_timer_id and 
-                timer_data.get("entity_id") == entity_id and 
-                timer_data.get("status") == "active"):
-                
+        for timer_id in self.index.ids(status=TaskStatus.ACTIVE, entity_id=entity_id):
+            if timer_id != exclude_timer_id and timer_id in self.tasks:
                 # 取消这些定时器
-                if timer_id in self.timers:
-                    timer_handle = self.timers[timer_id]
-                    try:
-                        self.cancel_timer_handle(timer_handle)
-                    except:
-                        try:
-                            if hasattr(timer_handle, 'cancel'):
-                                timer_handle.cancel()
-                        except:
-                            pass
-                    del self.timers[timer_id]
+                self.unschedule_task(timer_id)
                 
                 # 更新状态
-                timer_data["status"] = "cancelled"
-                timer_data["cancelled_at"] = self.datetime_to_iso(self.get_local_now())
+                self.finish_task(timer_id, TaskStatus.CANCELLED, cancelled_ts=int(time.time()))
+                cleaned_ids.append(timer_id)
                 self.log(f"Cleaned up other active timers for same entity: {timer_id}")
+        
+        return cleaned_ids
     
-    def cancel_entity_timer(self, entity_id, user_id=None):
-        """取消实体相关的定时器"""
+    def cancel_entity_timer(self, entity_id, user_id=None) -> int:
+        """取消实体相关的定时器，返回取消的定时器数量"""
         cancelled_count = 0
+        cancelled_ids = []
         
         # 首先检查entity_timers中是否有该实体的定时器
         if entity_id in self.entity_timers:
             timer_id = self.entity_timers[entity_id]
-            self.cancel_timer(timer_id)
-            cancelled_count += 1
+            if self.cancel_timer(timer_id):
+                cancelled_count += 1
         
         # 然后检查tasks中是否有该实体的其他活跃定时器（防止遗漏）
-        for timer_id, timer_data in list(self.tasks.items()):
-            if (timer_data.get("entity_id") == entity_id and 
-                timer_data.get("status") == "active"):
-                
+        for timer_id in self.index.ids(status=TaskStatus.ACTIVE, entity_id=entity_id):
+            if timer_id in self.tasks:
                 # 避免重复取消
-                if timer_id not in self.timers:
-                    # 如果timers中没有但tasks中还有活跃状态，说明可能是遗漏的定时器
-                    timer_data["status"] = "cancelled"
-                    timer_data["cancelled_at"] = self.datetime_to_iso(self.get_local_now())
+                if timer_id not in self.scheduler:
+                    # 如果到期队列中没有但tasks中还有活跃状态，说明可能是遗漏的定时器
+                    self.finish_task(timer_id, TaskStatus.CANCELLED, cancelled_ts=int(time.time()))
                     self.log(f"Cleaned up missed active timer: {timer_id}")
+                    cancelled_ids.append(timer_id)
                     cancelled_count += 1
         
         if cancelled_count > 0:
-            self.save_tasks()
+            if cancelled_ids:
+                self.save_tasks(*cancelled_ids)
             self.log(f"Cancelled {cancelled_count} timer(s) for entity: {entity_id}")
         else:
             self.log(f"No active timers found for entity: {entity_id}", level="INFO")
+        return cancelled_count
+    
+    def get_active_task_ids(self, user_id=None) -> List[str]:
+        """获取活跃任务ID（指定用户时通过索引只取该用户的任务，按创建时间排序）"""
+        if not user_id:
+            return list(self.tasks)
+        task_ids = [task_id for task_id in self.index.ids(status=TaskStatus.ACTIVE, user_id=user_id)
+                    if task_id in self.tasks]
+        task_ids.sort(key=lambda task_id: self.tasks[task_id].created_ts or 0)
+        return task_ids
+    
+    def build_timer_info(self, timer_id: str, timer: Timer, now_ts: float = None) -> dict:
+        """构建发送给前端的一次性定时器信息"""
+        if now_ts is None:
+            now_ts = time.time()
+        
+        timer_info = {
+            "timer_id": timer_id,
+            "entity_id": timer.entity_id,
+            "entity_name": timer.entity_name,
+            "duration": timer.duration,
+            "end_time": epoch_to_iso(timer.end_ts),
+            "remaining_seconds": max(0, timer.end_ts - now_ts),
+            "action": self.get_action_description(timer.action),
+            "is_climate": timer.is_climate,
+            "time_zone": self.time_zone
+        }
+        
+        # 如果是空调，添加额外信息
+        if timer.is_climate:
+            timer_info["previous_mode"] = (timer.previous_state or {}).get("hvac_mode", "Unknown")
+            timer_info["target_action"] = timer.action.get("description", "Climate control")
+        timer_info.update(self.build_group_fields(timer))
+        
+        # 执行失败等待重试
+        if timer.attempts:
+            timer_info["attempts"] = len(timer.attempts)
+            timer_info["next_retry"] = epoch_to_iso(self.scheduler.due_time(timer_id))
+        
+        return timer_info
+    
+    def build_schedule_info(self, schedule_id: str, schedule: Schedule) -> dict:
+        """构建发送给前端的周期任务信息"""
+        schedule_info = {
+            "schedule_id": schedule_id,
+            "entity_id": schedule.entity_id,
+            "entity_name": schedule.entity_name,
+            "repeat_type": schedule.repeat_type.value,
+            "schedule_time": schedule.schedule_time,
+            "status": schedule.status.value,
+            "last_executed": epoch_to_iso(schedule.last_executed_ts),
+            "next_execution": epoch_to_iso(schedule.next_execution_ts),
+            "is_climate": schedule.is_climate,
+            "action_type": schedule.action_type,
+            "time_zone": self.time_zone
+        }
+        
+        # 添加特定类型信息
+        if schedule.repeat_type is RepeatType.WEEKLY:
+            schedule_info["weekdays"] = schedule.weekdays or []
+        elif schedule.repeat_type is RepeatType.MONTHLY:
+            schedule_info["month_days"] = schedule.month_days or []
+        schedule_info.update(self.build_group_fields(schedule))
+        
+        return schedule_info
+    
+    def build_group_fields(self, task: Task) -> dict:
+        """分组任务发送给前端的附加字段（单实体任务为空）"""
+        if not task.is_group:
+            return {}
+        fields = {"members": task.members, "member_count": len(task.members)}
+        if task.member_results is not None:
+            fields["member_results"] = task.member_results
+        return fields
+    
+    def record_change(self, task_id: str, change: str, task: Task = None):
+        """记录任务变更：递增版本号，写入变更日志并广播增量事件
+        
+        change为added/updated/removed，对应timer_added/timer_updated/timer_removed事件。
+        """
+        task = task or self.get_task(task_id)
+        if task is None:
+            return
+        
+        self.revision += 1
+        self.invalidate_list_cache()
+        self.mark_state_entity_dirty()
+        is_schedule = task.is_recurring
+        
+        change_data = {
+            "revision": self.revision,
+            "change": change,
+            "task_id": task_id,
+            "entity_id": task.entity_id,
+            "is_schedule": is_schedule,
+        }
+        if change == "removed":
+            change_data["status"] = task.status.value
+        elif is_schedule:
+            change_data["schedule"] = self.build_schedule_info(task_id, task)
+        else:
+            change_data["timer"] = self.build_timer_info(task_id, task)
+        
+        self.change_log.append((self.revision, task.created_by, change_data))
+        
+        # batch命令结束时统一发送
+        if self.delta_events and self.batch is None:
+            self.fire_event(
+                "timer_backend_response",
+                action=f"timer_{change}",
+                source="timer_backend",
+                time_zone=self.time_zone,
+                **change_data
+            )
+    
+    def collect_changes_since(self, since_revision: int, user_id=None) -> List[dict]:
+        """从变更日志中取出指定版本之后的变更（同一任务只保留最新的变更）"""
+        latest = {}
+        for revision, created_by, change_data in self.change_log:
+            if revision <= since_revision:
+                continue
+            if user_id and created_by != user_id:
+                continue
+            latest.pop(change_data["task_id"], None)
+            latest[change_data["task_id"]] = change_data
+        return list(latest.values())
+    
+    def send_changes_since(self, since_revision, user_id=None):
+        """发送指定版本之后的变更；落后太多或版本未知时发送完整列表"""
+        try:
+            since_revision = int(since_revision)
+        except (TypeError, ValueError):
+            return self.request_all_timers(user_id)
+        
+        oldest_revision = self.change_log[0][0] if self.change_log else self.revision + 1
+        if since_revision > self.revision or since_revision < oldest_revision - 1:
+            # 版本来自重启前或已超出变更日志范围
+            return self.request_all_timers(user_id)
+        
+        try:
+            self.fire_event(
+                "timer_backend_response",
+                action="timers_changes",
+                since_revision=since_revision,
+                revision=self.revision,
+                changes=self.collect_changes_since(since_revision, user_id),
+                source="timer_backend",
+                timestamp=self.datetime_to_iso(self.get_local_now()),
+                time_zone=self.time_zone
+            )
+            
+        except Exception as e:
+            self.log(f"Failed to send timer changes: {e}", level="ERROR")
+    
+    def build_active_lists(self, user_id=None) -> dict:
+        """构建活跃定时器和周期任务列表，同时将已过期的定时器标记为完成"""
+        active_timers = []
+        active_schedules = []
+        expired_ids = []
+        now_ts = time.time()
+        
+        for timer_id in self.get_active_task_ids(user_id):
+            timer = self.tasks.get(timer_id)
+            if timer is None or not timer.is_active:
+                continue
+            
+            if timer.is_recurring:
+                # 周期任务
+                active_schedules.append(self.build_schedule_info(timer_id, timer))
+                
+            elif timer.end_ts <= now_ts and timer_id not in self.scheduler and timer_id not in self.catch_up_pending:
+                # 一次性定时器已经过期（且不在等待执行、重试或补执行），标记为完成
+                self.finish_task(timer_id, TaskStatus.COMPLETED, executed_ts=int(now_ts))
+                # 清理定时器
+                entity_id = timer.entity_id
+                if entity_id in self.entity_timers:
+                    del self.entity_timers[entity_id]
+                self.unschedule_task(timer_id)
+                expired_ids.append(timer_id)
+                
+            else:
+                # 一次性定时器
+                active_timers.append((self.build_timer_info(timer_id, timer, now_ts), timer.end_ts))
+        
+        # 保存可能的更改（如定时器过期）
+        if expired_ids:
+            self.save_tasks(*expired_ids)
+        
+        return {
+            "timers": active_timers,
+            "schedules": active_schedules,
+            "next_end": min((end_ts for _, end_ts in active_timers), default=float("inf"))
+        }
+    
+    def get_active_lists(self, user_id=None):
+        """获取活跃定时器和周期任务列表
+        
+        按user_id缓存构建结果，任务变更时失效；命中缓存时只根据保存的结束时间重算剩余秒数。
+        """
+        now_ts = time.time()
+        entry = self.list_cache.get(user_id)
+        if entry is not None and entry["next_end"] > now_ts:
+            self.list_cache_hits += 1
+        else:
+            # 未命中或有定时器已到期（需要标记完成），重新构建
+            self.list_cache_misses += 1
+            entry = self.build_active_lists(user_id)
+            if len(self.list_cache) >= 64:
+                self.list_cache.clear()
+            self.list_cache[user_id] = entry
+        
+        timers = [
+            dict(timer_info, remaining_seconds=max(0, end_ts - now_ts))
+            for timer_info, end_ts in entry["timers"]
+        ]
+        return timers, entry["schedules"]
+    
+    def invalidate_list_cache(self):
+        """任务变更后清空列表缓存"""
+        self.list_cache.clear()
+    
+    def mark_state_entity_dirty(self):
+        """任务变更后安排更新状态实体（同一轮内的多次变更只更新一次）"""
+        if not self.state_entity or self.state_entity_pending:
+            return
+        self.state_entity_pending = True
+        self.run_in(self.publish_state_entity, 0)
+    
+    def publish_state_entity(self, kwargs):
+        """将活跃任务的精简列表写入状态实体的属性（状态为活跃任务数）"""
+        self.state_entity_pending = False
+        try:
+            timers, schedules = self.get_active_lists()
+            # 剩余秒数随时间变化，由卡片根据end_time计算
+            compact_timers = [
+                {key: value for key, value in timer.items() if key not in ("remaining_seconds", "time_zone")}
+                for timer in timers
+            ]
+            compact_schedules = [
+                {key: value for key, value in schedule.items() if key != "time_zone"}
+                for schedule in schedules
+            ]
+            self.set_state(
+                self.state_entity,
+                state=len(compact_timers) + len(compact_schedules),
+                attributes={
+                    "timers": compact_timers,
+                    "schedules": compact_schedules,
+                    "timer_count": len(compact_timers),
+                    "schedule_count": len(compact_schedules),
+                    "revision": self.revision,
+                    "time_zone": self.time_zone,
+                    "friendly_name": "Timer backend active tasks",
+                    "icon": "mdi:timer-outline",
+                    "unit_of_measurement": "tasks"
+                }
+            )
+            self.state_entity_updates += 1
+        except Exception as e:
+            self.log(f"Failed to publish state entity {self.state_entity}: {e}", level="WARNING")
+    
+    def request_all_timers(self, user_id=None):
+        """处理列表请求：合并短时间内的请求，并限制同一user_id的广播频率"""
+        stats = self.list_request_stats
+        stats["received"] += 1
+        if self.list_coalesce_window <= 0 and self.list_min_interval <= 0:
+            stats["broadcasts"] += 1
+            return self.send_all_timers(user_id)
+        
+        if user_id in self.pending_list_users:
+            # 已有待发送的广播，合并
+            stats["coalesced"] += 1
+            return
+        
+        now = time.monotonic()
+        due = now + self.list_coalesce_window
+        last_sent = self.list_last_sent.get(user_id)
+        if last_sent is not None and last_sent + self.list_min_interval > due:
+            # 距上次广播太近，推迟到间隔结束
+            due = last_sent + self.list_min_interval
+            stats["deferred"] += 1
+        self.pending_list_users[user_id] = due
+        self.arm_list_flush()
+    
+    def arm_list_flush(self):
+        """对准最早的待发送列表广播"""
+        if not self.pending_list_users:
+            return
+        next_due = min(self.pending_list_users.values())
+        if self.list_flush_handle is not None and self.list_flush_due <= next_due:
+            return
+        self.cancel_callback(self.list_flush_handle)
+        self.list_flush_due = next_due
+        self.list_flush_handle = self.run_in(self.flush_list_requests, max(0, next_due - time.monotonic()))
+    
+    def flush_list_requests(self, kwargs):
+        """发送已到期的列表广播（每个user_id一次）"""
+        self.list_flush_handle = None
+        self.list_flush_due = None
+        now = time.monotonic()
+        # run_in的精度为秒级时允许少量提前
+        due_users = [user_id for user_id, due in self.pending_list_users.items() if due <= now + 0.05]
+        for user_id in due_users:
+            del self.pending_list_users[user_id]
+            self.list_last_sent[user_id] = now
+            self.list_request_stats["broadcasts"] += 1
+            self.send_all_timers(user_id)
+        self.arm_list_flush()
     
     def send_all_timers(self, user_id=None):
         """发送所有定时器状态"""
         try:
-            # 计算每个定时器的剩余时间
-            active_timers = []
-            active_schedules = []
-            now = self.get_local_now()
-            
-            for timer_id, timer in self.tasks.items():
-                if timer.get("is_recurring"):
-                    # 周期任务
-                    if timer["status"] == "active":
-                        schedule_info = {
-                            "schedule_id": timer_id,
-                            "entity_id": timer["entity_id"],
-                            "entity_name": timer["entity_name"],
-                            "repeat_type": timer["repeat_type"],
-                            "schedule_time": timer["schedule_time"],
-                            "status": timer["status"],
-                            "last_executed": timer.get("last_executed"),
-                            "next_execution": timer.get("next_execution"),
-                            "is_climate": timer.get("is_climate", False),
-                            "action_type": timer.get("action_type", "auto"),
-                            "time_zone": timer.get("time_zone", self.time_zone)
-                        }
-                        
-                        # 添加特定类型信息
-                        if timer["repeat_type"] == "weekly":
-                            schedule_info["weekdays"] = timer.get("weekdays", [])
-                        elif timer["repeat_type"] == "monthly":
-                            schedule_info["month_days"] = timer.get("month_days", [])
-                        
-                        # 如果指定了用户，只返回该用户的定时器
-                        if user_id and timer.get("created_by") != user_id:
-                            continue
-                        
-                        active_schedules.append(schedule_info)
-                    
-                elif timer["status"] == "active":
-                    # 一次性定时器
-                    end_time = self.iso_to_datetime(timer["end_time"])
-                    remaining = max(0, (end_time - now).total_seconds())
-                    
-                    # 如果定时器已经过期，标记为完成
-                    if remaining <= 0:
-                        timer["status"] = "completed"
-                        timer["executed_at"] = self.datetime_to_iso(now)
-                        # 清理定时器
-                        entity_id = timer["entity_id"]
-                        if entity_id in self.entity_timers:
-                            del self.entity_timers[entity_id]
-                        if timer_id in self.timers:
-                            del self.timers[timer_id]
-                        continue
-                    
-                    timer_info = {
-                        "timer_id": timer_id,
-                        "entity_id": timer["entity_id"],
-                        "entity_name": timer["entity_name"],
-                        "duration": timer["duration"],
-                        "end_time": timer["end_time"],
-                        "remaining_seconds": remaining,
-                        "action": self.get_action_description(timer["action"]),
-                        "is_climate": timer.get("is_climate", False),
-                        "time_zone": self.time_zone
-                    }
-                    
-                    # 如果是空调，添加额外信息
-                    if timer.get("is_climate"):
-                        timer_info["previous_mode"] = timer.get("previous_state", {}).get("hvac_mode", "Unknown")
-                        timer_info["target_action"] = timer.get("action", {}).get("description", "Climate control")
-                    
-                    # 如果指定了用户，只返回该用户的定时器
-                    if user_id and timer.get("created_by") != user_id:
-                        continue
-                    
-                    active_timers.append(timer_info)
+            active_timers, active_schedules = self.get_active_lists(user_id)
             
             # 发送事件 - 确保事件名称正确
             event_data = {
@@ -1519,8 +4009,9 @@ class TimerBackend(hass.Hass):
                 "schedules": active_schedules,
                 "timer_count": len(active_timers),
                 "schedule_count": len(active_schedules),
+                "revision": self.revision,
                 "source": "timer_backend",
-                "timestamp": self.datetime_to_iso(now),
+                "timestamp": self.datetime_to_iso(self.get_local_now()),
                 "time_zone": self.time_zone
             }
             
@@ -1529,51 +4020,20 @@ class TimerBackend(hass.Hass):
                 **event_data
             )
             
-            # 保存可能的更改（如定时器过期）
-            if any(timer.get("status") == "completed" for timer in self.tasks.values()):
-                self.save_tasks()
-            
         except Exception as e:
             self.log(f"Failed to send timers list: {e}", level="ERROR")
     
     def send_all_schedules(self, user_id=None):
         """发送所有周期任务状态"""
         try:
-            active_schedules = []
-            
-            for timer_id, timer in self.tasks.items():
-                if timer.get("is_recurring") and timer["status"] == "active":
-                    schedule_info = {
-                        "schedule_id": timer_id,
-                        "entity_id": timer["entity_id"],
-                        "entity_name": timer["entity_name"],
-                        "repeat_type": timer["repeat_type"],
-                        "schedule_time": timer["schedule_time"],
-                        "status": timer["status"],
-                        "last_executed": timer.get("last_executed"),
-                        "next_execution": timer.get("next_execution"),
-                        "is_climate": timer.get("is_climate", False),
-                        "action_type": timer.get("action_type", "auto"),
-                        "time_zone": timer.get("time_zone", self.time_zone)
-                    }
-                    
-                    # 添加特定类型信息
-                    if timer["repeat_type"] == "weekly":
-                        schedule_info["weekdays"] = timer.get("weekdays", [])
-                    elif timer["repeat_type"] == "monthly":
-                        schedule_info["month_days"] = timer.get("month_days", [])
-                    
-                    # 如果指定了用户，只返回该用户的定时器
-                    if user_id and timer.get("created_by") != user_id:
-                        continue
-                    
-                    active_schedules.append(schedule_info)
+            _, active_schedules = self.get_active_lists(user_id)
             
             # 发送事件
             event_data = {
                 "action": "schedules_list",
                 "schedules": active_schedules,
                 "count": len(active_schedules),
+                "revision": self.revision,
                 "source": "timer_backend",
                 "timestamp": self.datetime_to_iso(self.get_local_now()),
                 "time_zone": self.time_zone
@@ -1584,76 +4044,190 @@ class TimerBackend(hass.Hass):
         except Exception as e:
             self.log(f"Failed to send schedules list: {e}", level="ERROR")
     
+    def send_stats(self):
+        """发送后端运行统计"""
+        self.fire_event(
+            "timer_backend_response",
+            action="stats",
+            persistence=self.persist_writer.stats(),
+            list_cache={
+                "hits": self.list_cache_hits,
+                "misses": self.list_cache_misses,
+                "entries": len(self.list_cache)
+            },
+            execution=dict(
+                self.execution_stats,
+                avg_batch_seconds=round(self.execution_stats["total_batch_seconds"] / max(1, self.execution_stats["batches"]), 3)
+            ),
+            state_cache=self.state_cache.stats(),
+            dispatch=self.dispatcher.stats(),
+            list_requests=dict(self.list_request_stats, pending=len(self.pending_list_users)),
+            state_entity_updates=self.state_entity_updates,
+            restore=self.restore_stats,
+            catch_up=dict(self.catch_up_stats, pending=len(self.catch_up_queue)),
+            retry=self.retry_stats,
+            metrics=self.metrics.snapshot() if self.metrics is not None else None,
+            active_count=len(self.tasks),
+            history_count=self.get_history_count(),
+            scheduled_count=len(self.scheduler),
+            revision=self.revision,
+            source="timer_backend",
+            time_zone=self.time_zone
+        )
+    
+    def count_tasks(self) -> Dict[str, int]:
+        """统计活跃定时器、周期任务和历史任务数量"""
+        recurring = sum(1 for task in list(self.tasks.values()) if task.is_recurring)
+        return {
+            "active": len(self.tasks),
+            "timers": len(self.tasks) - recurring,
+            "recurring": recurring,
+            "history": self.get_history_count(),
+        }
+    
+    def publish_metrics(self, kwargs):
+        """将运行指标发布为Home Assistant传感器（metrics_prefix_*）"""
+        try:
+            counts = self.count_tasks()
+            self.set_state(
+                f"{self.metrics_prefix}_tasks",
+                state=counts["active"],
+                attributes=dict(counts, friendly_name="Timer backend tasks", unit_of_measurement="tasks")
+            )
+            
+            groups = (
+                ("action_latency", "action.", "Timer backend action latency"),
+                ("persist_duration", "persist.", "Timer backend persistence duration"),
+                ("fire_lateness", "lateness.", "Timer backend firing lateness"),
+                ("execution_duration", "execution.", "Timer backend execution duration"),
+                ("dispatch_wait", "dispatch.", "Timer backend dispatch wait"),
+            )
+            for suffix, prefix, friendly_name in groups:
+                snapshot = self.metrics.snapshot(prefix)
+                # 传感器状态为各项中最大的p95
+                p95_values = [item["p95_ms"] for item in snapshot.values() if item["p95_ms"] is not None]
+                self.set_state(
+                    f"{self.metrics_prefix}_{suffix}",
+                    state=max(p95_values) if p95_values else 0,
+                    attributes=dict(snapshot, friendly_name=friendly_name, unit_of_measurement="ms")
+                )
+            
+            dispatch = self.dispatcher.stats()
+            self.set_state(
+                f"{self.metrics_prefix}_dispatch_queue",
+                state=dispatch["queue_depth"],
+                attributes=dict(dispatch, friendly_name="Timer backend dispatch queue", unit_of_measurement="calls")
+            )
+        except Exception as e:
+            self.log(f"Failed to publish metrics: {e}", level="WARNING")
+    
     def get_friendly_name(self, entity_id):
         """获取实体友好名称"""
-        state = self.get_state(entity_id, attribute="friendly_name")
+        state = self.get_entity_state(entity_id, attribute="friendly_name")
         return state or entity_id
     
-    async def execute_timer(self, kwargs):
-        """执行通用定时器"""
-        timer_id = kwargs["timer_id"]
+    def complete_timer_execution(self, plan: dict):
+        """一次性定时器执行后：更新状态、清理并发送完成通知"""
+        timer_id = plan["task_id"]
+        timer = plan["task"]
+        entity_id = timer.entity_id
+        if "member_results" in plan:
+            timer.member_results = plan["member_results"]
         
-        if timer_id in self.tasks:
-            timer = self.tasks[timer_id]
-            entity_id = timer["entity_id"]
-            
-            # 检查定时器是否已被取消
-            if timer.get("status") == "cancelled":
-                self.log(f"Timer {timer_id} was cancelled, skipping execution")
+        if plan["error"] is not None:
+            self.record_attempt(timer, plan["error"])
+            if self.schedule_retry(timer_id, timer, plan["kind"]):
                 return
-            
-            try:
-                action = timer["action"]
-                success = False
-                
-                if action["type"] == "service_call":
-                    domain, service = action["service"].split(".")
-                    await self.call_service(
-                        f"{domain}/{service}",
-                        **action.get("data", {})
-                    )
-                    success = True
-                
-                # 更新状态
-                if success:
-                    timer["status"] = "completed"
-                    timer["executed_at"] = self.datetime_to_iso(self.get_local_now())
-                else:
-                    timer["status"] = "failed"
-                
-                # 清理
-                if entity_id in self.entity_timers:
-                    del self.entity_timers[entity_id]
-                if timer_id in self.timers:
-                    del self.timers[timer_id]
-                
-                self.save_tasks()
-                
-                # 发送通知
-                self.fire_event(
-                    "timer_backend_response",
-                    action="timer_completed",
-                    timer_id=timer_id,
-                    entity_id=entity_id,
-                    entity_name=timer["entity_name"],
-                    success=success,
-                    message=f"Timer executed for {timer['entity_name']}",
-                    time_zone=self.time_zone
-                )
-                
-                # 记录执行结果
-                if success:
-                    self.log(f"Timer executed successfully: {entity_id} - {timer['action'].get('description', '')}")
-                else:
-                    self.log(f"Timer execution failed: {entity_id}", level="ERROR")
-                
-            except Exception as e:
-                self.log(f"Failed to execute timer: {e}", level="ERROR")
-                timer["status"] = "error"
-                timer["error"] = str(e)
-                self.save_tasks()
+            self.log(f"Failed to execute timer: {plan['error']}", level="ERROR")
+            self.finish_task(timer_id, TaskStatus.ERROR, error=plan["error"])
+            self.save_tasks(timer_id)
+            return
+        
+        if timer.attempts:
+            # 重试后成功
+            self.record_attempt(timer, None)
+            self.retry_stats["succeeded"] += 1
+        
+        # 更新状态
+        success = plan["action"].get("type") == "service_call"
+        if success:
+            self.finish_task(timer_id, TaskStatus.COMPLETED, executed_ts=int(time.time()))
+        else:
+            self.finish_task(timer_id, TaskStatus.FAILED)
+        
+        # 清理
+        if entity_id in self.entity_timers:
+            del self.entity_timers[entity_id]
+        self.unschedule_task(timer_id)
+        
+        self.save_tasks(timer_id)
+        
+        # 发送通知
+        description = timer.action.get("description", "")
+        self.fire_event(
+            "timer_backend_response",
+            action="timer_completed",
+            timer_id=timer_id,
+            entity_id=entity_id,
+            entity_name=timer.entity_name,
+            success=success,
+            action_description=description,
+            message=f"{'Climate timer' if timer.is_climate else 'Timer'} executed for {timer.entity_name}",
+            time_zone=self.time_zone,
+            **self.build_group_fields(timer)
+        )
+        
+        # 记录执行结果
+        if success:
+            self.log(f"Timer executed successfully: {entity_id} - {description}")
+        else:
+            self.log(f"Timer execution failed: {entity_id}", level="ERROR")
+    
+    def record_attempt(self, task: Task, error: Optional[str]):
+        """在任务上记录一次执行尝试（只在出现过失败时记录）"""
+        attempts = task.attempts or []
+        attempts.append({"attempt": len(attempts) + 1, "at": int(time.time()), "error": error})
+        task.attempts = attempts
+    
+    def schedule_retry(self, timer_id: str, timer: Timer, kind: str) -> bool:
+        """定时器执行失败后按指数退避（带抖动）将其重新加入到期队列，返回是否已安排重试
+        
+        尝试次数达到retry_max_attempts，或重试时间比原定执行时间晚retry_max_lateness秒以上时不再重试。
+        """
+        failures = sum(1 for attempt in timer.attempts or [] if attempt.get("error") is not None)
+        if failures >= self.retry_max_attempts:
+            self.retry_stats["exhausted"] += 1
+            return False
+        
+        delay = min(self.retry_backoff_max, self.retry_backoff * 2 ** (failures - 1))
+        delay *= 1 + random.uniform(-self.retry_jitter, self.retry_jitter)
+        retry_at = time.time() + delay
+        if timer.end_ts is not None and retry_at - timer.end_ts > self.retry_max_lateness:
+            self.retry_stats["exhausted"] += 1
+            self.log(f"Not retrying timer {timer_id}: retry would exceed max lateness", level="WARNING")
+            return False
+        
+        # 在事件循环中执行，唤醒由执行回调统一设置
+        self.schedule_task(timer_id, retry_at, kind, arm=False)
+        self.retry_stats["scheduled"] += 1
+        self.record_change(timer_id, "updated")
+        self.save_tasks(timer_id)
+        self.log(f"Timer {timer_id} failed ({timer.attempts[-1]['error']}), "
+                 f"retry {failures}/{self.retry_max_attempts - 1} in {delay:.1f}s", level="WARNING")
+        return True
     
     def terminate(self):
         """应用终止"""
-        self.save_tasks()
+        # 同步写入所有待保存的变更，再压缩存储
+        try:
+            self.persist_writer.close()
+        except Exception as e:
+            self.log(f"Failed to flush pending task changes: {e}", level="ERROR")
+        # SQLite等逐行写入的存储没有可压缩的数据，不需要为压缩加载全部历史
+        if self.store.can_compact():
+            self.compact_tasks({})
+        self.store.close()
+        
+        stats = self.persist_writer.stats()
+        self.log(f"Persistence stats: {stats['requests']} save requests, {stats['writes']} writes, {stats['coalesced']} coalesced")
         self.log("Timer backend stopped")
\ No newline at end of file